@@ -0,0 +1,314 @@
+"""Columnar analytics over compacted bypass logs.
+
+A background job periodically compacts the raw logs into one Parquet
+segment per day (``<ANALYTICS_DIR>/day=2026-10-18/segment.parquet``). A
+segment holds hourly aggregates (hour, domain, action, events, successes)
+instead of the events themselves, so a year of history is a few hundred
+small files whatever the traffic. Logs are read through the storage
+repository, so compaction works on every storage backend.
+
+Queries load the segments covering the requested range (cached in memory
+until a segment file changes) and aggregate them with vectorized pandas
+group-bys. Long-range time series never touch the operational database.
+The most recent events are included once the next compaction has run:
+today's segment is rewritten by every run.
+
+Several server workers may share the directory: a run holds an exclusive
+file lock on it (``fcntl.flock``, so POSIX only; elsewhere runs are only
+serialized within a process) and temporary files are named per process.
+"""
+import asyncio
+import json
+import os
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock
+    fcntl = None
+
+try:
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Analytics are optional, like Parquet export
+    np = pd = pa = pq = None
+
+
+SEGMENT_FIELDS = ['timestamp', 'domain', 'action', 'success']
+INTERVALS = {'hour': 'h', 'day': 'D'}
+GROUP_BY = ('domain', 'action')
+MANIFEST = '_manifest.json'
+LOCK_FILE = '_compaction.lock'
+LOCK_POLL_INTERVAL = 0.5
+DAY_FORMAT = '%Y-%m-%d'
+# Events still in the write-behind buffer when a run starts are picked up by the next one
+LATE_EVENTS = timedelta(hours=1)
+
+
+def available() -> bool:
+    return pq is not None
+
+
+def _schema():
+    return pa.schema([
+        ('hour', pa.timestamp('ms')),
+        ('domain', pa.dictionary(pa.int32(), pa.string())),
+        ('action', pa.dictionary(pa.int32(), pa.string())),
+        ('events', pa.int64()),
+        ('successes', pa.int64()),
+    ])
+
+
+def _day_start(value: datetime) -> datetime:
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _naive_utc(value: datetime) -> "pd.Timestamp":
+    value = pd.Timestamp(value)
+    return value.tz_convert(None) if value.tzinfo is not None else value
+
+
+def aggregate_batch(batch: List[Dict[str, Any]]) -> "pd.DataFrame":
+    """Hourly (domain, action) counts of one batch of log documents"""
+    frame = pd.DataFrame.from_records(batch, columns=SEGMENT_FIELDS)
+    frame['hour'] = pd.to_datetime(frame['timestamp']).dt.floor('h')
+    frame['events'] = 1
+    frame['successes'] = frame['success'].fillna(True).astype('int64')
+    return frame.groupby(['hour', 'domain', 'action'], sort=False)[['events', 'successes']].sum().reset_index()
+
+
+def _combine(partials: List["pd.DataFrame"]) -> "pd.DataFrame":
+    if not partials:
+        return pd.DataFrame({
+            'hour': pd.Series(dtype='datetime64[ms]'), 'domain': pd.Series(dtype='object'),
+            'action': pd.Series(dtype='object'), 'events': pd.Series(dtype='int64'),
+            'successes': pd.Series(dtype='int64'),
+        })
+    frame = pd.concat(partials, ignore_index=True)
+    return frame.groupby(['hour', 'domain', 'action'])[['events', 'successes']].sum().reset_index()
+
+
+class SegmentStore:
+    """Day-partitioned Parquet segments with an in-memory cache of decoded frames"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        # Day -> (file mtime, frame)
+        self._cache: Dict[str, Tuple[int, "pd.DataFrame"]] = {}
+        # Last concatenated range, keyed by its days and their mtimes
+        self._range: Tuple[Tuple, Optional["pd.DataFrame"]] = ((), None)
+
+    def path_for(self, day: str) -> Path:
+        return self.directory / f"day={day}" / "segment.parquet"
+
+    def days(self) -> List[str]:
+        if not self.directory.exists():
+            return []
+        return sorted(
+            entry.name[len('day='):] for entry in self.directory.iterdir()
+            if entry.name.startswith('day=') and (entry / 'segment.parquet').exists()
+        )
+
+    def write(self, day: str, frame: "pd.DataFrame"):
+        """Replace the segment of ``day`` atomically"""
+        path = self.path_for(day)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        table = pa.Table.from_pandas(frame, schema=_schema(), preserve_index=False)
+        temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        pq.write_table(table, temporary, compression='zstd')
+        os.replace(temporary, path)
+
+    def load(self, day: str) -> Optional["pd.DataFrame"]:
+        path = self.path_for(day)
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._cache.pop(day, None)
+            return None
+        cached = self._cache.get(day)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        # Plain string columns: per-day dictionaries would make every concat re-unify categories
+        frame = pq.read_table(path).to_pandas().astype({'domain': object, 'action': object})
+        self._cache[day] = (mtime, frame)
+        return frame
+
+    def load_range(self, days: List[str]) -> Optional["pd.DataFrame"]:
+        """Segments of ``days`` concatenated, or None when none has data"""
+        frames = [(day, self.load(day)) for day in days]
+        frames = [(day, frame) for day, frame in frames if frame is not None and len(frame)]
+        if not frames:
+            return None
+        signature = tuple((day, self._cache[day][0]) for day, _ in frames)
+        if self._range[0] != signature:
+            self._range = (signature, pd.concat([frame for _, frame in frames], ignore_index=True))
+        return self._range[1]
+
+    def read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.directory / MANIFEST) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def write_manifest(self, manifest: Dict[str, Any]):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temporary = self.directory / f"{MANIFEST}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temporary, self.directory / MANIFEST)
+
+    def try_lock(self) -> Optional[int]:
+        """Take the compaction lock without blocking: its file descriptor, or None if another process holds it"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.directory / LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return None
+        return fd
+
+    def unlock(self, fd: int):
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+    @property
+    def compacted_through(self) -> Optional[datetime]:
+        value = self.read_manifest().get('compacted_through')
+        return datetime.fromisoformat(value) if value else None
+
+    def segments(self) -> List[Dict[str, Any]]:
+        segments = []
+        for day in self.days():
+            path = self.path_for(day)
+            segments.append({
+                'day': day,
+                'rows': pq.ParquetFile(path).metadata.num_rows,
+                'bytes': path.stat().st_size,
+            })
+        return segments
+
+
+async def compact(logs, store: SegmentStore, now: datetime, batch_size: int = 20000) -> List[str]:
+    """Rewrite the segments from the last compacted day through today.
+
+    Older days are final, since events are stamped with the server clock when
+    they are logged and written within ``LATE_EVENTS``. Aggregation and file
+    writes run in worker threads, off the event loop. Waits while another
+    process compacts the same store.
+    """
+    while (lock := await asyncio.to_thread(store.try_lock)) is None:
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+    try:
+        return await _compact(logs, store, now, batch_size)
+    finally:
+        store.unlock(lock)
+
+
+async def _compact(logs, store: SegmentStore, now: datetime, batch_size: int) -> List[str]:
+    start = await asyncio.to_thread(lambda: store.compacted_through)
+    if start is not None:
+        start -= LATE_EVENTS
+    else:
+        # First run: start from the oldest event
+        async with aclosing(logs.batches(None, None, ['timestamp'], 1)) as batches:
+            async for batch in batches:
+                start = batch[0]['timestamp']
+                break
+        if start is None:
+            await asyncio.to_thread(store.write_manifest, {'compacted_through': now.isoformat()})
+            return []
+
+    written = []
+    day = _day_start(start)
+    while day <= now:
+        day_end = min(day + timedelta(days=1), now)
+        partials = []
+        async for batch in logs.batches(day, day_end, SEGMENT_FIELDS, batch_size):
+            partials.append(await asyncio.to_thread(aggregate_batch, batch))
+        await asyncio.to_thread(lambda: store.write(day.strftime(DAY_FORMAT), _combine(partials)))
+        written.append(day.strftime(DAY_FORMAT))
+        day += timedelta(days=1)
+    await asyncio.to_thread(store.write_manifest, {'compacted_through': now.isoformat()})
+    return written
+
+
+def timeseries(
+    store: SegmentStore,
+    start: datetime,
+    end: datetime,
+    interval: str = 'hour',
+    by: Optional[str] = None,
+    domain: Optional[str] = None,
+    action: Optional[str] = None,
+    top: int = 10
+) -> List[Dict[str, Any]]:
+    """Event counts and success rates per ``interval`` in ``[start, end)``.
+
+    With ``by`` ('domain' or 'action') there is one series per value, limited
+    to the ``top`` values with the most events in the range. Buckets without
+    events are omitted.
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"Unknown interval '{interval}' (expected one of: {', '.join(INTERVALS)})")
+    if by is not None and by not in GROUP_BY:
+        raise ValueError(f"Cannot group by '{by}' (expected one of: {', '.join(GROUP_BY)})")
+    start, end = _naive_utc(start), _naive_utc(end)
+    if start >= end:
+        raise ValueError("Range start must be before its end")
+
+    days = []
+    day = _day_start(start)
+    while day < end:
+        days.append(day.strftime(DAY_FORMAT))
+        day += timedelta(days=1)
+    frame = store.load_range(days)
+    if frame is None:
+        return []
+
+    mask = (frame['hour'] >= start.floor('h')) & (frame['hour'] < end)
+    if domain is not None:
+        mask &= frame['domain'] == domain
+    if action is not None:
+        mask &= frame['action'] == action
+    frame = frame[mask]
+    if frame.empty:
+        return []
+
+    bucket = frame['hour'].dt.floor(INTERVALS[interval]).rename('time')
+    if by is None:
+        keys = pd.Series('all', index=frame.index, name='key')
+    else:
+        keys = frame[by].astype(str).rename('key')
+        totals = frame.groupby(keys, observed=True)['events'].sum()
+        leaders = totals.sort_values(ascending=False, kind='stable').head(top).index
+        selected = keys.isin(leaders)
+        frame, keys, bucket = frame[selected], keys[selected], bucket[selected]
+
+    grouped = frame.groupby([keys, bucket], observed=True)[['events', 'successes']].sum()
+    events = grouped['events'].to_numpy()
+    successes = grouped['successes'].to_numpy()
+    rates = np.round(successes * 100 / events, 2)
+    times = np.datetime_as_string(grouped.index.get_level_values('time').to_numpy(), unit='s')
+    group_keys = grouped.index.get_level_values('key').to_numpy()
+
+    # Rows are sorted by key then time, so each series is a contiguous slice
+    bounds = np.flatnonzero(group_keys[1:] != group_keys[:-1]) + 1
+    starts, ends = [0, *bounds.tolist()], [*bounds.tolist(), len(group_keys)]
+    points = [
+        {'time': time, 'events': count, 'successes': success, 'success_rate': rate}
+        for time, count, success, rate in zip(times.tolist(), events.tolist(), successes.tolist(), rates.tolist())
+    ]
+    series = [
+        {'key': group_keys[first], 'events': int(events[first:last].sum()), 'points': points[first:last]}
+        for first, last in zip(starts, ends)
+    ]
+    series.sort(key=lambda item: item['events'], reverse=True)
+    return series
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of response serialization per endpoint: FastAPI's default
+path (response_model validation, jsonable_encoder, json.dumps) against the
+FAST_JSON path (orjson on the trusted documents).
+
+Payloads are synthetic documents shaped like what each route reads from
+MongoDB, so no database is needed. CPU time is measured per request.
+
+    python bench_json.py --rows 100 1000 --repeat 200 --output bench_json.json
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+import fast_json
+import server
+
+
+def status_documents(rows):
+    now = datetime.utcnow()
+    return [
+        {"id": str(uuid.uuid4()), "client_name": f"client-{i}", "timestamp": now - timedelta(seconds=i)}
+        for i in range(rows)
+    ]
+
+
+def site_documents(rows):
+    return [
+        {
+            "domain": f"site{i}.fr",
+            "user_agent": "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+            "referer": "https://www.google.com/",
+            "cookies_to_remove": ["paywall", "subscriber", "metered"],
+            "headers_to_modify": {"X-Forwarded-For": "66.249.66.1"},
+            "selectors_to_remove": [".paywall", ".subscription-wall"],
+            "enabled": True,
+            "version": i,
+        }
+        for i in range(rows)
+    ]
+
+
+def stats_document(rows):
+    return server.BypassStats(
+        total_bypasses=rows * 1000,
+        bypasses_today=rows * 10,
+        bypasses_this_week=rows * 50,
+        most_bypassed_sites=[{"domain": f"site{i}.fr", "count": 1000 - i} for i in range(5)],
+        success_rate=93.5,
+    )
+
+
+def as_status_models(documents):
+    return [server.StatusCheck(**document) for document in documents]
+
+
+def unchanged(content):
+    return content
+
+
+# Endpoint -> (payload as read from MongoDB, what the default handler returns for it)
+ENDPOINTS = {
+    "/api/status": (status_documents, as_status_models),
+    "/api/supported-sites": (site_documents, unchanged),
+    "/api/bypass-stats": (stats_document, unchanged),
+}
+
+
+def response_field(path):
+    for route in server.app.routes:
+        if getattr(route, "path", None) == path and "GET" in route.methods:
+            return route.response_field
+    raise LookupError(path)
+
+
+async def standard_body(field, prepare, content):
+    encoded = await serialize_response(field=field, response_content=prepare(content))
+    return JSONResponse(encoded).body
+
+
+async def fast_body(field, prepare, content):
+    return fast_json.FastJSONResponse(content).body
+
+
+async def cpu_times(render, field, prepare, content, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.process_time()
+        await render(field, prepare, content)
+        durations.append(time.process_time() - started)
+    return durations
+
+
+async def run(args):
+    report = []
+    for path, (make_payload, prepare) in ENDPOINTS.items():
+        field = response_field(path)
+        for rows in args.rows:
+            content = make_payload(rows)
+            same = json.loads(await standard_body(field, prepare, content)) == \
+                json.loads(await fast_body(field, prepare, content))
+            standard_times = await cpu_times(standard_body, field, prepare, content, args.repeat)
+            fast_times = await cpu_times(fast_body, field, prepare, content, args.repeat)
+            entry = {
+                "endpoint": path,
+                "rows": rows,
+                "standard_median_ms": statistics.median(standard_times) * 1000,
+                "fast_median_ms": statistics.median(fast_times) * 1000,
+                "saving_ms": (statistics.median(standard_times) - statistics.median(fast_times)) * 1000,
+                "bodies_match": same,
+            }
+            report.append(entry)
+            print(f"{path:<22} {rows:>6} rows  standard {entry['standard_median_ms']:.3f}ms  "
+                  f"fast {entry['fast_median_ms']:.3f}ms  saving {entry['saving_ms']:.3f}ms  "
+                  f"match={entry['bodies_match']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def main():
+    if not fast_json.available():
+        raise SystemExit("bench_json.py needs orjson installed")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
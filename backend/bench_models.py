@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark the per-event model work of POST /api/bypass-log: request body
+validation, building the stored document and rendering the response.
+
+``legacy`` is the original pydantic v1-style path (two validations and two
+``.dict()`` copies per event). ``current`` is the path in server.py, and
+``current+fast_json`` adds the FAST_JSON response. Results are events per
+second on a single core (CPU time, no database involved).
+
+    python bench_models.py --events 100000 --output bench_models.json
+"""
+import argparse
+import asyncio
+import json
+import time
+import warnings
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+import fast_json
+import server
+from server import BypassLog, BypassLogCreate
+
+
+PAYLOAD = {
+    "action": "header_modified",
+    "domain": "lefigaro.fr",
+    "url": "https://www.lefigaro.fr/politique/article-123456",
+    "user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36",
+    "success": True,
+}
+
+
+def response_field():
+    for route in server.app.routes:
+        if getattr(route, "path", None) == "/api/bypass-log" and "POST" in route.methods:
+            return route.response_field
+    raise LookupError("/api/bypass-log")
+
+
+async def legacy(field, payload):
+    log_data = BypassLogCreate(**payload)
+    log_obj = BypassLog(**log_data.dict())
+    document = log_obj.dict()
+    body = JSONResponse(await serialize_response(field=field, response_content=log_obj)).body
+    return document, body
+
+
+async def current(field, payload):
+    log_obj = BypassLog.from_create(BypassLogCreate.model_validate(payload))
+    document = log_obj.model_dump()
+    body = JSONResponse(await serialize_response(field=field, response_content=log_obj)).body
+    return document, body
+
+
+async def current_fast_json(field, payload):
+    log_obj = BypassLog.from_create(BypassLogCreate.model_validate(payload))
+    document = log_obj.model_dump()
+    return document, fast_json.FastJSONResponse(log_obj).body
+
+
+async def events_per_second(path, field, events):
+    started = time.process_time()
+    for _ in range(events):
+        await path(field, PAYLOAD)
+    return events / (time.process_time() - started)
+
+
+async def run(args):
+    field = response_field()
+    paths = {"legacy": legacy, "current": current}
+    if fast_json.available():
+        paths["current+fast_json"] = current_fast_json
+
+    report = {}
+    for name, path in paths.items():
+        await events_per_second(path, field, min(args.events, 1000))  # warm up
+        report[name] = await events_per_second(path, field, args.events)
+        print(f"{name:<18} {report[name]:>10,.0f} events/s/core  x{report[name] / report['legacy']:.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+    # .dict() is deprecated in pydantic v2; the legacy path uses it on purpose
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Benchmark the single-pass $facet stats engine against the legacy
+five-round-trip implementation of /api/bypass-stats.
+
+Requires a MongoDB reachable through MONGO_URL (defaults to localhost);
+MONGO_URL=memory:// runs it offline against the in-process stand-in.
+Each size is seeded into its own collection, which is kept between runs
+unless --drop is given, so the expensive 100M seeding only happens once.
+
+    python bench_stats.py --sizes 1000000 10000000 100000000 --repeat 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import database
+import stats_engine
+
+
+DOMAINS = ["lefigaro.fr", "lemonde.fr", "liberation.fr", "leparisien.fr", "lesechos.fr",
+           "mediapart.fr", "nouvelobs.com", "lexpress.fr", "lepoint.fr", "telerama.fr"]
+ACTIONS = ["header_modified", "cookies_cleared", "paywall_detected", "test_bypass"]
+
+
+async def legacy_stats(collection, now):
+    """The original get_bypass_stats implementation (five round trips)"""
+    total_bypasses = await collection.count_documents({})
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    bypasses_today = await collection.count_documents({"timestamp": {"$gte": today_start}})
+    week_start = today_start - timedelta(days=today_start.weekday())
+    bypasses_this_week = await collection.count_documents({"timestamp": {"$gte": week_start}})
+    pipeline = [
+        {"$group": {"_id": "$domain", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}},
+        {"$limit": 5}
+    ]
+    most_bypassed_sites = []
+    async for doc in collection.aggregate(pipeline):
+        most_bypassed_sites.append({"domain": doc["_id"], "count": doc["count"]})
+    successful_bypasses = await collection.count_documents({"success": True})
+    success_rate = (successful_bypasses / total_bypasses * 100) if total_bypasses > 0 else 0
+    return {
+        "total_bypasses": total_bypasses,
+        "bypasses_today": bypasses_today,
+        "bypasses_this_week": bypasses_this_week,
+        "most_bypassed_sites": most_bypassed_sites,
+        "success_rate": round(success_rate, 2),
+    }
+
+
+async def seed(collection, size, days, batch_size=10000):
+    """Insert `size` synthetic logs spread over the last `days` days"""
+    existing = await collection.estimated_document_count()
+    if existing >= size:
+        return
+    rng = random.Random(size)
+    now = datetime.utcnow()
+    remaining = size - existing
+    while remaining > 0:
+        count = min(batch_size, remaining)
+        await collection.insert_many([
+            {
+                "id": f"bench-{existing + i}",
+                "action": rng.choice(ACTIONS),
+                "domain": rng.choice(DOMAINS),
+                "url": f"https://{rng.choice(DOMAINS)}/article/{rng.randrange(10**6)}",
+                "timestamp": now - timedelta(seconds=rng.randrange(days * 86400)),
+                "user_agent": None,
+                "success": rng.random() < 0.9,
+            }
+            for i in range(count)
+        ], ordered=False)
+        existing += count
+        remaining -= count
+    await collection.create_index([("timestamp", 1)])
+
+
+async def time_call(func, repeat):
+    durations = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await func()
+        durations.append(time.perf_counter() - started)
+    return result, durations
+
+
+async def run(args):
+    client = database.create_client(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[args.db_name]
+    report = []
+    try:
+        for size in args.sizes:
+            collection = db[f"bypass_logs_{size}"]
+            if args.drop:
+                await collection.drop()
+            print(f"Seeding {size:,} documents...")
+            await seed(collection, size, args.days)
+
+            now = datetime.utcnow()
+            legacy, legacy_times = await time_call(lambda: legacy_stats(collection, now), args.repeat)
+            facet, facet_times = await time_call(lambda: stats_engine.compute_stats(collection, now), args.repeat)
+
+            entry = {
+                "documents": size,
+                "legacy_median_s": statistics.median(legacy_times),
+                "facet_median_s": statistics.median(facet_times),
+                "speedup": statistics.median(legacy_times) / statistics.median(facet_times),
+                "results_match": legacy == facet,
+            }
+            report.append(entry)
+            print(f"{size:>12,} docs  legacy {entry['legacy_median_s']:.3f}s  "
+                  f"facet {entry['facet_median_s']:.3f}s  x{entry['speedup']:.2f}  "
+                  f"match={entry['results_match']}")
+    finally:
+        client.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000, 10_000_000, 100_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--days", type=int, default=90, help="Spread of synthetic timestamps")
+    parser.add_argument("--db-name", default="bypass_stats_benchmark")
+    parser.add_argument("--drop", action="store_true", help="Re-seed collections from scratch")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""In-process LRU/TTL cache for rendered site configuration responses.
+
+Entries hold the already-encoded JSON body together with its strong ETag, so
+a cache hit costs neither a database read nor a serialization pass, and
+clients revalidating with ``If-None-Match`` can be answered with a 304.
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, NamedTuple, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def render_response(value: Any) -> CachedResponse:
+    """Encode a value the way JSONResponse does and compute its strong ETag"""
+    body = json.dumps(
+        jsonable_encoder(value),
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return CachedResponse(body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match header against an ETag (weak comparison, RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (candidate.strip() for candidate in if_none_match.split(","))
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+def accepts_encoding(accept_encoding: Optional[str], coding: str) -> bool:
+    """Whether an Accept-Encoding header allows a content coding (``q=0`` refuses it, RFC 9110)"""
+    qualities = {}
+    for entry in (accept_encoding or "").split(","):
+        name, _, parameters = entry.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            key, _, value = parameter.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    quality = qualities.get(coding, qualities.get("*", 0.0))
+    return quality > 0
+
+
+class TTLCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self._clock():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> Any:
+        self._entries[key] = (self._clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Drop one entry, or everything when no key is given"""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
@@ -0,0 +1,101 @@
+"""Versioned, precompressed snapshots of every site configuration.
+
+Each write to ``site_configs`` stamps the document with a ``version`` taken
+from a cluster-wide counter (``counters._id == "site_configs"``), so versions
+increase monotonically across workers and replicas. Clients download the full
+snapshot once, then ask for the configs whose version is greater than the one
+they hold.
+
+A delta can't express a removal, so deleting a config (through
+``record_config_deletion``) also takes a version and stores it as the
+counter's ``deleted_version``: clients whose version predates it are told to
+fetch a full snapshot instead.
+"""
+import gzip
+import hashlib
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from pymongo import ReturnDocument
+
+from config_cache import render_response
+
+
+COUNTER_ID = 'site_configs'
+
+
+async def next_config_version(db) -> int:
+    counter = await db.counters.find_one_and_update(
+        {'_id': COUNTER_ID},
+        {'$inc': {'seq': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter['seq']
+
+
+async def record_config_deletion(db) -> int:
+    """Take a version for configs deleted just before; returns that version"""
+    version = await next_config_version(db)
+    await db.counters.update_one({'_id': COUNTER_ID}, {'$max': {'deleted_version': version}})
+    return version
+
+
+async def deleted_version(db) -> int:
+    counter = await db.counters.find_one({'_id': COUNTER_ID}) or {}
+    return counter.get('deleted_version', 0)
+
+
+def needs_full_resync(since: int, version: int, deleted_version: int) -> bool:
+    """Whether a client holding version ``since`` can't catch up with a delta"""
+    # Ahead of the server (e.g. after a restore), or behind a deletion
+    return since > version or since < deleted_version
+
+
+def _strip_id(document: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in document.items() if key != '_id'}
+
+
+def current_version(documents: List[Dict[str, Any]]) -> int:
+    return max((document.get('version', 0) for document in documents), default=0)
+
+
+def changed_since(documents: List[Dict[str, Any]], since: int) -> List[Dict[str, Any]]:
+    changed = [_strip_id(document) for document in documents if document.get('version', 0) > since]
+    return sorted(changed, key=lambda document: document.get('version', 0))
+
+
+class ConfigSnapshot(NamedTuple):
+    version: int
+    etag: str
+    body: bytes
+    gzipped_body: bytes
+    # The gzipped body is another representation, so it needs its own strong ETag
+    gzip_etag: str
+
+
+def build_snapshot(documents: List[Dict[str, Any]], deleted_version: int = 0) -> ConfigSnapshot:
+    sites = sorted((_strip_id(document) for document in documents), key=lambda document: document['domain'])
+    version = max(current_version(sites), deleted_version)
+    body = render_response({'version': version, 'sites': sites}).body
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    return ConfigSnapshot(
+        version, f'"v{version}-{digest}"', body, gzip.compress(body, compresslevel=9), f'"v{version}-{digest}-gzip"'
+    )
+
+
+class SnapshotHolder:
+    """Keeps the last built snapshot until the site config table changes"""
+
+    def __init__(self):
+        self._snapshot: Optional[ConfigSnapshot] = None
+        # Last deletion version the snapshot was built with
+        self.deleted_version = 0
+
+    def invalidate(self, domain: Optional[str] = None):
+        self._snapshot = None
+
+    def get(self, documents_loader, deleted_version: int = 0) -> ConfigSnapshot:
+        if self._snapshot is None or deleted_version != self.deleted_version:
+            self._snapshot = build_snapshot(documents_loader(), deleted_version)
+            self.deleted_version = deleted_version
+        return self._snapshot
@@ -0,0 +1,193 @@
+"""Keep an in-memory copy of ``site_configs`` in sync across workers.
+
+``SiteConfigTable`` holds every site configuration keyed by domain. Readers
+call ``get`` without locking: writers build new dicts and swap them in, and
+everything runs on the event loop thread.
+
+``SiteConfigWatcher`` loads the table once, then follows a MongoDB change
+stream so writes made by any worker or replica reach every process within a
+bounded delay. Standalone servers do not support change streams; there the
+watcher falls back to reloading the (small) collection every
+``poll_interval`` seconds.
+
+The table also holds the last config deletion version, so snapshot and delta
+requests don't read the counter. A deletion's version is recorded just after
+the document is removed: between the change event and the refreshed counter
+the table reports ``deletion_pending`` and readers must ask the database.
+"""
+import asyncio
+import copy
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+
+logger = logging.getLogger(__name__)
+
+# Error codes meaning "change streams are not available on this deployment"
+CHANGE_STREAM_UNSUPPORTED = {40573, 40324, 136}
+
+
+class SiteConfigTable:
+    def __init__(self):
+        self._by_domain: Dict[str, Dict[str, Any]] = {}
+        self._domain_by_id: Dict[Any, str] = {}
+        self._listeners: List[Callable[[Optional[str]], None]] = []
+        self.loaded = False
+        self.deleted_version = 0
+        self.deletion_pending = False
+
+    def add_listener(self, listener: Callable[[Optional[str]], None]):
+        """Call ``listener(domain)`` on every change, ``listener(None)`` on reload"""
+        self._listeners.append(listener)
+
+    def _notify(self, domain: Optional[str]):
+        for listener in self._listeners:
+            try:
+                listener(domain)
+            except Exception as e:
+                logger.error(f"Site config listener failed: {e}")
+
+    def get(self, domain: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the config for a domain (without ``_id``)"""
+        config = self._by_domain.get(domain)
+        return copy.deepcopy(config) if config is not None else None
+
+    def all(self) -> List[Dict[str, Any]]:
+        return [copy.deepcopy(config) for config in self._by_domain.values()]
+
+    def replace_all(self, documents: List[Dict[str, Any]]):
+        by_domain, domain_by_id = {}, {}
+        for document in documents:
+            document = dict(document)
+            _id = document.pop('_id', None)
+            by_domain[document['domain']] = document
+            domain_by_id[_id] = document['domain']
+        if by_domain == self._by_domain and self.loaded:
+            return
+        self._by_domain, self._domain_by_id = by_domain, domain_by_id
+        self.loaded = True
+        self._notify(None)
+
+    def upsert(self, document: Dict[str, Any]):
+        document = dict(document)
+        _id = document.pop('_id', None)
+        by_domain = dict(self._by_domain)
+        previous_domain = self._domain_by_id.get(_id)
+        if previous_domain is not None and previous_domain != document['domain']:
+            # The document was renamed to another domain
+            by_domain.pop(previous_domain, None)
+        by_domain[document['domain']] = document
+        self._by_domain = by_domain
+        if _id is not None:
+            self._domain_by_id = {**self._domain_by_id, _id: document['domain']}
+        if previous_domain is not None and previous_domain != document['domain']:
+            self._notify(previous_domain)
+        self._notify(document['domain'])
+
+    def set_deleted_version(self, version: int):
+        """Record the latest deletion version (they only grow)"""
+        if version <= self.deleted_version:
+            return
+        self.deleted_version = version
+        self.deletion_pending = False
+        self._notify(None)
+
+    def remove_by_id(self, _id: Any):
+        domain = self._domain_by_id.get(_id)
+        if domain is None:
+            return
+        self._by_domain = {key: value for key, value in self._by_domain.items() if key != domain}
+        self._domain_by_id = {key: value for key, value in self._domain_by_id.items() if key != _id}
+        self._notify(domain)
+
+
+class SiteConfigWatcher:
+    def __init__(
+        self,
+        collection,
+        table: SiteConfigTable,
+        poll_interval: float = 5.0,
+        retry_delay: float = 1.0,
+        load_deleted_version: Optional[Callable[[], Awaitable[int]]] = None
+    ):
+        self.collection = collection
+        self.table = table
+        self.load_deleted_version = load_deleted_version
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.mode = 'stopped'
+        # Last change seen, kept when the stream breaks so it resumes after it
+        self.resume_token = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def reload(self):
+        documents = await self.collection.find({}).to_list(None)
+        self.table.replace_all(documents)
+        if self.load_deleted_version is not None:
+            self.table.set_deleted_version(await self.load_deleted_version())
+
+    async def start(self):
+        """Load the table, then keep it up to date in the background"""
+        await self.reload()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self.mode = 'stopped'
+
+    async def _run(self):
+        while True:
+            try:
+                self.mode = 'change_stream'
+                await self._follow_change_stream()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAM_UNSUPPORTED:
+                    logger.info("Change streams unavailable, polling site configs instead")
+                    await self._poll()
+                    return
+                logger.error(f"Site config change stream failed: {e}")
+                self.resume_token = None
+            except PyMongoError as e:
+                logger.error(f"Site config change stream interrupted: {e}")
+
+            # Anything may have changed while we were disconnected
+            await asyncio.sleep(self.retry_delay)
+            try:
+                await self.reload()
+            except PyMongoError as e:
+                logger.error(f"Failed to reload site configs: {e}")
+
+    async def _follow_change_stream(self):
+        async with self.collection.watch(full_document='updateLookup', resume_after=self.resume_token) as stream:
+            async for change in stream:
+                self.resume_token = stream.resume_token
+                operation = change['operationType']
+                if operation in ('insert', 'replace', 'update') and change.get('fullDocument'):
+                    self.table.upsert(change['fullDocument'])
+                elif operation == 'delete':
+                    self.table.deletion_pending = True
+                    self.table.remove_by_id(change['documentKey']['_id'])
+                elif operation in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+                    self.resume_token = None
+                    await self.reload()
+                    return
+
+    async def _poll(self):
+        self.mode = 'polling'
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.reload()
+            except PyMongoError as e:
+                logger.error(f"Failed to poll site configs: {e}")
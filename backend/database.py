@@ -0,0 +1,173 @@
+"""MongoDB client construction, connection pool tuning and pool statistics.
+
+Pool settings come from the environment so they can be sized per worker
+count without code changes:
+
+- ``MONGO_MAX_POOL_SIZE`` / ``MONGO_MIN_POOL_SIZE``: connections per server
+- ``MONGO_MAX_IDLE_TIME_MS``: close idle connections after this long
+- ``MONGO_WAIT_QUEUE_TIMEOUT_MS``: how long a request may wait for a connection
+- ``MONGO_CONNECT_TIMEOUT_MS`` / ``MONGO_SOCKET_TIMEOUT_MS`` /
+  ``MONGO_SERVER_SELECTION_TIMEOUT_MS``: driver timeouts
+- ``MONGO_READ_PREFERENCE``: default read preference of the client
+
+Individual read paths can be routed elsewhere with
+``MONGO_<ROUTE>_READ_PREFERENCE`` and ``MONGO_<ROUTE>_MAX_STALENESS_SECONDS``
+(falling back to ``MONGO_MAX_STALENESS_SECONDS``), see ``read_route``.
+
+``MONGO_URL=memory://`` swaps Motor for the in-process stand-in in
+``memory_db`` (for benchmarks and offline runs); pool options, listeners and
+read preferences are then ignored.
+"""
+import asyncio
+import os
+from typing import Any, Dict
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+
+import memory_db
+
+
+# Environment variable -> (client option, default)
+POOL_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': ('maxPoolSize', 100),
+    'MONGO_MIN_POOL_SIZE': ('minPoolSize', 10),
+    'MONGO_MAX_IDLE_TIME_MS': ('maxIdleTimeMS', 300000),
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': ('waitQueueTimeoutMS', 5000),
+    'MONGO_CONNECT_TIMEOUT_MS': ('connectTimeoutMS', 5000),
+    'MONGO_SOCKET_TIMEOUT_MS': ('socketTimeoutMS', 30000),
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': ('serverSelectionTimeoutMS', 10000),
+}
+
+READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+
+# MongoDB refuses maxStalenessSeconds below 90
+MIN_MAX_STALENESS = 90
+
+
+def client_options_from_env() -> Dict[str, Any]:
+    options = {
+        option: int(os.environ.get(variable, default))
+        for variable, (option, default) in POOL_OPTIONS.items()
+    }
+    options['readPreference'] = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+    return options
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters fed by the driver's CMAP events.
+
+    Events arrive on driver threads; each handler only bumps plain integers,
+    which is safe under the GIL and keeps the listener off the hot path.
+    """
+
+    def __init__(self):
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.checkouts_started = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkins = 0
+        self.pools_cleared = 0
+        self.peak_in_use = 0
+        self.peak_waiting = 0
+
+    @property
+    def in_use(self) -> int:
+        return self.checkouts - self.checkins
+
+    @property
+    def waiting(self) -> int:
+        return self.checkouts_started - self.checkouts - self.checkout_failures
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            'connections_open': self.connections_created - self.connections_closed,
+            'connections_created': self.connections_created,
+            'connections_closed': self.connections_closed,
+            'checkouts': self.checkouts,
+            'checkout_failures': self.checkout_failures,
+            'in_use': self.in_use,
+            'peak_in_use': self.peak_in_use,
+            'waiting': self.waiting,
+            'peak_waiting': self.peak_waiting,
+            'pools_cleared': self.pools_cleared,
+        }
+
+    def connection_created(self, event):
+        self.connections_created += 1
+
+    def connection_closed(self, event):
+        self.connections_closed += 1
+
+    def connection_check_out_started(self, event):
+        self.checkouts_started += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+
+    def connection_checked_out(self, event):
+        self.checkouts += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        self.checkins += 1
+
+    def pool_cleared(self, event):
+        self.pools_cleared += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+def create_client(mongo_url: str, *listeners, **overrides) -> AsyncIOMotorClient:
+    """Build the Motor client; no connection is made until first use or warm-up"""
+    if memory_db.is_memory_url(mongo_url):
+        return memory_db.MemoryClient(mongo_url)
+    options = {**client_options_from_env(), **overrides}
+    return AsyncIOMotorClient(mongo_url, event_listeners=list(listeners), **options)
+
+
+async def warm_up(client: AsyncIOMotorClient, connections: int):
+    """Run server discovery and open ``connections`` pooled connections up front"""
+    await client.admin.command('ping')
+    if connections > 1:
+        await asyncio.gather(*(client.admin.command('ping') for _ in range(connections)))
+
+
+def read_preference(mode: str, max_staleness: int = -1):
+    """Build a read preference; ``max_staleness`` of -1 means no bound"""
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference '{mode}' (expected one of: {', '.join(READ_PREFERENCES)})")
+    if mode == 'primary':
+        return Primary()
+    if max_staleness != -1:
+        max_staleness = max(max_staleness, MIN_MAX_STALENESS)
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+
+def read_route(route: str, default_mode: str = 'primary'):
+    """Read preference for one read path, configured by ``MONGO_<ROUTE>_*``"""
+    mode = os.environ.get(f'MONGO_{route}_READ_PREFERENCE', default_mode)
+    max_staleness = os.environ.get(
+        f'MONGO_{route}_MAX_STALENESS_SECONDS',
+        os.environ.get('MONGO_MAX_STALENESS_SECONDS', '120')
+    )
+    return read_preference(mode, int(max_staleness))
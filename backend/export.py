@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Streaming export of bypass logs as NDJSON or Parquet.
+
+Documents are read from a server-side cursor in batches with a projection,
+and each batch is encoded and handed to the caller before the next one is
+fetched, so exports of any size run in constant memory. The same generators
+back the /api/export/bypass-logs endpoint and the command line:
+
+    python export.py --start 2026-10-01 --end 2026-10-08 --format parquet -o logs.parquet
+
+The command line reads the logs through the same storage repositories as the
+API, configured by the same environment (``STORAGE_BACKEND``, ``MONGO_URL``
+and the ``MONGO_*`` pool options, ``LOG_ENCODING``, ``LOG_PARTITIONING``).
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import typer
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+
+import database
+from log_codec import PLAIN_CODEC, CompactLogCodec, LogCodec
+from partitions import LogPartitions
+
+try:
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pd = pa = pq = None
+
+
+EXPORT_FIELDS = ['id', 'action', 'domain', 'url', 'timestamp', 'user_agent', 'success']
+FORMATS = ('ndjson', 'parquet')
+DEFAULT_BATCH_SIZE = 5000
+
+
+def parquet_available() -> bool:
+    return pq is not None
+
+
+def _parquet_schema(fields: List[str]):
+    types = {
+        'id': pa.string(), 'action': pa.string(), 'domain': pa.string(), 'url': pa.string(),
+        'timestamp': pa.timestamp('ms'), 'user_agent': pa.string(), 'success': pa.bool_(),
+    }
+    return pa.schema([(field, types[field]) for field in fields])
+
+
+def validate_fields(fields: Optional[List[str]]) -> List[str]:
+    if not fields:
+        return list(EXPORT_FIELDS)
+    unknown = [field for field in fields if field not in EXPORT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown export fields: {', '.join(unknown)}")
+    return fields
+
+
+def time_range_query(
+    start: Optional[datetime],
+    end: Optional[datetime],
+    codec: LogCodec = PLAIN_CODEC
+) -> Dict[str, Any]:
+    bounds = {}
+    if start is not None:
+        bounds['$gte'] = start
+    if end is not None:
+        bounds['$lt'] = end
+    return {codec.field('timestamp'): bounds} if bounds else {}
+
+
+async def iter_log_batches(
+    collections,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    fields: List[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    codec: LogCodec = PLAIN_CODEC
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Yield lists of at most ``batch_size`` projected log documents.
+
+    ``collections`` is one collection or a list of time partitions (oldest
+    first), which are read one after the other. Documents are decoded with
+    ``codec`` so the output always uses the API field names.
+    """
+    if not isinstance(collections, (list, tuple)):
+        collections = [collections]
+    projection = {codec.field(field): 1 for field in fields}
+    projection.setdefault('_id', 0)
+    batch = []
+    for collection in collections:
+        cursor = collection.find(time_range_query(start, end, codec), projection) \
+            .sort(codec.field('timestamp'), 1).batch_size(batch_size)
+        async for document in cursor:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield await codec.decode_many(batch, fields)
+                batch = []
+    if batch:
+        yield await codec.decode_many(batch, fields)
+
+
+def _ndjson_lines(batch: List[Dict[str, Any]]) -> bytes:
+    return b''.join(
+        json.dumps(jsonable_encoder(document), ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+        for document in batch
+    )
+
+
+async def ndjson_chunks(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        yield await asyncio.to_thread(_ndjson_lines, batch)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object collecting bytes until they are taken"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+async def parquet_chunks(batches: AsyncIterator[List[Dict[str, Any]]], fields: List[str]) -> AsyncIterator[bytes]:
+    """Encode each batch as one Parquet row group and yield the bytes written so far"""
+    if not parquet_available():
+        raise RuntimeError("Parquet export requires pandas and pyarrow")
+    schema = _parquet_schema(fields)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+
+    def encode(batch):
+        frame = pd.DataFrame.from_records(batch, columns=fields)
+        writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+        return sink.take()
+
+    # Encoding runs in a worker thread, one batch at a time (the writer isn't thread-safe)
+    try:
+        async for batch in batches:
+            chunk = await asyncio.to_thread(encode, batch)
+            if chunk:
+                yield chunk
+    finally:
+        await asyncio.to_thread(writer.close)
+    yield sink.take()
+
+
+def check_arguments(export_format: str, fields: Optional[List[str]]) -> List[str]:
+    """Validate the format and return the fields to export"""
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format '{export_format}' (expected one of: {', '.join(FORMATS)})")
+    return validate_fields(fields)
+
+
+def encode_batches(
+    batches: AsyncIterator[List[Dict[str, Any]]],
+    export_format: str,
+    fields: List[str]
+) -> AsyncIterator[bytes]:
+    """Encode batches of log documents from any source in the requested format"""
+    if export_format == 'parquet':
+        return parquet_chunks(batches, fields)
+    return ndjson_chunks(batches)
+
+
+def export_chunks(
+    collections,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    export_format: str = 'ndjson',
+    fields: Optional[List[str]] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    codec: LogCodec = PLAIN_CODEC
+) -> AsyncIterator[bytes]:
+    """Byte chunks of a time-range export in the requested format"""
+    fields = check_arguments(export_format, fields)
+    return encode_batches(iter_log_batches(collections, start, end, fields, batch_size, codec), export_format, fields)
+
+
+def open_storage():
+    """Storage configured from the environment like the API's, and its MongoDB
+    client (None for the embedded engines). Call ``open()`` on the storage before use.
+    """
+    # Imported here: storage builds on this module
+    import storage
+
+    backend = os.environ.get('STORAGE_BACKEND', 'mongodb')
+    if backend != 'mongodb':
+        return storage.open_embedded(backend, os.environ.get('STORAGE_PATH', f'bypass.{backend}')), None
+    client = database.create_client(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    codec = CompactLogCodec(db) if os.environ.get('LOG_ENCODING', 'plain') == 'compact' else PLAIN_CODEC
+    partitions = LogPartitions(
+        db,
+        base_name=codec.collection_name,
+        granularity=os.environ.get('LOG_PARTITIONING', 'off')
+    )
+    repositories = storage.Storage(
+        storage.MongoLogRepository(db, db, partitions.writer, partitions, codec),
+        storage.MongoSiteConfigRepository(db, db),
+        storage.MongoStatusCheckRepository(db),
+    )
+    return repositories, client
+
+
+cli = typer.Typer(help="Export bypass logs")
+
+
+@cli.command()
+def main(
+    start: Optional[datetime] = typer.Option(None, help="Inclusive lower bound on timestamp (UTC)"),
+    end: Optional[datetime] = typer.Option(None, help="Exclusive upper bound on timestamp (UTC)"),
+    export_format: str = typer.Option('ndjson', '--format', help="ndjson or parquet"),
+    output: Optional[Path] = typer.Option(None, '--output', '-o', help="Output file (stdout when omitted)"),
+    fields: Optional[List[str]] = typer.Option(None, '--field', help="Field to export (repeatable)"),
+    batch_size: int = typer.Option(DEFAULT_BATCH_SIZE, help="Documents fetched and encoded per batch"),
+):
+    load_dotenv(Path(__file__).parent / '.env')
+
+    async def run():
+        repositories, client = open_storage()
+        await repositories.open()
+        target = await asyncio.to_thread(open, output, 'wb') if output else sys.stdout.buffer
+        try:
+            async for chunk in repositories.logs.export_chunks(start, end, export_format, fields, batch_size):
+                await asyncio.to_thread(target.write, chunk)
+        finally:
+            if output:
+                await asyncio.to_thread(target.close)
+            await repositories.close()
+            if client is not None:
+                client.close()
+
+    try:
+        asyncio.run(run())
+    except (ValueError, RuntimeError) as e:
+        typer.echo(f"Export failed: {e}", err=True)
+        raise typer.Exit(code=1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,40 @@
+"""Optional orjson response path for endpoints returning trusted data.
+
+FastAPI normally validates a route's return value against its
+``response_model``, runs it through ``jsonable_encoder`` and then encodes it
+with the standard library. For documents read straight from our own
+collections that work is redundant, so ``FastJSONResponse`` hands the data
+to orjson in one step: datetimes and UUIDs are encoded natively and
+pydantic models are dumped without revalidation. Returning a ``Response``
+from a route also makes FastAPI skip its own serialization.
+"""
+from typing import Any
+
+from pydantic import BaseModel
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # The fast path is optional
+    orjson = None
+
+
+def available() -> bool:
+    return orjson is not None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
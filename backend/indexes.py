@@ -0,0 +1,111 @@
+"""Declared MongoDB indexes for the backend collections.
+
+``ensure_indexes`` compares the declarations below with what each collection
+actually has, builds the missing indexes and reports drift (an index with the
+declared name but different keys or options, or an undeclared index) without
+touching it, so conflicting changes are always made deliberately through a
+migration.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+from pymongo.errors import OperationFailure
+
+
+logger = logging.getLogger(__name__)
+
+# Index options that change index semantics and are compared for drift
+COMPARED_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds')
+
+
+@dataclass
+class IndexSpec:
+    name: str
+    keys: List[Tuple[str, int]]
+    options: Dict[str, Any] = field(default_factory=dict)
+
+
+INDEXES: Dict[str, List[IndexSpec]] = {
+    'bypass_logs': [
+        IndexSpec('timestamp_domain', [('timestamp', 1), ('domain', 1)]),
+        IndexSpec('domain', [('domain', 1)]),
+        IndexSpec('success_true', [('success', 1)], {'partialFilterExpression': {'success': True}}),
+    ],
+    # Compact log encoding (see log_codec.py): t=timestamp, d=domain, s=success
+    'bypass_events': [
+        IndexSpec('timestamp_domain', [('t', 1), ('d', 1)]),
+        IndexSpec('domain', [('d', 1)]),
+        IndexSpec('success_true', [('s', 1)], {'partialFilterExpression': {'s': True}}),
+    ],
+    'log_dictionary': [
+        IndexSpec('kind_value', [('k', 1), ('v', 1)], {'unique': True}),
+        IndexSpec('kind_code', [('k', 1), ('c', 1)], {'unique': True}),
+    ],
+    'bypass_rollups': [
+        IndexSpec('kind_day', [('kind', 1), ('day', 1)]),
+        IndexSpec('kind_count', [('kind', 1), ('count', -1)]),
+    ],
+    'site_configs': [
+        IndexSpec('domain_unique', [('domain', 1)], {'unique': True}),
+        IndexSpec('version', [('version', 1)]),
+    ],
+    'status_checks': [
+        IndexSpec('timestamp_id', [('timestamp', 1), ('_id', 1)]),
+    ],
+}
+
+
+def _differences(spec: IndexSpec, existing: Dict[str, Any]) -> List[str]:
+    differences = []
+    existing_keys = [(name, int(direction)) for name, direction in existing['key'].items()]
+    if existing_keys != spec.keys:
+        differences.append(f"keys {existing_keys} != {spec.keys}")
+    for option in COMPARED_OPTIONS:
+        if existing.get(option) != spec.options.get(option):
+            differences.append(f"{option} {existing.get(option)!r} != {spec.options.get(option)!r}")
+    return differences
+
+
+async def ensure_collection_indexes(collection, specs: List[IndexSpec]) -> Dict[str, List[str]]:
+    """Create missing indexes on one collection and describe any drift"""
+    report = {'created': [], 'drift': [], 'undeclared': []}
+    existing = {index['name']: index async for index in collection.list_indexes()}
+
+    for spec in specs:
+        if spec.name in existing:
+            differences = _differences(spec, existing[spec.name])
+            if differences:
+                report['drift'].append(f"{spec.name}: {'; '.join(differences)}")
+            continue
+        try:
+            await collection.create_index(spec.keys, name=spec.name, background=True, **spec.options)
+            report['created'].append(spec.name)
+        except OperationFailure as e:
+            # Same keys under another name, duplicate values for a unique index, ...
+            report['drift'].append(f"{spec.name}: could not be created ({e})")
+
+    declared = {spec.name for spec in specs}
+    report['undeclared'] = [name for name in existing if name != '_id_' and name not in declared]
+    return report
+
+
+async def ensure_indexes(db, declarations: Dict[str, List[IndexSpec]] = INDEXES) -> Dict[str, Dict[str, List[str]]]:
+    """Bring every declared collection up to date and log the outcome"""
+    report = {}
+    for collection_name, specs in declarations.items():
+        try:
+            report[collection_name] = await ensure_collection_indexes(db[collection_name], specs)
+        except Exception as e:
+            logger.error(f"Failed to check indexes on {collection_name}: {e}")
+            report[collection_name] = {'created': [], 'drift': [f"check failed ({e})"], 'undeclared': []}
+            continue
+
+        collection_report = report[collection_name]
+        if collection_report['created']:
+            logger.info(f"Created indexes on {collection_name}: {', '.join(collection_report['created'])}")
+        for drift in collection_report['drift']:
+            logger.warning(f"Index drift on {collection_name}: {drift}")
+        if collection_report['undeclared']:
+            logger.warning(f"Undeclared indexes on {collection_name}: {', '.join(collection_report['undeclared'])}")
+    return report
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Load test for the backend API.
+
+Drives each route (or a weighted mix resembling extension traffic) at a
+fixed concurrency and reports throughput, p50/p95/p99 latency and error rate
+per route. Runs either against a server started locally:
+
+    uvicorn server:app --port 8001 &
+    python load_test.py --base-url http://localhost:8001 --concurrency 50 --duration 30
+
+or in-process through the ASGI app, with whatever MONGO_URL the .env points to:
+
+    python load_test.py --in-process --routes mix log stats --output results.json
+
+Results are written as JSON; pass --baseline with an earlier result file to
+print the throughput and p95 change per scenario.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import subprocess
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import httpx
+
+
+DOMAINS = ["lefigaro.fr", "lemonde.fr", "liberation.fr", "leparisien.fr", "lesechos.fr",
+           "mediapart.fr", "nouvelobs.com", "lexpress.fr", "lepoint.fr", "telerama.fr"]
+ACTIONS = ["header_modified", "cookies_cleared", "paywall_detected"]
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/129.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_6) AppleWebKit/605.1.15 Version/17.6 Safari/605.1.15",
+]
+
+
+def _event(rng):
+    domain = rng.choice(DOMAINS)
+    return {
+        "action": rng.choice(ACTIONS),
+        "domain": domain,
+        "url": f"https://www.{domain}/article/{rng.randrange(10**7)}",
+        "user_agent": rng.choice(USER_AGENTS),
+        "success": rng.random() < 0.92,
+    }
+
+
+# Route name -> function building (method, path, keyword arguments for httpx)
+ROUTES = {
+    "log": lambda rng: ("POST", "/api/bypass-log", {"json": _event(rng)}),
+    "bulk": lambda rng: ("POST", "/api/bypass-log/bulk", {"json": [_event(rng) for _ in range(50)]}),
+    "stats": lambda rng: ("GET", "/api/bypass-stats", {}),
+    "window": lambda rng: ("GET", "/api/bypass-stats/window", {"params": {"window": rng.choice(["today", "week"])}}),
+    "site-config": lambda rng: ("GET", f"/api/site-config/{rng.choice(DOMAINS)}", {}),
+    "snapshot": lambda rng: ("GET", "/api/site-configs/snapshot", {"headers": {"accept-encoding": "gzip"}}),
+    "supported-sites": lambda rng: ("GET", "/api/supported-sites", {"params": {"limit": 100}}),
+    "test-bypass": lambda rng: ("POST", "/api/test-bypass", {"params": {"url": f"https://www.{rng.choice(DOMAINS)}/a"}}),
+}
+
+# Extension traffic: mostly event logging, popup opens and config fetches
+MIX = {"log": 55, "bulk": 3, "stats": 15, "window": 2, "site-config": 20, "snapshot": 3, "supported-sites": 2}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    """samples: route -> list of (latency seconds, ok)"""
+    summary = {}
+    for route, results in sorted(samples.items()):
+        latencies = sorted(latency for latency, _ in results)
+        errors = sum(1 for _, ok in results if not ok)
+        summary[route] = {
+            "requests": len(results),
+            "errors": errors,
+            "error_rate": round(errors / len(results), 4) if results else 0.0,
+            "throughput_rps": round(len(results) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        }
+    return summary
+
+
+async def run_scenario(client, weights, concurrency, duration, requests, seed):
+    samples = {route: [] for route in weights}
+    routes, cumulative = list(weights), list(weights.values())
+    deadline = time.perf_counter() + duration
+    issued = 0
+
+    async def worker(worker_id):
+        nonlocal issued
+        rng = random.Random(seed * 1000 + worker_id)
+        while time.perf_counter() < deadline and (requests is None or issued < requests):
+            issued += 1
+            route = rng.choices(routes, cumulative)[0]
+            method, path, kwargs = ROUTES[route](rng)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            samples[route].append((time.perf_counter() - started, ok))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    total = [sample for results in samples.values() for sample in results]
+    overall = summarize({"all": total}, elapsed)["all"]
+    return {"elapsed_s": round(elapsed, 3), "overall": overall, "routes": summarize(samples, elapsed)}
+
+
+@asynccontextmanager
+async def make_client(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if not args.in_process:
+        async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+            yield client
+        return
+
+    import server
+    # ASGITransport doesn't run the lifespan, so start the app's background work here
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=args.timeout) as client:
+            yield client
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def print_comparison(report, baseline):
+    for name, scenario in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        now, before = scenario["overall"], previous["overall"]
+        rps_change = (now["throughput_rps"] / before["throughput_rps"] - 1) * 100 if before["throughput_rps"] else 0
+        p95_change = (now["p95_ms"] / before["p95_ms"] - 1) * 100 if before["p95_ms"] else 0
+        print(f"  vs baseline {name:<16} throughput {rps_change:+.1f}%  p95 {p95_change:+.1f}%")
+
+
+async def run(args):
+    scenarios = {}
+    async with make_client(args) as client:
+        for name in args.routes:
+            weights = MIX if name == "mix" else {name: 1}
+            if args.warmup:
+                await run_scenario(client, weights, args.concurrency, args.warmup, None, args.seed)
+            result = await run_scenario(client, weights, args.concurrency, args.duration, args.requests, args.seed)
+            scenarios[name] = result
+            overall = result["overall"]
+            print(f"{name:<16} {overall['throughput_rps']:>9.1f} req/s  p50 {overall['p50_ms']:.2f}ms  "
+                  f"p95 {overall['p95_ms']:.2f}ms  p99 {overall['p99_ms']:.2f}ms  "
+                  f"errors {overall['error_rate'] * 100:.2f}%")
+
+    report = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "commit": git_commit(),
+        "target": "in-process" if args.in_process else args.base_url,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "scenarios": scenarios,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            print_comparison(report, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--in-process", action="store_true", help="Drive the ASGI app directly instead of over HTTP")
+    parser.add_argument("--routes", nargs="+", default=["mix"], choices=["mix", *ROUTES],
+                        help="Scenarios to run: a single route or the weighted mix")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument("--requests", type=int, help="Stop a scenario after this many requests")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Unmeasured seconds before each scenario")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Earlier JSON result to compare against")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
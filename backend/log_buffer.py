@@ -0,0 +1,166 @@
+"""Write-behind buffer for bypass log inserts.
+
+Request handlers enqueue documents and return immediately; a background task
+groups queued documents and writes them with a single ``insert_many`` once
+either the batch size or the flush interval is reached (group commit).
+The queue is bounded, so producers wait when the database falls behind.
+A batch that fails as a whole (connection lost, timeout...) is retried with
+exponential backoff before it is dropped; documents rejected by the server
+(duplicate keys, validation) are dropped at once since retrying can't help.
+Write errors without a ``code`` (a partition of the batch that could not be
+written, see ``partitions.py``) are retried like a failed batch.
+An optional ``on_flush`` coroutine receives every batch that was stored,
+which lets derived data (such as rollup counters) be updated per batch.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+
+logger = logging.getLogger(__name__)
+
+# Marker pushed through the queue to make the flusher drain and exit
+_STOP = object()
+
+
+class LogWriteBuffer:
+    def __init__(
+        self,
+        collection,
+        max_batch_size: int = 500,
+        flush_interval: float = 0.5,
+        max_queue_size: int = 10000,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+        on_flush: Optional[Callable[[List[Dict[str, Any]]], Awaitable[None]]] = None,
+    ):
+        self.collection = collection
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.on_flush = on_flush
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters exposed for monitoring
+        self.flushes = 0
+        self.flushed_documents = 0
+        self.dropped_documents = 0
+        self.retries = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Start the background flusher on the running event loop"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, document: Dict[str, Any]):
+        """Queue a document for insertion, waiting while the queue is full.
+
+        When the buffer is not running (disabled, or already closed) the
+        document is written synchronously and write errors reach the caller.
+        Otherwise the write happens later: a document that still can't be
+        written after the retries is logged and counted in ``dropped_documents``.
+        """
+        if not self.running:
+            await self.collection.insert_one(document)
+            await self._notify([document])
+            return
+        await self._queue.put(document)
+
+    async def close(self):
+        """Flush everything still queued and stop the background flusher"""
+        if not self.running:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        stored = []
+        pending = batch
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.collection.insert_many(pending, ordered=False)
+                stored.extend(pending)
+                pending = []
+                break
+            except BulkWriteError as e:
+                rejected, retryable = set(), set()
+                for write_error in e.details.get('writeErrors', []):
+                    if 'code' not in write_error:
+                        retryable.add(write_error['index'])
+                    # A retry resends documents that may have been written before the
+                    # failure: they keep their _id, so a duplicate key means stored
+                    elif not (attempt and write_error['code'] == 11000):
+                        rejected.add(write_error['index'])
+                stored.extend(document for index, document in enumerate(pending) if index not in rejected | retryable)
+                if rejected:
+                    logger.error(f"Failed to flush {len(rejected)} of {len(pending)} bypass logs: {e}")
+                pending = [pending[index] for index in sorted(retryable)]
+                if not pending:
+                    break
+                error = e
+            except Exception as e:
+                error = e
+            if attempt == self.max_retries:
+                logger.error(f"Dropping {len(pending)} bypass logs after {attempt + 1} failed flushes: {error}")
+                break
+            delay = self.retry_backoff * 2 ** attempt
+            logger.warning(f"Failed to flush {len(pending)} bypass logs, retrying in {delay:.1f}s: {error}")
+            self.retries += 1
+            await asyncio.sleep(delay)
+        self.flushes += 1
+
+        self.flushed_documents += len(stored)
+        self.dropped_documents += len(batch) - len(stored)
+        await self._notify(stored)
+
+    async def _notify(self, documents: List[Dict[str, Any]]):
+        if not documents or self.on_flush is None:
+            return
+        try:
+            await self.on_flush(documents)
+        except Exception as e:
+            logger.error(f"Failed to process {len(documents)} flushed bypass logs: {e}")
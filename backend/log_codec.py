@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Storage encodings for bypass log documents.
+
+``LogCodec`` stores documents exactly as the API models dump them.
+``CompactLogCodec`` shrinks them for high-volume deployments:
+
+- short field names (``a``, ``d``, ``u``, ``t``, ``ua``, ``s``)
+- the UUID ``id`` becomes a 16-byte binary ``_id``, so no second id index
+- ``action``, ``domain`` and ``user_agent`` are replaced by small integer
+  codes from the ``log_dictionary`` collection, cached in process
+
+Both codecs decode back to the field names of ``BypassLog``. Compact
+documents live in their own ``bypass_events`` collection so the two formats
+never mix in one aggregation; existing history can be converted with:
+
+    python log_codec.py convert
+"""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import Binary
+from dotenv import load_dotenv
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import database
+
+PLAIN_COLLECTION = 'bypass_logs'
+COMPACT_COLLECTION = 'bypass_events'
+
+FIELD_NAMES = {
+    'id': '_id',
+    'action': 'a',
+    'domain': 'd',
+    'url': 'u',
+    'timestamp': 't',
+    'user_agent': 'ua',
+    'success': 's',
+}
+DICTIONARY_FIELDS = ('action', 'domain', 'user_agent')
+
+
+class LogCodec:
+    """Identity encoding: documents are stored as the API models dump them"""
+
+    compact = False
+    collection_name = PLAIN_COLLECTION
+
+    def field(self, name: str) -> str:
+        return name
+
+    async def load(self):
+        pass
+
+    async def encode_many(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return documents
+
+    async def decode_many(
+        self,
+        documents: List[Dict[str, Any]],
+        fields: Optional[Iterable[str]] = None
+    ) -> List[Dict[str, Any]]:
+        return documents
+
+    async def decode_values(self, name: str, values: Iterable[Any]) -> List[Any]:
+        return list(values)
+
+
+PLAIN_CODEC = LogCodec()
+
+
+class CompactLogCodec(LogCodec):
+    compact = True
+    collection_name = COMPACT_COLLECTION
+
+    def __init__(self, db):
+        self.dictionary = db.log_dictionary
+        self.counters = db.counters
+        self._codes: Dict[str, Dict[str, int]] = {kind: {} for kind in DICTIONARY_FIELDS}
+        self._values: Dict[str, Dict[int, str]] = {kind: {} for kind in DICTIONARY_FIELDS}
+
+    def field(self, name: str) -> str:
+        return FIELD_NAMES[name]
+
+    def _remember(self, kind: str, value: str, code: int):
+        self._codes[kind][value] = code
+        self._values[kind][code] = value
+
+    async def load(self):
+        """Warm the in-process dictionary cache"""
+        async for entry in self.dictionary.find({}):
+            self._remember(entry['k'], entry['v'], entry['c'])
+
+    async def _allocate(self, kind: str, value: str) -> int:
+        existing = await self.dictionary.find_one({'k': kind, 'v': value})
+        if existing is None:
+            counter = await self.counters.find_one_and_update(
+                {'_id': f"log_dictionary:{kind}"},
+                {'$inc': {'seq': 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            try:
+                await self.dictionary.insert_one({'k': kind, 'v': value, 'c': counter['seq']})
+                existing = {'c': counter['seq']}
+            except DuplicateKeyError:
+                # Another worker registered the same value first, use its code
+                existing = await self.dictionary.find_one({'k': kind, 'v': value})
+        self._remember(kind, value, existing['c'])
+        return existing['c']
+
+    async def _code(self, kind: str, value: str) -> int:
+        code = self._codes[kind].get(value)
+        return code if code is not None else await self._allocate(kind, value)
+
+    async def _value(self, kind: str, code: Any) -> Optional[str]:
+        if not isinstance(code, int):
+            return code
+        if code not in self._values[kind]:
+            entry = await self.dictionary.find_one({'k': kind, 'c': code})
+            if entry is None:
+                return None
+            self._remember(kind, entry['v'], code)
+        return self._values[kind][code]
+
+    async def encode_many(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        encoded = []
+        for document in documents:
+            try:
+                _id = Binary.from_uuid(uuid.UUID(document['id']))
+            except (KeyError, ValueError):
+                _id = document.get('id')
+            compact = {'_id': _id, 'u': document['url'], 't': document['timestamp'], 's': document.get('success', True)}
+            for name in DICTIONARY_FIELDS:
+                if document.get(name) is not None:
+                    compact[FIELD_NAMES[name]] = await self._code(name, document[name])
+            encoded.append(compact)
+        return encoded
+
+    async def decode_many(
+        self,
+        documents: List[Dict[str, Any]],
+        fields: Optional[Iterable[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Decode documents, setting absent ``fields`` (default: all) to None"""
+        wanted = set(fields) if fields is not None else set(FIELD_NAMES)
+        decoded = []
+        for compact in documents:
+            document = {}
+            for name, short in FIELD_NAMES.items():
+                if short not in compact:
+                    if name in wanted:
+                        document[name] = None
+                    continue
+                value = compact[short]
+                if name == 'id' and isinstance(value, Binary):
+                    value = str(value.as_uuid())
+                elif name in DICTIONARY_FIELDS:
+                    value = await self._value(name, value)
+                document[name] = value
+            decoded.append(document)
+        return decoded
+
+    async def decode_values(self, name: str, values: Iterable[Any]) -> List[Any]:
+        return [await self._value(name, value) for value in values]
+
+
+class EncodingWriter:
+    """Collection-like writer that encodes documents before inserting them"""
+
+    def __init__(self, writer, codec: LogCodec):
+        self.writer = writer
+        self.codec = codec
+
+    async def insert_one(self, document: Dict[str, Any]):
+        return await self.writer.insert_one((await self.codec.encode_many([document]))[0])
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = False):
+        # Encoding is one-to-one, so write error indexes still match the caller's list
+        return await self.writer.insert_many(await self.codec.encode_many(documents), ordered=ordered)
+
+
+async def convert(db, batch_size: int = 5000):
+    """Copy every plain bypass log into the compact collection"""
+    codec = CompactLogCodec(db)
+    await codec.load()
+    converted = 0
+    batch = []
+    async for document in db[PLAIN_COLLECTION].find({}, {'_id': 0}).batch_size(batch_size):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            converted += await _copy_batch(db, codec, batch)
+            batch = []
+    if batch:
+        converted += await _copy_batch(db, codec, batch)
+    return converted
+
+
+async def _copy_batch(db, codec: CompactLogCodec, batch: List[Dict[str, Any]]) -> int:
+    encoded = await codec.encode_many(batch)
+    # Upserts keyed on _id, so re-running the conversion never duplicates events
+    await db[COMPACT_COLLECTION].bulk_write(
+        [ReplaceOne({'_id': document['_id']}, document, upsert=True) for document in encoded],
+        ordered=False
+    )
+    return len(encoded)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['convert']:
+        print("Usage: python log_codec.py convert")
+        sys.exit(1)
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = database.create_client(os.environ['MONGO_URL'])
+    count = asyncio.run(convert(client[os.environ['DB_NAME']]))
+    print(f"Converted {count} bypass logs to {COMPACT_COLLECTION}")
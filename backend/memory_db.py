@@ -0,0 +1,772 @@
+"""In-process stand-in for Motor, selected with ``MONGO_URL=memory://``.
+
+Implements the subset of the Motor API the backend uses, with MongoDB
+semantics where they matter to our code: ``_id`` and unique indexes raise
+``DuplicateKeyError`` (also inside ``insert_many``/``bulk_write`` as a
+``BulkWriteError``), upserts seed the new document from the filter, stored
+datetimes are truncated to milliseconds like BSON, and documents are copied
+on the way in and out. Aggregation covers the stages and expressions our
+pipelines use (``$match``, ``$group``, ``$facet``, ``$unionWith``, ...).
+Change streams raise the same error as a standalone server, so the config
+watcher falls back to polling.
+
+Everything lives in the process and is shared by clients opened with the
+same URL, which makes benchmarks and test runs hermetic and repeatable.
+There is no persistence, journaling or concurrency control beyond the event
+loop; never point a deployment at it.
+"""
+import re
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.read_preferences import Primary
+from pymongo.results import (
+    BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+)
+
+
+SCHEME = 'memory://'
+
+_MISSING = object()
+
+
+def is_memory_url(url: str) -> bool:
+    return url.startswith(SCHEME)
+
+
+# --- documents ---------------------------------------------------------------
+
+def _copy_in(value: Any) -> Any:
+    """Copy a value into storage, normalizing it like a BSON round trip would"""
+    if isinstance(value, dict):
+        return {key: _copy_in(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_copy_in(item) for item in value]
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+
+def _copy(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _get(document: Any, path: str) -> Any:
+    value = document
+    for part in path.split('.'):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+    return value
+
+
+def _set(document: Dict[str, Any], path: str, value: Any):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _unset(document: Dict[str, Any], path: str):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+# BSON comparison order between types
+def _type_rank(value: Any) -> int:
+    if value is None or value is _MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _sort_key(value: Any):
+    rank = _type_rank(value)
+    if rank == 1:
+        return (rank, 0)
+    if rank in (4, 5, 10):
+        return (rank, repr(value))
+    return (rank, value)
+
+
+def _compare(left: Any, right: Any) -> Optional[int]:
+    """-1/0/1, or None when MongoDB would not compare the two types"""
+    if _type_rank(left) != _type_rank(right) or _type_rank(left) in (4, 5, 10):
+        return None
+    if left is _MISSING or left is None:
+        return 0
+    return (left > right) - (left < right)
+
+
+def _hashable(value: Any) -> Any:
+    if isinstance(value, dict):
+        return tuple((key, _hashable(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    return value
+
+
+# --- queries -------------------------------------------------------------------
+
+def _equals(value: Any, expected: Any) -> bool:
+    if value is _MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return any(_equals(item, expected) for item in value)
+    if _type_rank(value) != _type_rank(expected):
+        return False
+    return value == expected
+
+
+def _ordered(value: Any, expected: Any, accept: Callable[[int], bool]) -> bool:
+    if isinstance(value, list):
+        return any(_ordered(item, expected, accept) for item in value)
+    result = _compare(value, expected)
+    return result is not None and accept(result)
+
+
+def _match_operators(value: Any, condition: Dict[str, Any]) -> bool:
+    for operator, expected in condition.items():
+        if operator == '$ne':
+            matched = not _equals(value, expected)
+        elif operator == '$gt':
+            matched = _ordered(value, expected, lambda result: result > 0)
+        elif operator == '$gte':
+            matched = _ordered(value, expected, lambda result: result >= 0)
+        elif operator == '$lt':
+            matched = _ordered(value, expected, lambda result: result < 0)
+        elif operator == '$in':
+            matched = any(_equals(value, item) for item in expected)
+        elif operator == '$exists':
+            matched = (value is not _MISSING) == bool(expected)
+        elif operator == '$regex':
+            matched = isinstance(value, str) and re.search(expected, value) is not None
+        else:
+            raise OperationFailure(f"unknown operator: {operator}", code=2)
+        if not matched:
+            return False
+    return True
+
+
+def matches(document: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == '$and':
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict) and condition and all(name.startswith('$') for name in condition):
+            if not _match_operators(_get(document, key), condition):
+                return False
+        elif not _equals(_get(document, key), condition):
+            return False
+    return True
+
+
+def _project(document: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return _copy(document)
+    include_id = bool(projection.get('_id', 1))
+    included = [field for field, flag in projection.items() if field != '_id' and flag]
+    if included:
+        result = {'_id': document['_id']} if include_id and '_id' in document else {}
+        for field in included:
+            value = _get(document, field)
+            if value is not _MISSING:
+                _set(result, field, _copy(value))
+        return result
+    result = _copy(document)
+    for field, flag in projection.items():
+        if not flag:
+            _unset(result, field)
+    return result
+
+
+def _sort_documents(documents: List[Dict[str, Any]], sort: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    # Stable sorts applied from the last key to the first
+    for field, direction in reversed(sort):
+        documents.sort(key=lambda document: _sort_key(_get(document, field)), reverse=direction < 0)
+    return documents
+
+
+def _normalize_sort(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(field, order) for field, order in key_or_list]
+
+
+# --- updates -------------------------------------------------------------------
+
+def _apply_update(document: Dict[str, Any], update: Dict[str, Any], inserting: bool = False):
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == '$set' or (operator == '$setOnInsert' and inserting):
+                _set(document, path, _copy_in(value))
+            elif operator == '$setOnInsert':
+                continue
+            elif operator == '$inc':
+                current = _get(document, path)
+                _set(document, path, (0 if current is _MISSING else current) + value)
+            elif operator == '$unset':
+                _unset(document, path)
+            elif operator == '$addToSet':
+                current = _get(document, path)
+                items = [] if current is _MISSING else current
+                if not any(_equals(item, value) for item in items):
+                    _set(document, path, [*items, _copy_in(value)])
+            elif operator == '$pull':
+                current = _get(document, path)
+                if isinstance(current, list):
+                    _set(document, path, [item for item in current if not _equals(item, value)])
+            elif operator == '$max':
+                current = _get(document, path)
+                if current is _MISSING or current is None or value > current:
+                    _set(document, path, _copy_in(value))
+            else:
+                raise OperationFailure(f"Unknown modifier: {operator}", code=9)
+
+
+def _upsert_seed(query: Dict[str, Any]) -> Dict[str, Any]:
+    """Fields an upsert copies from the equality conditions of its filter"""
+    seed = {}
+    for key, condition in (query or {}).items():
+        if key == '$and':
+            for clause in condition:
+                seed.update(_upsert_seed(clause))
+        elif key.startswith('$'):
+            continue
+        elif not (isinstance(condition, dict) and condition and all(name.startswith('$') for name in condition)):
+            _set(seed, key, _copy_in(condition))
+    return seed
+
+
+# --- aggregation -----------------------------------------------------------------
+
+def _date_to_string(spec: Dict[str, Any], document: Dict[str, Any]) -> Optional[str]:
+    value = evaluate(spec['date'], document)
+    if not isinstance(value, datetime):
+        return None
+    return value.strftime(spec.get('format', '%Y-%m-%dT%H:%M:%S.%LZ').replace('%L', f"{value.microsecond // 1000:03d}"))
+
+
+def evaluate(expression: Any, document: Dict[str, Any]) -> Any:
+    """Evaluate an aggregation expression against one document"""
+    if isinstance(expression, str) and expression.startswith('$'):
+        value = _get(document, expression[1:])
+        return None if value is _MISSING else value
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) != 1 or not next(iter(expression)).startswith('$'):
+        return {key: evaluate(value, document) for key, value in expression.items()}
+
+    operator, arguments = next(iter(expression.items()))
+    if operator == '$cond':
+        if isinstance(arguments, dict):
+            arguments = [arguments['if'], arguments['then'], arguments['else']]
+        condition, then, otherwise = arguments
+        return evaluate(then if evaluate(condition, document) else otherwise, document)
+    if operator == '$eq':
+        left, right = (evaluate(argument, document) for argument in arguments)
+        return _type_rank(left) == _type_rank(right) and left == right
+    if operator == '$dateToString':
+        return _date_to_string(arguments, document)
+    raise OperationFailure(f"Unrecognized expression '{operator}'", code=168)
+
+
+def _group(documents: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    key_expression = spec['_id']
+    accumulators = {field: next(iter(accumulator.items())) for field, accumulator in spec.items() if field != '_id'}
+    groups: Dict[Any, Dict[str, Any]] = {}
+    for document in documents:
+        key = evaluate(key_expression, document)
+        group = groups.get(_hashable(key))
+        if group is None:
+            group = groups[_hashable(key)] = {'_id': key}
+        for field, (operator, argument) in accumulators.items():
+            value = evaluate(argument, document)
+            if operator == '$sum':
+                group[field] = group.get(field, 0) + (value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0)
+            elif operator == '$push':
+                group.setdefault(field, []).append(value)
+            else:
+                raise OperationFailure(f"unknown group operator '{operator}'", code=15952)
+    return list(groups.values())
+
+
+class _Pipeline:
+    def __init__(self, database: "MemoryDatabase"):
+        self.database = database
+
+    def run(self, documents: List[Dict[str, Any]], pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            handler = getattr(self, '_' + name[1:].replace('With', '_with'), None)
+            if handler is None:
+                raise OperationFailure(f"Unrecognized pipeline stage name: '{name}'", code=40324)
+            documents = handler(documents, spec)
+        return documents
+
+    def _match(self, documents, spec):
+        return [document for document in documents if matches(document, spec)]
+
+    def _group(self, documents, spec):
+        return _group(documents, spec)
+
+    def _sort(self, documents, spec):
+        return _sort_documents(list(documents), _normalize_sort(spec))
+
+    def _limit(self, documents, spec):
+        return documents[:spec]
+
+    def _count(self, documents, spec):
+        return [{spec: len(documents)}] if documents else []
+
+    def _facet(self, documents, spec):
+        return [{name: self.run(list(documents), pipeline) for name, pipeline in spec.items()}]
+
+    def _union_with(self, documents, spec):
+        if isinstance(spec, str):
+            spec = {'coll': spec}
+        other = [_copy(document) for document in self.database[spec['coll']]._documents.values()]
+        return documents + self.run(other, spec.get('pipeline', []))
+
+
+# --- cursors ---------------------------------------------------------------------
+
+class MemoryCursor:
+    """Lazy cursor with the chaining and async iteration of a Motor cursor"""
+
+    def __init__(self, produce: Callable[[], List[Dict[str, Any]]], projection=_MISSING):
+        self._produce = produce
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._limit = 0
+        self._results: Optional[List[Dict[str, Any]]] = None
+        self._position = 0
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size: int):
+        return self
+
+    def _evaluate(self) -> List[Dict[str, Any]]:
+        if self._results is None:
+            results = self._produce()
+            if self._sort:
+                results = _sort_documents(results, self._sort)
+            if self._limit:
+                results = results[:self._limit]
+            # Like MongoDB, sort on the stored fields and project (copy out) last
+            if self._projection is not _MISSING:
+                results = [_project(document, self._projection) for document in results]
+            self._results = results
+        return self._results
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        results = self._evaluate()
+        end = len(results) if length is None else min(len(results), self._position + length)
+        batch = results[self._position:end]
+        self._position = end
+        return batch
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        results = self._evaluate()
+        if self._position >= len(results):
+            raise StopAsyncIteration
+        self._position += 1
+        return results[self._position - 1]
+
+    async def close(self):
+        self._results = []
+
+
+# --- collections -----------------------------------------------------------------
+
+def _index_name(keys: List[Tuple[str, int]]) -> str:
+    return '_'.join(f"{field}_{direction}" for field, direction in keys)
+
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self._documents: Dict[Any, Dict[str, Any]] = {}
+        self._indexes: Dict[str, Dict[str, Any]] = {}
+        # Unique index name -> {key tuple: _id}
+        self._unique: Dict[str, Dict[Any, Any]] = {}
+        self.exists = False
+
+    def with_options(self, *args, **kwargs) -> "MemoryCollection":
+        return self
+
+    def _clear(self):
+        self._documents.clear()
+        self._indexes.clear()
+        self._unique.clear()
+        self.exists = False
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+    # Index bookkeeping
+
+    def _index_key(self, index: Dict[str, Any], document: Dict[str, Any]) -> Optional[Any]:
+        partial = index.get('partialFilterExpression')
+        if partial is not None and not matches(document, partial):
+            return None
+        values = tuple(_hashable(_get(document, field)) for field in index['key'])
+        if index.get('sparse') and all(value is _MISSING for value in values):
+            return None
+        return tuple(None if value is _MISSING else value for value in values)
+
+    def _check_unique(self, document: Dict[str, Any], replacing: Any = _MISSING):
+        for name, entries in self._unique.items():
+            key = self._index_key(self._indexes[name], document)
+            if key is not None and key in entries and entries[key] != replacing:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.full_name} index: {name} dup key: {key}",
+                    code=11000
+                )
+
+    def _store(self, document: Dict[str, Any], previous: Optional[Dict[str, Any]] = None):
+        """Write a document, keeping the unique index maps in sync"""
+        _id = document['_id']
+        if previous is not None:
+            for name, entries in self._unique.items():
+                key = self._index_key(self._indexes[name], previous)
+                if key is not None and entries.get(key) == _id:
+                    del entries[key]
+        for name, entries in self._unique.items():
+            key = self._index_key(self._indexes[name], document)
+            if key is not None:
+                entries[key] = _id
+        self._documents[_hashable(_id)] = document
+        self.exists = True
+
+    def _remove(self, document: Dict[str, Any]):
+        for name, entries in self._unique.items():
+            key = self._index_key(self._indexes[name], document)
+            if key is not None and entries.get(key) == document['_id']:
+                del entries[key]
+        del self._documents[_hashable(document['_id'])]
+
+    def _insert(self, document: Dict[str, Any]) -> Any:
+        if '_id' not in document:
+            # Like pymongo, the generated _id is added to the caller's document
+            document['_id'] = ObjectId()
+        stored = _copy_in(document)
+        if _hashable(stored['_id']) in self._documents:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.full_name} index: _id_ dup key: {stored['_id']!r}",
+                code=11000
+            )
+        self._check_unique(stored)
+        self._store(stored)
+        return stored['_id']
+
+    def _replace(self, previous: Dict[str, Any], replacement: Dict[str, Any]):
+        self._check_unique(replacement, replacing=previous['_id'])
+        self._store(replacement, previous)
+
+    def _find(self, query: Optional[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+        # Query values are normalized like stored ones (aware datetimes to naive UTC)
+        query = _copy_in(query or {})
+        _id = query.get('_id', _MISSING)
+        if _id is not _MISSING and not isinstance(_id, dict):
+            document = self._documents.get(_hashable(_id))
+            return [document] if document is not None and matches(document, query) else []
+        return [document for document in self._documents.values() if matches(document, query)]
+
+    def _update(self, query, update, upsert: bool, multi: bool) -> Dict[str, Any]:
+        if not update or not all(key.startswith('$') for key in update):
+            raise ValueError("update only works with $ operators")
+        matched = self._find(query)
+        if not multi:
+            matched = matched[:1]
+        modified = 0
+        for document in list(matched):
+            updated = _copy(document)
+            _apply_update(updated, update)
+            if updated.get('_id') != document['_id']:
+                raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'", code=66)
+            if updated != document:
+                self._replace(document, updated)
+                modified += 1
+        result = {'n': len(matched), 'nModified': modified}
+        if not matched and upsert:
+            document = _upsert_seed(query)
+            _apply_update(document, update, inserting=True)
+            result['upserted'] = self._insert(document)
+            result['n'] = 1
+        return result
+
+    # Reads
+
+    def find(self, filter: Optional[Dict[str, Any]] = None, projection=None, **kwargs) -> MemoryCursor:
+        return MemoryCursor(lambda: self._find(filter), projection)
+
+    async def find_one(self, filter: Optional[Dict[str, Any]] = None, projection=None, **kwargs):
+        documents = await self.find(filter, projection).limit(1).to_list(1)
+        return documents[0] if documents else None
+
+    async def count_documents(self, filter: Dict[str, Any], **kwargs) -> int:
+        return len(self._find(filter))
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        return len(self._documents)
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> MemoryCursor:
+        pipeline = _copy_in(pipeline)
+        return MemoryCursor(
+            lambda: _Pipeline(self.database).run([_copy(document) for document in self._documents.values()], pipeline)
+        )
+
+    # Writes
+
+    async def insert_one(self, document: Dict[str, Any], **kwargs) -> InsertOneResult:
+        return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True, **kwargs) -> InsertManyResult:
+        inserted_ids, errors = [], []
+        for index, document in enumerate(documents):
+            try:
+                inserted_ids.append(self._insert(document))
+            except DuplicateKeyError as e:
+                errors.append({'index': index, 'code': 11000, 'errmsg': str(e), 'op': document})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                'writeErrors': errors, 'writeConcernErrors': [], 'nInserted': len(inserted_ids),
+                'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': [],
+            })
+        return InsertManyResult(inserted_ids, True)
+
+    async def replace_one(self, filter: Dict[str, Any], replacement: Dict[str, Any], upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._replace_one(filter, replacement, upsert), True)
+
+    def _replace_one(self, filter, replacement, upsert) -> Dict[str, Any]:
+        if any(key.startswith('$') for key in replacement):
+            raise ValueError("replacement can not include $ operators")
+        matched = self._find(filter)[:1]
+        if matched:
+            document = _copy_in(replacement)
+            document['_id'] = matched[0]['_id']
+            modified = int(document != matched[0])
+            self._replace(matched[0], document)
+            return {'n': 1, 'nModified': modified}
+        if not upsert:
+            return {'n': 0, 'nModified': 0}
+        document = {**_upsert_seed(filter), **_copy_in(replacement)}
+        return {'n': 1, 'nModified': 0, 'upserted': self._insert(document)}
+
+    async def update_one(self, filter, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._update(filter, update, upsert, multi=False), True)
+
+    async def update_many(self, filter, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._update(filter, update, upsert, multi=True), True)
+
+    async def find_one_and_update(self, filter, update, projection=None, upsert: bool = False,
+                                  return_document: bool = False, **kwargs):
+        before = self._find(filter)[:1]
+        before = _copy(before[0]) if before else None
+        result = self._update(filter, update, upsert, multi=False)
+        if return_document:
+            _id = before['_id'] if before is not None else result.get('upserted', _MISSING)
+            if _id is _MISSING:
+                return None
+            return _project(self._documents[_hashable(_id)], projection)
+        return _project(before, projection) if before is not None else None
+
+    async def delete_many(self, filter: Dict[str, Any], **kwargs) -> DeleteResult:
+        matched = list(self._find(filter))
+        for document in matched:
+            self._remove(document)
+        return DeleteResult({'n': len(matched)}, True)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        result = {'writeErrors': [], 'writeConcernErrors': [], 'nInserted': 0, 'nUpserted': 0,
+                  'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []}
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, ReplaceOne):
+                    outcome = self._replace_one(request._filter, request._doc, request._upsert)
+                elif isinstance(request, UpdateOne):
+                    outcome = self._update(request._filter, request._doc, request._upsert, multi=False)
+                else:
+                    raise TypeError(f"{request!r} is not a valid request")
+                if 'upserted' in outcome:
+                    result['nUpserted'] += 1
+                    result['upserted'].append({'index': index, '_id': outcome['upserted']})
+                else:
+                    result['nMatched'] += outcome['n']
+                    result['nModified'] += outcome['nModified']
+            except DuplicateKeyError as e:
+                result['writeErrors'].append({'index': index, 'code': 11000, 'errmsg': str(e)})
+                if ordered:
+                    break
+        if result['writeErrors']:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    # Indexes
+
+    async def create_index(self, keys, name: Optional[str] = None, **kwargs) -> str:
+        keys = _normalize_sort(keys, 1)
+        name = name or _index_name(keys)
+        spec = {'v': 2, 'key': dict(keys), 'name': name}
+        spec.update({option: value for option, value in kwargs.items() if option != 'background'})
+        existing = self._indexes.get(name)
+        if existing is not None:
+            if existing != spec:
+                raise OperationFailure(f"An existing index has the same name as the requested index: {name}", code=86)
+            return name
+        for other in self._indexes.values():
+            if other['key'] == spec['key'] and other.get('partialFilterExpression') == spec.get('partialFilterExpression'):
+                raise OperationFailure(f"Index already exists with a different name: {other['name']}", code=85)
+        if spec.get('unique'):
+            entries = {}
+            for document in self._documents.values():
+                key = self._index_key(spec, document)
+                if key is None:
+                    continue
+                if key in entries:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.full_name} index: {name} dup key: {key}",
+                        code=11000
+                    )
+                entries[key] = document['_id']
+            self._unique[name] = entries
+        self._indexes[name] = spec
+        self.exists = True
+        return name
+
+    def list_indexes(self, **kwargs) -> MemoryCursor:
+        indexes = [{'v': 2, 'key': {'_id': 1}, 'name': '_id_'}] if self.exists else []
+        return MemoryCursor(lambda: [_copy(index) for index in indexes + list(self._indexes.values())])
+
+    async def drop(self, **kwargs):
+        await self.database.drop_collection(self.name)
+
+
+# --- databases and clients ----------------------------------------------------------
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(self, name)
+        return collection
+
+    def with_options(self, *args, **kwargs) -> "MemoryDatabase":
+        return self
+
+    async def list_collection_names(self, filter: Optional[Dict[str, Any]] = None, **kwargs) -> List[str]:
+        return [
+            name for name, collection in self._collections.items()
+            if collection.exists and matches({'name': name}, filter)
+        ]
+
+    async def drop_collection(self, name_or_collection, **kwargs):
+        # Like Motor, existing handles stay usable and see an empty collection
+        collection = self._collections.get(getattr(name_or_collection, 'name', name_or_collection))
+        if collection is not None:
+            collection._clear()
+
+    async def command(self, command, value: Any = 1, **kwargs) -> Dict[str, Any]:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == 'ping':
+            return {'ok': 1.0}
+        raise OperationFailure(f"Command '{name}' is not supported by the in-memory database", code=59)
+
+
+class MemoryClient:
+    """Client for ``memory://<name>`` URLs; clients with the same URL share data"""
+
+    _stores: Dict[str, Dict[str, MemoryDatabase]] = {}
+
+    def __init__(self, url: str = SCHEME, **kwargs):
+        self.url = url
+        self._databases = self._stores.setdefault(url, {})
+        self.read_preference = Primary()
+        self.options = SimpleNamespace(pool_options=SimpleNamespace(
+            max_pool_size=0, min_pool_size=0, max_idle_time_seconds=None, wait_queue_timeout=None
+        ))
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(self, name)
+        return database
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def close(self):
+        pass
+
+    @classmethod
+    def reset(cls, url: Optional[str] = None):
+        """Empty every collection of one URL, or of every in-memory client"""
+        stores = list(cls._stores.values()) if url is None else [cls._stores.get(url, {})]
+        for databases in stores:
+            for database in databases.values():
+                for collection in database._collections.values():
+                    collection._clear()
@@ -0,0 +1,217 @@
+"""Dependency-free Prometheus metrics for the backend.
+
+Counters and histograms are plain Python ints and lists updated without
+locks: every update is a single bytecode-level operation on the event loop
+thread (or a driver thread for MongoDB events), which the GIL keeps
+consistent enough for monitoring. Per-label state is allocated the first
+time a label set is seen, so a steady-state request only bumps integers.
+
+``MetricsMiddleware`` times every HTTP request by route template,
+``MongoCommandMetrics`` times every MongoDB command by collection and
+operation, and gauges read live values (e.g. the ingest queue depth) through
+callbacks at scrape time. ``render`` produces the text exposition format.
+"""
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; fits both sub-millisecond cache hits and multi-second aggregations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = (f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """A counter incremented directly, or read from ``callback`` at scrape time"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), callback: Callable[[], float] = None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.callback = callback
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        if self.callback is not None:
+            lines.append(f"{self.name} {self.callback()}")
+        for labels, value in list(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """A gauge set directly, or read from ``callback`` at scrape time"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), callback: Callable[[], float] = None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.callback = callback
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if self.callback is not None:
+            lines.append(f"{self.name} {self.callback()}")
+        for labels, value in list(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., +Inf count, sum]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values.setdefault(labels, [0] * (len(self.buckets) + 2))
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.label_names + ("le",)
+        for labels, state in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {state[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, in-flight requests and errors per route"""
+
+    def __init__(self, app, registry: Registry):
+        self.app = app
+        self.latency = registry.histogram(
+            "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+        )
+        self.in_flight = registry.gauge("http_requests_in_flight", "HTTP requests currently being served")
+        self.errors = registry.counter(
+            "http_request_errors_total", "HTTP requests answered with a 5xx status or an exception", ("method", "route")
+        )
+        self.responses = registry.counter(
+            "http_responses_total", "HTTP responses by route and status class", ("method", "route", "status")
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            status = 500
+            raise
+        finally:
+            self.in_flight.dec()
+            # Route templates (not raw paths) keep the label cardinality bounded
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched")
+            self.latency.observe(time.perf_counter() - started, *labels)
+            self.responses.inc(*labels, f"{status // 100}xx")
+            if status >= 500:
+                self.errors.inc(*labels)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times MongoDB commands per collection and operation"""
+
+    def __init__(self, registry: Registry):
+        self.duration = registry.histogram(
+            "mongodb_command_duration_seconds", "MongoDB command latency", ("collection", "command")
+        )
+        self.failures = registry.counter(
+            "mongodb_command_failures_total", "Failed MongoDB commands", ("collection", "command")
+        )
+        self._collections: Dict[Tuple[int, int], str] = {}
+
+    @staticmethod
+    def _key(event) -> Tuple[int, int]:
+        return event.request_id, event.operation_id
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        self._collections[self._key(event)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self._collections.pop(self._key(event), "")
+        self.duration.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+    def failed(self, event):
+        collection = self._collections.pop(self._key(event), "")
+        self.duration.observe(event.duration_micros / 1e6, collection, event.command_name)
+        self.failures.inc(collection, event.command_name)
@@ -0,0 +1,127 @@
+"""Versioned schema migrations for the backend database.
+
+Migrations are plain coroutines registered with ``@migration(version, ...)``
+and applied in version order. Applied versions are recorded in the
+``schema_migrations`` collection. A lease document in the same collection
+makes sure only one replica runs migrations at a time; the others wait for
+the lease to be released and then find nothing left to do.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, NamedTuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from config_snapshot import next_config_version
+
+
+logger = logging.getLogger(__name__)
+
+LOCK_ID = 'lock'
+LOCK_LEASE = timedelta(minutes=5)
+LOCK_POLL_INTERVAL = 1.0
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[..., Awaitable[None]]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str):
+    """Register a migration coroutine taking the database as its argument"""
+    def decorator(func):
+        if any(existing.version == version for existing in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append(Migration(version, description, func))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return func
+    return decorator
+
+
+@migration(1, "Default missing bypass log success flags to true")
+async def _default_success_flag(db):
+    await db.bypass_logs.update_many({'success': {'$exists': False}}, {'$set': {'success': True}})
+
+
+@migration(2, "Remove duplicate site configs before the unique domain index")
+async def _dedupe_site_configs(db):
+    pipeline = [
+        {'$sort': {'last_updated': -1}},
+        {'$group': {'_id': '$domain', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ]
+    async for duplicate in db.site_configs.aggregate(pipeline):
+        # Keep the most recently updated document for each domain
+        await db.site_configs.delete_many({'_id': {'$in': duplicate['ids'][1:]}})
+
+
+@migration(3, "Stamp unversioned site configs for snapshot delta sync")
+async def _version_site_configs(db):
+    async for config in db.site_configs.find({'version': {'$exists': False}}, {'_id': 1}):
+        await db.site_configs.update_one({'_id': config['_id']}, {'$set': {'version': await next_config_version(db)}})
+
+
+async def _acquire_lock(collection, owner: str) -> bool:
+    now = datetime.utcnow()
+    try:
+        lock = await collection.find_one_and_update(
+            {'_id': LOCK_ID, '$or': [{'owner': None}, {'expires_at': {'$lt': now}}]},
+            {'$set': {'owner': owner, 'expires_at': now + LOCK_LEASE}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Another replica holds an unexpired lease
+        return False
+    return lock is not None and lock.get('owner') == owner
+
+
+async def _release_lock(collection, owner: str):
+    await collection.update_one({'_id': LOCK_ID, 'owner': owner}, {'$set': {'owner': None}})
+
+
+async def applied_versions(db) -> List[int]:
+    cursor = db.schema_migrations.find({'_id': {'$ne': LOCK_ID}}, {'_id': 1})
+    return sorted([doc['_id'] async for doc in cursor])
+
+
+async def run_migrations(db, migrations: List[Migration] = MIGRATIONS) -> List[int]:
+    """Apply pending migrations under the replica lock; returns applied versions"""
+    collection = db.schema_migrations
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    while not await _acquire_lock(collection, owner):
+        logger.info("Waiting for another replica to finish schema migrations")
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+    applied_now = []
+    try:
+        done = set(await applied_versions(db))
+        for pending in migrations:
+            if pending.version in done:
+                continue
+            await collection.update_one(
+                {'_id': LOCK_ID, 'owner': owner},
+                {'$set': {'expires_at': datetime.utcnow() + LOCK_LEASE}}
+            )
+            logger.info(f"Applying migration {pending.version}: {pending.description}")
+            await pending.apply(db)
+            await collection.insert_one({
+                '_id': pending.version,
+                'description': pending.description,
+                'applied_at': datetime.utcnow(),
+                'applied_by': owner
+            })
+            applied_now.append(pending.version)
+    finally:
+        await _release_lock(collection, owner)
+    return applied_now
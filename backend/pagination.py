@@ -0,0 +1,114 @@
+"""Keyset (cursor) pagination and NDJSON streaming over Motor cursors.
+
+A page is fetched by sorting on a unique key (for example ``timestamp`` then
+``_id``) and asking for the documents strictly after the last key the client
+saw. The cursor handed to clients is that last key, encoded as opaque
+URL-safe base64, so each page costs one indexed range scan whatever its depth.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+
+SortSpec = List[Tuple[str, int]]
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {'$date': value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {'$oid': str(value)}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if '$date' in value:
+            return datetime.fromisoformat(value['$date'])
+        if '$oid' in value:
+            return ObjectId(value['$oid'])
+    return value
+
+
+def encode_cursor(document: Dict[str, Any], sort: SortSpec) -> str:
+    values = [_encode_value(document.get(field)) for field, _ in sort]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: SortSpec) -> List[Any]:
+    """Decode a cursor, raising ``ValueError`` when it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(sort):
+            raise ValueError
+        return [_decode_value(value) for value in values]
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+
+def keyset_filter(sort: SortSpec, values: List[Any]) -> Dict[str, Any]:
+    """Filter selecting documents strictly after ``values`` in ``sort`` order"""
+    clauses = []
+    for position, (field, direction) in enumerate(sort):
+        clause = {prefix_field: values[index] for index, (prefix_field, _) in enumerate(sort[:position])}
+        clause[field] = {'$gt' if direction > 0 else '$lt': values[position]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+
+def _with_cursor(query: Dict[str, Any], sort: SortSpec, cursor: Optional[str]) -> Dict[str, Any]:
+    if not cursor:
+        return query
+    after = keyset_filter(sort, decode_cursor(cursor, sort))
+    return {'$and': [query, after]} if query else after
+
+
+async def fetch_page(
+    collection,
+    sort: SortSpec,
+    limit: int,
+    cursor: Optional[str] = None,
+    query: Optional[Dict[str, Any]] = None,
+    projection: Optional[Dict[str, Any]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Return up to ``limit`` documents and the cursor of the next page (or None)"""
+    documents = await collection.find(_with_cursor(query or {}, sort, cursor), projection) \
+        .sort(sort).limit(limit + 1).to_list(limit + 1)
+    if len(documents) <= limit:
+        return documents, None
+    documents = documents[:limit]
+    return documents, encode_cursor(documents[-1], sort)
+
+
+def stream_ndjson(
+    collection,
+    sort: SortSpec,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    query: Optional[Dict[str, Any]] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    transform: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    batch_size: int = 500
+) -> AsyncIterator[bytes]:
+    """Yield matching documents as NDJSON lines straight from a server-side cursor.
+
+    A malformed cursor raises ``ValueError`` right away, before the response
+    (and its status code) is sent.
+    """
+    query = _with_cursor(query or {}, sort, cursor)
+    return _stream_ndjson(collection, sort, query, limit, projection, transform, batch_size)
+
+
+async def _stream_ndjson(collection, sort, query, limit, projection, transform, batch_size) -> AsyncIterator[bytes]:
+    find_cursor = collection.find(query, projection).sort(sort).batch_size(batch_size)
+    if limit:
+        find_cursor = find_cursor.limit(limit)
+    async for document in find_cursor:
+        if transform is not None:
+            document = transform(document)
+        yield json.dumps(jsonable_encoder(document), ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
@@ -0,0 +1,203 @@
+"""Time-partitioned storage for bypass logs.
+
+With partitioning enabled, each event is written to a collection named after
+the day or month of its ``timestamp`` (``bypass_logs_20261018`` or
+``bypass_logs_202610``). Readers ask for the partitions overlapping the time
+range they need and query them together through ``$unionWith``, and the
+retention policy drops whole expired partitions instead of deleting
+documents one by one.
+
+The unpartitioned ``bypass_logs`` collection is always read as well, so
+history written before partitioning was switched on stays visible.
+"""
+import logging
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from indexes import INDEXES, ensure_collection_indexes
+
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {
+    'day': ('%Y%m%d', 8),
+    'month': ('%Y%m', 6),
+}
+
+
+def union_aggregate(collections, pipeline: List[Dict[str, Any]], match: Optional[Dict[str, Any]] = None, **kwargs):
+    """Run ``pipeline`` over several collections in one round trip.
+
+    ``match`` is applied inside every ``$unionWith`` branch so each partition
+    can use its own indexes before the documents are combined.
+    """
+    if not isinstance(collections, (list, tuple)):
+        collections = [collections]
+    first, rest = collections[0], collections[1:]
+    head = [{'$match': match}] if match else []
+    unions = [{'$unionWith': {'coll': collection.name, 'pipeline': head}} for collection in rest]
+    return first.aggregate(head + unions + pipeline, **kwargs)
+
+
+class PartitionedLogWriter:
+    """Collection-like writer routing each document to its time partition.
+
+    ``insert_many`` writes one batch per partition and goes on when one of
+    them fails, so a ``BulkWriteError`` reports every document that was not
+    stored, with the caller's indexes. Documents of a partition whose write
+    failed as a whole (connection lost...) are reported without a ``code``:
+    unlike rejected documents they can be retried. When nothing at all was
+    written, the original exception is raised instead.
+    """
+
+    def __init__(self, partitions: "LogPartitions"):
+        self.partitions = partitions
+
+    async def insert_one(self, document: Dict[str, Any]):
+        collection = await self.partitions.collection_for(document['timestamp'])
+        return await collection.insert_one(document)
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = False):
+        groups: Dict[str, List[Tuple[int, Dict[str, Any]]]] = defaultdict(list)
+        for index, document in enumerate(documents):
+            groups[self.partitions.name_for(document['timestamp'])].append((index, document))
+
+        write_errors = []
+        inserted = 0
+        failure = None
+        for name, items in groups.items():
+            try:
+                collection = await self.partitions.collection_for(items[0][1]['timestamp'])
+                await collection.insert_many([document for _, document in items], ordered=False)
+                inserted += len(items)
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                inserted += len(items) - len(errors)
+                # Report errors against the caller's indexes, not the partition batch
+                write_errors.extend({**error, 'index': items[error['index']][0]} for error in errors)
+            except Exception as e:
+                logger.error(f"Failed to write {len(items)} logs to {name}: {e}")
+                failure = failure or e
+                write_errors.extend({'index': index, 'errmsg': str(e)} for index, _ in items)
+
+        if failure is not None and len(write_errors) == len(documents):
+            raise failure
+        if write_errors:
+            raise BulkWriteError({
+                'writeErrors': sorted(write_errors, key=lambda error: error['index']),
+                'writeConcernErrors': [],
+                'nInserted': inserted,
+            })
+
+
+class LogPartitions:
+    def __init__(self, db, base_name: str = 'bypass_logs', granularity: str = 'off', retention_days: int = 0):
+        if granularity != 'off' and granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown partition granularity '{granularity}'")
+        self.db = db
+        self.base_name = base_name
+        self.granularity = granularity
+        self.retention_days = retention_days
+        self._indexed: Set[str] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.granularity != 'off'
+
+    @property
+    def writer(self):
+        """Where new logs are inserted: the base collection or a partition router"""
+        return PartitionedLogWriter(self) if self.enabled else self.db[self.base_name]
+
+    def name_for(self, timestamp: datetime) -> str:
+        if not self.enabled:
+            return self.base_name
+        return f"{self.base_name}_{timestamp.strftime(GRANULARITIES[self.granularity][0])}"
+
+    def partition_range(self, name: str) -> Optional[Tuple[datetime, datetime]]:
+        """The [start, end) time range covered by a partition name"""
+        suffix = name[len(self.base_name) + 1:]
+        for date_format, length in GRANULARITIES.values():
+            if len(suffix) != length:
+                continue
+            try:
+                start = datetime.strptime(suffix, date_format)
+            except ValueError:
+                return None
+            if length == 8:
+                return start, start + timedelta(days=1)
+            return start, (start + timedelta(days=32)).replace(day=1)
+        return None
+
+    async def collection_for(self, timestamp: datetime):
+        """The partition for a timestamp, creating its indexes on first use"""
+        name = self.name_for(timestamp)
+        collection = self.db[name]
+        if self.enabled and name not in self._indexed:
+            await ensure_collection_indexes(collection, INDEXES[self.base_name])
+            self._indexed.add(name)
+        return collection
+
+    async def partition_names(self) -> List[str]:
+        pattern = f"^{re.escape(self.base_name)}_[0-9]+$"
+        names = await self.db.list_collection_names(filter={'name': {'$regex': pattern}})
+        return sorted(name for name in names if self.partition_range(name) is not None)
+
+    async def collections(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        read_preference=None
+    ) -> List[Any]:
+        """Collections holding logs in [start, end), oldest first.
+
+        With ``read_preference`` the returned collections read with it (e.g.
+        to send analytics to secondaries), writes are unaffected.
+        """
+        collections = [self.db[self.base_name]]
+        if self.enabled:
+            for name in await self.partition_names():
+                partition_start, partition_end = self.partition_range(name)
+                if start is not None and partition_end <= start:
+                    continue
+                if end is not None and partition_start >= end:
+                    continue
+                collections.append(self.db[name])
+        if read_preference is not None:
+            collections = [collection.with_options(read_preference=read_preference) for collection in collections]
+        return collections
+
+    async def drop_expired(
+        self,
+        now: datetime,
+        before_drop: Optional[Callable[[Any], Awaitable[None]]] = None,
+        after_drop: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> List[str]:
+        """Drop every partition entirely older than the retention period.
+
+        ``before_drop(collection)`` is awaited before each partition is dropped,
+        so data derived from its logs can be adjusted; if it raises, the
+        partition is not dropped and the hook runs again on the next sweep, so
+        it must be idempotent. ``after_drop(name)`` is awaited once it is gone.
+        """
+        if not self.enabled or self.retention_days <= 0:
+            return []
+        cutoff = now - timedelta(days=self.retention_days)
+        dropped = []
+        for name in await self.partition_names():
+            _, partition_end = self.partition_range(name)
+            if partition_end <= cutoff:
+                if before_drop is not None:
+                    await before_drop(self.db[name])
+                await self.db.drop_collection(name)
+                self._indexed.discard(name)
+                dropped.append(name)
+                if after_drop is not None:
+                    await after_drop(name)
+        if dropped:
+            logger.info(f"Dropped expired log partitions: {', '.join(dropped)}")
+        return dropped
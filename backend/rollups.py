@@ -0,0 +1,164 @@
+"""Pre-aggregated counters for bypass statistics.
+
+Every stored bypass log is folded into a handful of small documents in the
+``bypass_rollups`` collection:
+
+- ``{"_id": "total"}``: all events
+- ``{"_id": "day:YYYY-MM-DD"}``: events per UTC day
+- ``{"_id": "domain:<domain>"}``: events per domain
+
+Each rollup keeps a ``count`` and a ``success`` counter, so the stats
+endpoint only reads a few documents no matter how large ``bypass_logs`` gets.
+When retention drops a log partition its logs are subtracted first, so the
+counters describe the logs that are kept, like the raw stats do. Each counter
+lists the partitions already taken out of it (``subtracted``) until they are
+dropped, so a sweep interrupted between the two steps can simply run again.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Tuple
+
+from pymongo import UpdateOne
+
+from log_codec import PLAIN_CODEC, LogCodec
+from partitions import union_aggregate
+
+
+logger = logging.getLogger(__name__)
+
+DAY_FORMAT = '%Y-%m-%d'
+
+
+def day_key(timestamp: datetime) -> str:
+    return timestamp.strftime(DAY_FORMAT)
+
+
+def _rollup_keys(document: Dict[str, Any]):
+    yield 'total', {'kind': 'total'}
+    yield f"day:{day_key(document['timestamp'])}", {'kind': 'day', 'day': day_key(document['timestamp'])}
+    yield f"domain:{document['domain']}", {'kind': 'domain', 'domain': document['domain']}
+
+
+async def fold_logs(rollups, documents: Iterable[Dict[str, Any]]):
+    """Add a batch of stored log documents to the rollup counters"""
+    counters = defaultdict(lambda: [0, 0])
+    fields = {}
+    for document in documents:
+        for key, key_fields in _rollup_keys(document):
+            counter = counters[key]
+            counter[0] += 1
+            counter[1] += 1 if document.get('success', True) else 0
+            fields[key] = key_fields
+
+    if not counters:
+        return
+
+    operations = [
+        UpdateOne(
+            {'_id': key},
+            {'$inc': {'count': count, 'success': success}, '$setOnInsert': fields[key]},
+            upsert=True
+        )
+        for key, (count, success) in counters.items()
+    ]
+    await rollups.bulk_write(operations, ordered=False)
+
+
+async def _count_logs(logs, codec: LogCodec) -> Dict[str, Tuple[Dict[str, Any], int, int]]:
+    """Rollup key -> (key fields, count, success) computed from raw logs"""
+    success_expr = {'$cond': [{'$eq': [f"${codec.field('success')}", False]}, 0, 1]}
+    group_specs = [
+        ('total', None),
+        ('day', {'$dateToString': {'format': '%Y-%m-%d', 'date': f"${codec.field('timestamp')}"}}),
+        ('domain', f"${codec.field('domain')}"),
+    ]
+
+    counts = {}
+    for kind, group_key in group_specs:
+        pipeline = [{'$group': {'_id': group_key, 'count': {'$sum': 1}, 'success': {'$sum': success_expr}}}]
+        async for doc in union_aggregate(logs, pipeline, allowDiskUse=True):
+            if kind == 'total':
+                key, key_fields = 'total', {'kind': 'total'}
+            elif kind == 'domain':
+                domain = (await codec.decode_values('domain', [doc['_id']]))[0]
+                key, key_fields = f"domain:{domain}", {'kind': 'domain', 'domain': domain}
+            else:
+                key, key_fields = f"{kind}:{doc['_id']}", {'kind': kind, kind: doc['_id']}
+            counts[key] = (key_fields, doc['count'], doc['success'])
+    return counts
+
+
+async def rebuild_rollups(logs, rollups, codec: LogCodec = PLAIN_CODEC):
+    """Recompute every rollup from the raw logs (a collection or its partitions).
+
+    Counters are written with absolute values, so running this concurrently
+    on several replicas converges to the same result.
+    """
+    operations = [
+        # Recounted from the logs still stored, so earlier subtractions no longer apply
+        UpdateOne(
+            {'_id': key},
+            {'$set': {**key_fields, 'count': count, 'success': success}, '$unset': {'subtracted': ''}},
+            upsert=True
+        )
+        for key, (key_fields, count, success) in (await _count_logs(logs, codec)).items()
+    ]
+    if operations:
+        await rollups.bulk_write(operations, ordered=False)
+    logger.info(f"Rebuilt {len(operations)} bypass rollups")
+
+
+async def subtract_logs(logs, rollups, codec: LogCodec = PLAIN_CODEC):
+    """Take the logs of ``logs`` (a partition about to be dropped) out of the counters.
+
+    Counters that already list the partition are skipped, so running this
+    again for the same partition changes nothing.
+    """
+    operations = [
+        UpdateOne(
+            {'_id': key, 'subtracted': {'$ne': logs.name}},
+            {'$inc': {'count': -count, 'success': -success}, '$addToSet': {'subtracted': logs.name}}
+        )
+        for key, (_, count, success) in (await _count_logs(logs, codec)).items()
+    ]
+    if not operations:
+        return
+    await rollups.bulk_write(operations, ordered=False)
+    # Days and domains without any log left would show up with a zero count
+    await rollups.delete_many({'kind': {'$ne': 'total'}, 'count': {'$lt': 1}})
+
+
+async def forget_subtracted(name: str, rollups):
+    """Clear the marks of a partition once it is dropped"""
+    await rollups.update_many({'subtracted': name}, {'$pull': {'subtracted': name}})
+
+
+async def read_stats(rollups, now: datetime, top_sites: int = 5) -> Dict[str, Any]:
+    """Build the bypass statistics from rollup documents only"""
+    total = await rollups.find_one({'_id': 'total'}) or {}
+
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    week_start = today_start - timedelta(days=today_start.weekday())
+    today = day_key(today_start)
+    bypasses_today = 0
+    bypasses_this_week = 0
+    async for doc in rollups.find({'kind': 'day', 'day': {'$gte': day_key(week_start)}}):
+        bypasses_this_week += doc['count']
+        if doc['day'] == today:
+            bypasses_today += doc['count']
+
+    most_bypassed_sites: List[Dict[str, Any]] = []
+    cursor = rollups.find({'kind': 'domain'}).sort('count', -1).limit(top_sites)
+    async for doc in cursor:
+        most_bypassed_sites.append({'domain': doc['domain'], 'count': doc['count']})
+
+    total_bypasses = total.get('count', 0)
+    success_rate = (total.get('success', 0) / total_bypasses * 100) if total_bypasses > 0 else 0
+    return {
+        'total_bypasses': total_bypasses,
+        'bypasses_today': bypasses_today,
+        'bypasses_this_week': bypasses_this_week,
+        'most_bypassed_sites': most_bypassed_sites,
+        'success_rate': round(success_rate, 2),
+    }
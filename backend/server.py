@@ -1,27 +1,248 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response
 from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
 import os
+import asyncio
 import logging
+import tempfile
 from pathlib import Path
-from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timedelta
 import json
 
+import database
+from log_buffer import LogWriteBuffer
+from partitions import LogPartitions
+from log_codec import PLAIN_CODEC, CompactLogCodec, EncodingWriter
+import rollups
+import stats_engine
+import indexes
+import migrations
+import analytics
+import sketches
+import export
+import fast_json
+import storage
+import metrics
+import tracing
+from config_cache import TTLCache, accepts_encoding, etag_matches, render_response
+from stats_cache import CoalescingCache
+from slow_queries import SlowQueryLog
+from config_watcher import SiteConfigTable, SiteConfigWatcher
+from config_snapshot import (
+    SnapshotHolder, build_snapshot, changed_since, current_version, deleted_version, needs_full_resync,
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Storage engine behind the routes: 'mongodb', or an embedded 'sqlite' / 'duckdb' file
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongodb')
+USE_MONGO = STORAGE_BACKEND == 'mongodb'
+
+# MongoDB connection (embedded backends don't need one, the client then stays in memory)
+mongo_url = os.environ['MONGO_URL'] if USE_MONGO else os.environ.get('MONGO_URL', 'memory://')
+# Prometheus metrics served at /metrics (HTTP latency, MongoDB command timings, queues)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+metrics_registry = metrics.Registry()
+pool_stats = database.PoolStats()
+# Commands slower than SLOW_QUERY_MS are logged with their shape (0 disables)
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100'))
+slow_query_log = SlowQueryLog(
+    threshold_ms=SLOW_QUERY_MS,
+    max_per_minute=int(os.environ.get('SLOW_QUERY_MAX_PER_MINUTE', '60')),
+    explain=os.environ.get('SLOW_QUERY_EXPLAIN', 'false').lower() == 'true',
+    explains_per_minute=int(os.environ.get('SLOW_QUERY_EXPLAINS_PER_MINUTE', '6')),
+)
+listeners = [pool_stats]
+if METRICS_ENABLED:
+    listeners.append(metrics.MongoCommandMetrics(metrics_registry))
+if SLOW_QUERY_MS > 0:
+    listeners.append(slow_query_log)
+client = database.create_client(mongo_url, *listeners)
+# Open minPoolSize connections at startup so the first requests don't pay for the handshakes
+MONGO_WARM_UP = os.environ.get('MONGO_WARM_UP', 'true').lower() == 'true'
 db = client[os.environ['DB_NAME']]
 
+# Opt-in tracing: a sampled request gets a root span and a child span per MongoDB call
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+tracer = None
+if TRACING_ENABLED:
+    tracer = tracing.Tracer(tracing.exporter_from_env(), float(os.environ.get('TRACING_SAMPLE_RATE', '0.01')))
+    db = tracing.TracedDatabase(db)
+
+# Read routing: writes always go to the primary, while dashboard analytics may
+# be served by secondaries within a staleness bound. Site config listings can be
+# routed too, but stay on the primary by default: a config read right after an
+# update must see it, or the stale copy would be cached for the whole TTL
+ANALYTICS_READ_PREFERENCE = database.read_route('ANALYTICS', 'secondaryPreferred')
+CONFIG_READ_PREFERENCE = database.read_route('CONFIG', 'primary')
+analytics_db = db.with_options(read_preference=ANALYTICS_READ_PREFERENCE)
+config_db = db.with_options(read_preference=CONFIG_READ_PREFERENCE)
+
+# Maximum number of events accepted by a single bulk log request
+BULK_LOG_MAX_ITEMS = int(os.environ.get('BULK_LOG_MAX_ITEMS', '1000'))
+
+# Schema migrations and index creation at startup
+DB_MIGRATE_ON_STARTUP = os.environ.get('DB_MIGRATE_ON_STARTUP', 'true').lower() == 'true'
+index_report: Dict[str, Any] = {}
+index_task: Optional[asyncio.Task] = None
+
+# Rendered /api/site-config responses, invalidated when rules are updated
+SITE_CONFIG_MAX_AGE = int(os.environ.get('SITE_CONFIG_MAX_AGE', '60'))
+site_config_cache = TTLCache(
+    max_entries=int(os.environ.get('SITE_CONFIG_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('SITE_CONFIG_CACHE_TTL', '300')),
+)
+
+# Serialize trusted database reads with orjson, skipping response_model validation
+FAST_JSON = os.environ.get('FAST_JSON', 'false').lower() == 'true' and fast_json.available()
+
+# Popup stats are served from a short-lived cache; concurrent misses share one
+# aggregation and expired results keep being served while they are refreshed
+stats_cache = CoalescingCache(
+    ttl=float(os.environ.get('STATS_CACHE_TTL', '5')),
+    stale_ttl=float(os.environ.get('STATS_CACHE_STALE_TTL', '30')),
+)
+
+# Columnar analytics: logs compacted into daily Parquet segments behind /api/analytics/*
+# Workers sharing ANALYTICS_DIR take turns compacting (a file lock in the directory)
+ANALYTICS_ENABLED = os.environ.get('ANALYTICS_ENABLED', 'false').lower() == 'true' and analytics.available()
+ANALYTICS_COMPACT_INTERVAL = float(os.environ.get('ANALYTICS_COMPACT_INTERVAL', '900'))
+analytics_store = analytics.SegmentStore(
+    os.environ.get('ANALYTICS_DIR', os.path.join(tempfile.gettempdir(), 'bypass-analytics'))
+)
+analytics_lock = asyncio.Lock()
+analytics_task: Optional[asyncio.Task] = None
+
+# Streaming sketches of the stored logs (approximate top domains/URLs and
+# distinct URLs/clients in /api/bypass-stats), persisted to SKETCH_PATH.
+# Sketches live in the process that writes the logs: enable them on a single
+# worker only, several would each count part of the traffic and overwrite
+# each other's file
+SKETCHES_ENABLED = os.environ.get('SKETCHES_ENABLED', 'false').lower() == 'true'
+SKETCH_PATH = os.environ.get('SKETCH_PATH', os.path.join(tempfile.gettempdir(), 'bypass-sketches.json'))
+SKETCH_PERSIST_INTERVAL = float(os.environ.get('SKETCH_PERSIST_INTERVAL', '60'))
+SKETCH_CAPACITY = int(os.environ.get('SKETCH_CAPACITY', '1000'))
+traffic_sketches = sketches.TrafficSketches(SKETCH_CAPACITY)
+sketch_task: Optional[asyncio.Task] = None
+sketch_rebuild_task: Optional[asyncio.Task] = None
+
+# In-memory copy of site_configs kept in sync by a change stream (or polling)
+CONFIG_WATCH_ENABLED = os.environ.get('CONFIG_WATCH_ENABLED', 'true').lower() == 'true'
+site_config_table = SiteConfigTable()
+site_config_table.add_listener(site_config_cache.invalidate)
+config_snapshots = SnapshotHolder()
+site_config_table.add_listener(config_snapshots.invalidate)
+site_config_watcher = SiteConfigWatcher(
+    db.site_configs,
+    site_config_table,
+    poll_interval=float(os.environ.get('CONFIG_POLL_INTERVAL', '5')),
+    load_deleted_version=lambda: deleted_version(db),
+)
+
+# Where /api/bypass-stats reads from: 'rollups' (pre-aggregated counters, MongoDB only) or 'raw'
+STATS_SOURCE = os.environ.get('STATS_SOURCE', 'rollups' if USE_MONGO else 'raw')
+
+# Storage encoding of bypass logs: 'plain' (API field names) or 'compact'
+LOG_ENCODING = os.environ.get('LOG_ENCODING', 'plain')
+log_codec = CompactLogCodec(db) if LOG_ENCODING == 'compact' else PLAIN_CODEC
+
+# Optional time partitioning of bypass logs ('off', 'day' or 'month')
+LOG_PARTITIONING = os.environ.get('LOG_PARTITIONING', 'off')
+log_partitions = LogPartitions(
+    db,
+    base_name=log_codec.collection_name,
+    granularity=LOG_PARTITIONING,
+    retention_days=int(os.environ.get('LOG_RETENTION_DAYS', '0')),
+)
+LOG_RETENTION_INTERVAL = float(os.environ.get('LOG_RETENTION_INTERVAL', '3600'))
+retention_task: Optional[asyncio.Task] = None
+log_writer = EncodingWriter(log_partitions.writer, log_codec) if log_codec.compact else log_partitions.writer
+
+if USE_MONGO:
+    repositories = storage.Storage(
+        storage.MongoLogRepository(
+            db, analytics_db, log_writer, log_partitions, log_codec, STATS_SOURCE, ANALYTICS_READ_PREFERENCE
+        ),
+        storage.MongoSiteConfigRepository(db, config_db),
+        storage.MongoStatusCheckRepository(db),
+    )
+else:
+    storage.check_embedded_options(LOG_PARTITIONING, LOG_ENCODING, STATS_SOURCE)
+    repositories = storage.open_embedded(STORAGE_BACKEND, os.environ.get('STORAGE_PATH', f'bypass.{STORAGE_BACKEND}'))
+
+async def after_logs_stored(documents: List[Dict[str, Any]]):
+    """Update everything derived from the logs once a batch is stored"""
+    if SKETCHES_ENABLED:
+        traffic_sketches.add_logs(documents)
+    await repositories.logs.after_insert(documents)
+
+# Write-behind buffer for single-event log inserts (group commit)
+LOG_BUFFER_ENABLED = os.environ.get('LOG_BUFFER_ENABLED', 'true').lower() == 'true'
+log_buffer = LogWriteBuffer(
+    repositories.logs,
+    max_batch_size=int(os.environ.get('LOG_BUFFER_MAX_BATCH', '500')),
+    flush_interval=float(os.environ.get('LOG_BUFFER_FLUSH_INTERVAL', '0.5')),
+    max_queue_size=int(os.environ.get('LOG_BUFFER_MAX_QUEUE', '10000')),
+    max_retries=int(os.environ.get('LOG_BUFFER_MAX_RETRIES', '3')),
+    retry_backoff=float(os.environ.get('LOG_BUFFER_RETRY_BACKOFF', '0.5')),
+    on_flush=after_logs_stored,
+)
+
+metrics_registry.gauge(
+    "log_buffer_queue_depth", "Bypass log events waiting to be written", callback=lambda: log_buffer.queue_depth
+)
+metrics_registry.counter(
+    "log_buffer_flushed_documents_total", "Bypass log events written by the buffer",
+    callback=lambda: log_buffer.flushed_documents
+)
+metrics_registry.counter(
+    "log_buffer_retries_total", "Bypass log batch writes retried after an error",
+    callback=lambda: log_buffer.retries
+)
+metrics_registry.counter(
+    "log_buffer_dropped_documents_total", "Bypass log events lost on write errors",
+    callback=lambda: log_buffer.dropped_documents
+)
+metrics_registry.counter(
+    "stats_cache_hits_total", "Popup stats served from cache (fresh or stale)",
+    callback=lambda: stats_cache.hits + stats_cache.stale_hits
+)
+metrics_registry.counter(
+    "stats_cache_misses_total", "Popup stats requests that waited for a computation",
+    callback=lambda: stats_cache.misses
+)
+metrics_registry.gauge(
+    "mongodb_pool_connections_in_use", "Checked-out MongoDB connections", callback=lambda: pool_stats.in_use
+)
+metrics_registry.gauge(
+    "mongodb_pool_checkouts_waiting", "Requests waiting for a MongoDB connection", callback=lambda: pool_stats.waiting
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if USE_MONGO:
+        await warm_up_db()
+        await migrate_db()
+        await start_config_watcher()
+        await start_log_retention()
+        await prepare_mongo_logs()
+    await repositories.open()
+    await load_sketches()
+    await start_log_buffer()
+    await start_analytics()
+    await start_sketch_persistence()
+    yield
+    await shutdown_db_client()
+
 # Create the main app without a prefix
-app = FastAPI(title="Bypass Paywalls Clean - Backend", version="1.0.0")
+app = FastAPI(title="Bypass Paywalls Clean - Backend", version="1.0.0", lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -37,6 +258,19 @@ class BypassLog(BaseModel):
     user_agent: Optional[str] = None
     success: bool = True
 
+    @classmethod
+    def from_create(cls, data: "BypassLogCreate") -> "BypassLog":
+        """Build a log from an already-validated request without validating it again"""
+        return cls.model_construct(
+            id=str(uuid.uuid4()),
+            action=data.action,
+            domain=data.domain,
+            url=data.url,
+            timestamp=datetime.utcnow(),
+            user_agent=data.user_agent,
+            success=data.success,
+        )
+
 class BypassLogCreate(BaseModel):
     action: str
     domain: str
@@ -44,6 +278,17 @@ class BypassLogCreate(BaseModel):
     user_agent: Optional[str] = None
     success: bool = True
 
+class BulkLogItemResult(BaseModel):
+    index: int
+    accepted: bool
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkLogResponse(BaseModel):
+    accepted: int
+    rejected: int
+    results: List[BulkLogItemResult]
+
 class SiteConfig(BaseModel):
     domain: str
     name: str
@@ -52,12 +297,32 @@ class SiteConfig(BaseModel):
     notes: Optional[str] = None
     last_updated: datetime = Field(default_factory=datetime.utcnow)
 
+class ApproximateStats(BaseModel):
+    since: datetime
+    events: int
+    unique_urls: int
+    unique_clients: int
+    clients_since: datetime
+    distinct_relative_error: float
+    top_domains: List[Dict[str, Any]]  # {"domain", "count", "error"}: count - error <= true count <= count
+    top_urls: List[Dict[str, Any]]
+
 class BypassStats(BaseModel):
     total_bypasses: int
     bypasses_today: int
     bypasses_this_week: int
     most_bypassed_sites: List[Dict[str, Any]]
     success_rate: float
+    approximate: Optional[ApproximateStats] = None
+
+class WindowStats(BaseModel):
+    window: str
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    total_bypasses: int
+    successful_bypasses: int
+    most_bypassed_sites: List[Dict[str, Any]]
+    success_rate: float
 
 class UpdateRulesResponse(BaseModel):
     success: bool
@@ -76,95 +341,210 @@ class StatusCheckCreate(BaseModel):
 
 
 # Bypass Extension Routes
+def record_client(request: Request):
+    """Count the sender among the distinct clients (address and user agent, hashed)"""
+    if SKETCHES_ENABLED and request.client is not None:
+        traffic_sketches.add_client(f"{request.client.host}|{request.headers.get('user-agent', '')}")
+
 @api_router.post("/bypass-log", response_model=BypassLog)
-async def log_bypass_action(log_data: BypassLogCreate):
+async def log_bypass_action(log_data: BypassLogCreate, request: Request):
     """Log bypass actions from the Chrome extension"""
-    log_dict = log_data.dict()
-    log_obj = BypassLog(**log_dict)
-    
+    log_obj = BypassLog.from_create(log_data)
+    record_client(request)
+
     try:
-        await db.bypass_logs.insert_one(log_obj.dict())
-        return log_obj
+        await log_buffer.put(log_obj.model_dump())
+        return fast_json.FastJSONResponse(log_obj) if FAST_JSON else log_obj
     except Exception as e:
         logging.error(f"Failed to log bypass action: {e}")
         raise HTTPException(status_code=500, detail="Failed to log action")
 
+def parse_bulk_log_body(body: bytes, content_type: str) -> List[Any]:
+    """Split a bulk log body (JSON array or NDJSON) into raw items.
+
+    Unparseable NDJSON lines are returned as ``ValueError`` instances so they
+    can be rejected individually instead of failing the whole batch.
+    """
+    text = body.decode('utf-8').strip()
+    if not text:
+        return []
+
+    if 'ndjson' not in content_type and 'jsonl' not in content_type and text.startswith('['):
+        try:
+            items = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON array: {e}")
+        if not isinstance(items, list):
+            raise ValueError("Expected a JSON array of events")
+        return items
+
+    items = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except json.JSONDecodeError as e:
+            items.append(ValueError(f"Invalid JSON line: {e}"))
+    return items
+
+@api_router.post("/bypass-log/bulk", response_model=BulkLogResponse)
+async def log_bypass_actions_bulk(request: Request):
+    """Log a batch of bypass actions (JSON array or NDJSON body)"""
+    try:
+        items = parse_bulk_log_body(await request.body(), request.headers.get('content-type', ''))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    record_client(request)
+
+    if len(items) > BULK_LOG_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(items)} events (max {BULK_LOG_MAX_ITEMS})"
+        )
+
+    # Validate every item in one pass, keeping track of where each valid
+    # document came from so write errors can be mapped back to the request.
+    results = []
+    documents = []
+    document_indexes = []
+    for index, item in enumerate(items):
+        if isinstance(item, ValueError):
+            results.append(BulkLogItemResult(index=index, accepted=False, error=str(item)))
+            continue
+        if not isinstance(item, dict):
+            results.append(BulkLogItemResult(index=index, accepted=False, error="Event must be a JSON object"))
+            continue
+        try:
+            log_obj = BypassLog.from_create(BypassLogCreate.model_validate(item))
+        except ValidationError as e:
+            error = "; ".join(
+                f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors()
+            )
+            results.append(BulkLogItemResult(index=index, accepted=False, error=error))
+            continue
+        results.append(BulkLogItemResult.model_construct(index=index, accepted=True, id=log_obj.id, error=None))
+        documents.append(log_obj.model_dump())
+        document_indexes.append(index)
+
+    if documents:
+        stored = documents
+        try:
+            await repositories.logs.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            failed = set()
+            for write_error in e.details.get('writeErrors', []):
+                failed.add(write_error['index'])
+                result = results[document_indexes[write_error['index']]]
+                result.accepted = False
+                result.id = None
+                result.error = write_error.get('errmsg', 'Write failed')
+            stored = [document for index, document in enumerate(documents) if index not in failed]
+        except Exception as e:
+            logging.error(f"Failed to log bypass actions: {e}")
+            raise HTTPException(status_code=500, detail="Failed to log actions")
+
+        try:
+            await after_logs_stored(stored)
+        except Exception as e:
+            logging.error(f"Failed to update bypass rollups: {e}")
+
+    accepted = sum(1 for result in results if result.accepted)
+    return BulkLogResponse(
+        accepted=accepted,
+        rejected=len(results) - accepted,
+        results=results
+    )
+
+async def load_bypass_stats() -> BypassStats:
+    stats = await repositories.logs.stats(datetime.utcnow())
+    if SKETCHES_ENABLED and sketches_ready():
+        stats['approximate'] = traffic_sketches.summary()
+    return BypassStats(**stats)
+
 @api_router.get("/bypass-stats", response_model=BypassStats)
 async def get_bypass_stats():
     """Get bypass statistics for the extension popup"""
     try:
-        # Get total bypasses
-        total_bypasses = await db.bypass_logs.count_documents({})
-        
-        # Get today's bypasses
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        bypasses_today = await db.bypass_logs.count_documents({
-            "timestamp": {"$gte": today_start}
-        })
-        
-        # Get this week's bypasses
-        week_start = today_start - timedelta(days=today_start.weekday())
-        bypasses_this_week = await db.bypass_logs.count_documents({
-            "timestamp": {"$gte": week_start}
-        })
-        
-        # Get most bypassed sites
-        pipeline = [
-            {"$group": {"_id": "$domain", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 5}
-        ]
-        most_bypassed_cursor = db.bypass_logs.aggregate(pipeline)
-        most_bypassed_sites = []
-        async for doc in most_bypassed_cursor:
-            most_bypassed_sites.append({
-                "domain": doc["_id"],
-                "count": doc["count"]
-            })
-        
-        # Calculate success rate
-        successful_bypasses = await db.bypass_logs.count_documents({"success": True})
-        success_rate = (successful_bypasses / total_bypasses * 100) if total_bypasses > 0 else 0
-        
-        return BypassStats(
-            total_bypasses=total_bypasses,
-            bypasses_today=bypasses_today,
-            bypasses_this_week=bypasses_this_week,
-            most_bypassed_sites=most_bypassed_sites,
-            success_rate=round(success_rate, 2)
-        )
+        stats = await stats_cache.get("popup", load_bypass_stats)
+        return fast_json.FastJSONResponse(stats) if FAST_JSON else stats
     except Exception as e:
         logging.error(f"Failed to get bypass stats: {e}")
         raise HTTPException(status_code=500, detail="Failed to get statistics")
 
-@api_router.get("/site-config/{domain}")
-async def get_site_config(domain: str):
-    """Get configuration for a specific site"""
+@api_router.get("/bypass-stats/cache")
+async def get_stats_cache_metrics():
+    """Get hit/miss counts and refresh timings of the stats cache"""
+    return stats_cache.metrics()
+
+@api_router.get("/bypass-stats/window", response_model=WindowStats)
+async def get_bypass_window_stats(
+    window: str = "today",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    top_sites: int = Query(5, ge=1, le=100)
+):
+    """Get bypass statistics for a named (today/week/month/all) or custom time window"""
     try:
-        config = await db.site_configs.find_one({"domain": domain})
-        if config:
-            # Remove MongoDB ObjectId for JSON serialization
-            if '_id' in config:
-                del config['_id']
-            return config
-        else:
-            # Return default config for lefigaro.fr or None for unsupported sites
-            if domain == "lefigaro.fr":
-                return {
-                    "domain": "lefigaro.fr",
-                    "name": "Le Figaro",
-                    "enabled": True,
-                    "methods": {
-                        "removeCookies": ["PHPSESSID", "_ga", "_gid", "tarteaucitron"],
-                        "useragent": "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
-                        "referer": "https://www.google.com/",
-                        "techniques": ["cookies", "useragent", "referer", "archive"]
-                    }
-                }
-            return None
+        window_start, window_end = stats_engine.resolve_window(window, datetime.utcnow(), start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        stats = await repositories.logs.window_stats(window_start, window_end, top_sites)
+        if FAST_JSON:
+            return fast_json.FastJSONResponse({"window": window, **stats})
+        return WindowStats(window=window, **stats)
     except Exception as e:
-        logging.error(f"Failed to get site config: {e}")
-        raise HTTPException(status_code=500, detail="Failed to get site configuration")
+        logging.error(f"Failed to get window stats: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get statistics")
+
+async def load_site_config(domain: str) -> Optional[Dict[str, Any]]:
+    """Read a site configuration, falling back to built-in defaults"""
+    if site_config_table.loaded:
+        config = site_config_table.get(domain)
+    else:
+        config = await repositories.site_configs.get(domain)
+    if config:
+        # Remove MongoDB ObjectId for JSON serialization
+        if '_id' in config:
+            del config['_id']
+        return config
+    # Return default config for lefigaro.fr or None for unsupported sites
+    if domain == "lefigaro.fr":
+        return {
+            "domain": "lefigaro.fr",
+            "name": "Le Figaro",
+            "enabled": True,
+            "methods": {
+                "removeCookies": ["PHPSESSID", "_ga", "_gid", "tarteaucitron"],
+                "useragent": "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+                "referer": "https://www.google.com/",
+                "techniques": ["cookies", "useragent", "referer", "archive"]
+            }
+        }
+    return None
+
+@api_router.get("/site-config/{domain}")
+async def get_site_config(domain: str, request: Request):
+    """Get configuration for a specific site"""
+    cached = site_config_cache.get(domain)
+    if cached is None:
+        try:
+            config = await load_site_config(domain)
+        except Exception as e:
+            logging.error(f"Failed to get site config: {e}")
+            raise HTTPException(status_code=500, detail="Failed to get site configuration")
+        cached = site_config_cache.set(domain, render_response(config))
+
+    headers = {
+        "ETag": cached.etag,
+        "Cache-Control": f"public, max-age={SITE_CONFIG_MAX_AGE}, must-revalidate"
+    }
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
 
 @api_router.post("/update-rules", response_model=UpdateRulesResponse)
 async def update_bypass_rules():
@@ -194,11 +574,11 @@ async def update_bypass_rules():
             "last_updated": datetime.utcnow()
         }
         
-        await db.site_configs.replace_one(
-            {"domain": "lefigaro.fr"},
-            lefigaro_config,
-            upsert=True
-        )
+        lefigaro_config = await repositories.site_configs.upsert(lefigaro_config)
+        if site_config_table.loaded:
+            # Visible here right away, other workers catch up through the watcher
+            site_config_table.upsert(lefigaro_config)
+        site_config_cache.invalidate("lefigaro.fr")
         
         return UpdateRulesResponse(
             success=True,
@@ -209,18 +589,94 @@ async def update_bypass_rules():
         logging.error(f"Failed to update rules: {e}")
         raise HTTPException(status_code=500, detail="Failed to update rules")
 
+async def latest_deleted_version() -> int:
+    """The last config deletion version, read from the database only when the table can't tell"""
+    if site_config_table.loaded and not site_config_table.deletion_pending:
+        return site_config_table.deleted_version
+    version = await repositories.site_configs.deleted_version()
+    if site_config_table.loaded:
+        site_config_table.set_deleted_version(version)
+    return version
+
+@api_router.get("/site-configs/snapshot")
+async def get_site_configs_snapshot(request: Request):
+    """Get every site configuration as one versioned, precompressed document"""
+    try:
+        deleted = await latest_deleted_version()
+        if site_config_table.loaded:
+            snapshot = config_snapshots.get(site_config_table.all, deleted)
+        else:
+            snapshot = build_snapshot(await repositories.site_configs.all(), deleted)
+    except Exception as e:
+        logging.error(f"Failed to build site config snapshot: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get site configuration snapshot")
+
+    gzipped = accepts_encoding(request.headers.get("accept-encoding"), "gzip")
+    etag = snapshot.gzip_etag if gzipped else snapshot.etag
+    headers = {
+        "ETag": etag,
+        "X-Config-Version": str(snapshot.version),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding"
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=snapshot.gzipped_body, media_type="application/json", headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+@api_router.get("/site-configs/delta")
+async def get_site_configs_delta(since: int = Query(0, ge=0)):
+    """Get the site configurations changed after a snapshot version"""
+    try:
+        deleted = await latest_deleted_version()
+        if site_config_table.loaded:
+            documents = site_config_table.all()
+            version = current_version(documents)
+            changed = changed_since(documents, since)
+        else:
+            version, changed = await repositories.site_configs.changes(since)
+    except Exception as e:
+        logging.error(f"Failed to get site config delta: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get site configuration changes")
+
+    version = max(version, deleted)
+    return {
+        "version": version,
+        "since": since,
+        # Deletions can't be sent as a delta, and a client ahead of the server
+        # (e.g. after a restore) is out of sync: both must fetch a new snapshot
+        "full_resync": needs_full_resync(since, version, deleted),
+        "sites": changed
+    }
+
+def page_headers(request: Request, next_cursor: Optional[str]) -> Dict[str, str]:
+    """Headers pointing clients at the next page of a keyset-paginated list"""
+    if not next_cursor:
+        return {}
+    next_url = request.url.include_query_params(cursor=next_cursor)
+    return {"X-Next-Cursor": next_cursor, "Link": f'<{next_url}>; rel="next"'}
+
 @api_router.get("/supported-sites")
-async def get_supported_sites():
-    """Get list of all supported sites"""
+async def get_supported_sites(
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    stream: bool = False
+):
+    """Get list of all supported sites (paginated by domain, or streamed as NDJSON)"""
     try:
-        sites = await db.site_configs.find({}).to_list(100)
-        # Convert MongoDB documents to JSON-serializable format
-        serializable_sites = []
-        for site in sites:
-            if '_id' in site:
-                del site['_id']  # Remove MongoDB ObjectId
-            serializable_sites.append(site)
-        return serializable_sites
+        if stream:
+            return StreamingResponse(repositories.site_configs.stream(cursor), media_type="application/x-ndjson")
+        sites, next_cursor = await repositories.site_configs.page(limit, cursor)
+        if FAST_JSON:
+            return fast_json.FastJSONResponse(sites, headers=page_headers(request, next_cursor))
+        response.headers.update(page_headers(request, next_cursor))
+        return sites
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Failed to get supported sites: {e}")
         raise HTTPException(status_code=500, detail="Failed to get supported sites")
@@ -234,15 +690,8 @@ async def test_bypass(url: str):
         domain = parsed_url.netloc.replace('www.', '')
         
         # Log the test
-        test_log = BypassLogCreate(
-            action="test_bypass",
-            domain=domain,
-            url=url,
-            success=True
-        )
-        
-        log_obj = BypassLog(**test_log.dict())
-        await db.bypass_logs.insert_one(log_obj.dict())
+        log_obj = BypassLog(action="test_bypass", domain=domain, url=url, success=True)
+        await log_buffer.put(log_obj.model_dump())
         
         return {
             "success": True,
@@ -254,6 +703,129 @@ async def test_bypass(url: str):
         logging.error(f"Failed to test bypass: {e}")
         raise HTTPException(status_code=500, detail="Failed to test bypass")
 
+@api_router.get("/db/indexes")
+async def get_index_report():
+    """Get the result of the last index check (created, drifted and undeclared indexes)"""
+    return index_report
+
+@api_router.get("/db/pool")
+async def get_pool_stats():
+    """Get connection pool settings and live usage counters"""
+    options = client.options.pool_options
+    return {
+        "max_pool_size": options.max_pool_size,
+        "min_pool_size": options.min_pool_size,
+        "max_idle_time_seconds": options.max_idle_time_seconds,
+        "wait_queue_timeout": options.wait_queue_timeout,
+        "read_preference": client.read_preference.mongos_mode,
+        **pool_stats.snapshot()
+    }
+
+@api_router.get("/db/slow-queries")
+async def get_slow_queries(limit: int = Query(50, ge=1, le=200)):
+    """Get the most recent slow MongoDB commands with their query shapes"""
+    return {
+        "threshold_ms": SLOW_QUERY_MS,
+        "suppressed": slow_query_log.suppressed,
+        "queries": list(slow_query_log.entries)[-limit:]
+    }
+
+@api_router.get("/traces")
+async def get_recent_traces(limit: int = Query(20, ge=1, le=1000)):
+    """Get the most recent sampled traces (tracing with the memory exporter only)"""
+    if tracer is None or not isinstance(tracer.exporter, tracing.MemoryExporter):
+        raise HTTPException(status_code=404, detail="Tracing with the memory exporter is not enabled")
+    return list(tracer.exporter.traces)[-limit:]
+
+@api_router.get("/export/bypass-logs")
+async def export_bypass_logs(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: str = "ndjson",
+    fields: Optional[str] = None,
+    batch_size: int = Query(export.DEFAULT_BATCH_SIZE, ge=100, le=50000)
+):
+    """Stream bypass logs in [start, end) as NDJSON or Parquet"""
+    if format == "parquet" and not export.parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pandas and pyarrow")
+    try:
+        chunks = repositories.logs.export_chunks(
+            start, end, format, fields.split(",") if fields else None, batch_size
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Failed to export bypass logs: {e}")
+        raise HTTPException(status_code=500, detail="Failed to export bypass logs")
+
+    media_type = "application/vnd.apache.parquet" if format == "parquet" else "application/x-ndjson"
+    extension = "parquet" if format == "parquet" else "ndjson"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="bypass_logs.{extension}"'}
+    )
+
+def require_analytics():
+    if not ANALYTICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Analytics are not enabled")
+
+@api_router.get("/analytics/timeseries")
+async def get_analytics_timeseries(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    interval: str = "hour",
+    by: Optional[str] = None,
+    domain: Optional[str] = None,
+    action: Optional[str] = None,
+    top: int = Query(10, ge=1, le=100)
+):
+    """Get event counts and success rates per hour or day (optionally per domain or action)"""
+    require_analytics()
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=7)
+    try:
+        # Segment reads and group-bys run off the event loop
+        series = await asyncio.to_thread(
+            analytics.timeseries, analytics_store, start, end, interval, by, domain, action, top
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Failed to query analytics: {e}")
+        raise HTTPException(status_code=500, detail="Failed to query analytics")
+
+    result = {
+        "interval": interval,
+        "start": start,
+        "end": end,
+        "by": by,
+        "compacted_through": analytics_store.compacted_through,
+        "series": series
+    }
+    return fast_json.FastJSONResponse(result) if FAST_JSON else result
+
+@api_router.get("/analytics/segments")
+async def get_analytics_segments():
+    """Get the compacted daily segments and how recent they are"""
+    require_analytics()
+    return {
+        "compacted_through": analytics_store.compacted_through,
+        "segments": await asyncio.to_thread(analytics_store.segments)
+    }
+
+@api_router.post("/analytics/compact")
+async def compact_analytics_now():
+    """Compact the logs logged since the last run into the analytics segments"""
+    require_analytics()
+    try:
+        async with analytics_lock:
+            days = await analytics.compact(repositories.logs, analytics_store, datetime.utcnow())
+    except Exception as e:
+        logging.error(f"Failed to compact analytics segments: {e}")
+        raise HTTPException(status_code=500, detail="Failed to compact analytics segments")
+    return {"compacted_days": days, "compacted_through": await asyncio.to_thread(lambda: analytics_store.compacted_through)}
+
 # Legacy routes (keeping for compatibility)
 @api_router.get("/")
 async def root():
@@ -262,29 +834,68 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "bypass-log": "POST - Log bypass actions",
+            "bypass-log/bulk": "POST - Log a batch of bypass actions (JSON array or NDJSON)",
             "bypass-stats": "GET - Get bypass statistics",
+            "bypass-stats/window": "GET - Get bypass statistics for a time window",
+            "bypass-stats/cache": "GET - Get stats cache metrics",
             "site-config/{domain}": "GET - Get site configuration",
             "update-rules": "POST - Update bypass rules",
             "supported-sites": "GET - Get supported sites list",
-            "test-bypass": "POST - Test bypass for URL"
+            "site-configs/snapshot": "GET - Get all site configs as a versioned snapshot",
+            "site-configs/delta": "GET - Get site configs changed since a snapshot version",
+            "test-bypass": "POST - Test bypass for URL",
+            "db/indexes": "GET - Get index drift report",
+            "db/pool": "GET - Get connection pool statistics",
+            "db/slow-queries": "GET - Get recent slow MongoDB commands",
+            "traces": "GET - Get recent request traces (when tracing is enabled)",
+            "export/bypass-logs": "GET - Stream bypass logs as NDJSON or Parquet",
+            "analytics/timeseries": "GET - Get hourly or daily bypass time series (when analytics are enabled)",
+            "analytics/segments": "GET - Get compacted analytics segments",
+            "analytics/compact": "POST - Compact recent logs into analytics segments"
         }
     }
 
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
-    status_dict = input.dict()
-    status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
+    status_obj = StatusCheck.model_construct(
+        id=str(uuid.uuid4()), client_name=input.client_name, timestamp=datetime.utcnow()
+    )
+    await repositories.status_checks.insert(status_obj.model_dump())
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
+async def get_status_checks(
+    request: Request,
+    response: Response,
+    limit: int = Query(1000, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    stream: bool = False
+):
+    try:
+        if stream:
+            return StreamingResponse(repositories.status_checks.stream(cursor), media_type="application/x-ndjson")
+        status_checks, next_cursor = await repositories.status_checks.page(limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if FAST_JSON:
+        return fast_json.FastJSONResponse(status_checks, headers=page_headers(request, next_cursor))
+    response.headers.update(page_headers(request, next_cursor))
     return [StatusCheck(**status_check) for status_check in status_checks]
 
 # Include the router in the main app
 app.include_router(api_router)
 
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        """Prometheus scrape endpoint"""
+        return Response(content=metrics_registry.render(), media_type=metrics.CONTENT_TYPE)
+
+    app.add_middleware(metrics.MetricsMiddleware, registry=metrics_registry)
+
+if TRACING_ENABLED:
+    app.add_middleware(tracing.TracingMiddleware, tracer=tracer)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -300,6 +911,162 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
+async def build_indexes():
+    global index_report
+    index_report = await indexes.ensure_indexes(db)
+
+async def warm_up_db():
+    slow_query_log.start(client, asyncio.get_running_loop())
+    if not MONGO_WARM_UP:
+        return
+    try:
+        await database.warm_up(client, client.options.pool_options.min_pool_size)
+    except Exception as e:
+        logger.error(f"Failed to warm up MongoDB connection pool: {e}")
+
+async def migrate_db():
+    if not DB_MIGRATE_ON_STARTUP:
+        return
+    try:
+        applied = await migrations.run_migrations(db)
+        if applied:
+            logger.info(f"Applied schema migrations: {applied}")
+    except Exception as e:
+        logger.error(f"Failed to run schema migrations: {e}")
+    # Index builds can take a while on large collections, don't block startup
+    global index_task
+    index_task = asyncio.create_task(build_indexes())
+
+async def start_config_watcher():
+    if not CONFIG_WATCH_ENABLED:
+        return
+    try:
+        await site_config_watcher.start()
+    except Exception as e:
+        logger.error(f"Failed to start site config watcher: {e}")
+
+async def enforce_log_retention():
+    while True:
+        try:
+            # Rollups follow the logs: a dropped partition's counts are subtracted first
+            await log_partitions.drop_expired(
+                datetime.utcnow(),
+                before_drop=lambda partition: rollups.subtract_logs(partition, db.bypass_rollups, log_codec),
+                after_drop=lambda name: rollups.forget_subtracted(name, db.bypass_rollups)
+            )
+        except Exception as e:
+            logger.error(f"Failed to drop expired log partitions: {e}")
+        await asyncio.sleep(LOG_RETENTION_INTERVAL)
+
+async def start_log_retention():
+    global retention_task
+    if log_partitions.enabled and log_partitions.retention_days > 0:
+        retention_task = asyncio.create_task(enforce_log_retention())
+
+async def prepare_mongo_logs():
+    try:
+        await log_codec.load()
+    except Exception as e:
+        logger.error(f"Failed to load log dictionary: {e}")
+
+    # Backfill the rollups once from existing history before accepting writes
+    if STATS_SOURCE == 'rollups':
+        try:
+            if await db.bypass_rollups.find_one({'_id': 'total'}) is None:
+                await rollups.rebuild_rollups(await log_partitions.collections(), db.bypass_rollups, log_codec)
+        except Exception as e:
+            logger.error(f"Failed to rebuild bypass rollups: {e}")
+
+async def run_analytics_compaction():
+    while True:
+        try:
+            async with analytics_lock:
+                await analytics.compact(repositories.logs, analytics_store, datetime.utcnow())
+        except Exception as e:
+            logger.error(f"Failed to compact analytics segments: {e}")
+        await asyncio.sleep(ANALYTICS_COMPACT_INTERVAL)
+
+async def start_analytics():
+    global analytics_task
+    if ANALYTICS_ENABLED:
+        analytics_task = asyncio.create_task(run_analytics_compaction())
+
+def sketches_ready() -> bool:
+    """False until the history is folded into the sketches (a failed rebuild is retried on the next start)"""
+    if sketch_rebuild_task is None:
+        return True
+    return sketch_rebuild_task.done() and not sketch_rebuild_task.cancelled() and sketch_rebuild_task.result()
+
+async def load_sketches():
+    global traffic_sketches, sketch_rebuild_task
+    if not SKETCHES_ENABLED:
+        return
+    try:
+        loaded = await asyncio.to_thread(sketches.load, SKETCH_PATH)
+        if loaded is not None:
+            traffic_sketches = loaded
+            return
+    except Exception as e:
+        logger.error(f"Failed to load traffic sketches, rebuilding them: {e}")
+
+    # First start: fold the existing history in without holding up startup.
+    # Logs are stamped when received, so history ends at the cutoff and newer
+    # events are only counted live
+    traffic_sketches = sketches.TrafficSketches(SKETCH_CAPACITY)
+    sketch_rebuild_task = asyncio.create_task(rebuild_sketches(traffic_sketches, datetime.utcnow()))
+
+async def rebuild_sketches(target: sketches.TrafficSketches, cutoff: datetime) -> bool:
+    try:
+        await sketches.rebuild(repositories.logs, target, end=cutoff)
+    except Exception as e:
+        logger.error(f"Failed to rebuild traffic sketches: {e}")
+        return False
+    try:
+        await save_sketches()
+    except Exception as e:
+        logger.error(f"Failed to persist traffic sketches: {e}")
+    return True
+
+async def save_sketches():
+    data = traffic_sketches.to_json()
+    traffic_sketches.dirty = False
+    await asyncio.to_thread(sketches.save, SKETCH_PATH, data)
+
+async def persist_sketches():
+    while True:
+        await asyncio.sleep(SKETCH_PERSIST_INTERVAL)
+        # A partial rebuild isn't saved, or the next start would take it as complete
+        if traffic_sketches.dirty and sketches_ready():
+            try:
+                await save_sketches()
+            except Exception as e:
+                logger.error(f"Failed to persist traffic sketches: {e}")
+
+async def start_sketch_persistence():
+    global sketch_task
+    if SKETCHES_ENABLED:
+        sketch_task = asyncio.create_task(persist_sketches())
+
+async def start_log_buffer():
+    if LOG_BUFFER_ENABLED:
+        log_buffer.start()
+
 async def shutdown_db_client():
+    # Drain pending log inserts before the connection goes away
+    await log_buffer.close()
+    if sketch_task is not None:
+        sketch_task.cancel()
+        if sketches_ready():
+            try:
+                await save_sketches()
+            except Exception as e:
+                logger.error(f"Failed to persist traffic sketches: {e}")
+    if sketch_rebuild_task is not None:
+        sketch_rebuild_task.cancel()
+    await site_config_watcher.stop()
+    if retention_task is not None:
+        retention_task.cancel()
+    if analytics_task is not None:
+        analytics_task.cancel()
+    await repositories.close()
     client.close()
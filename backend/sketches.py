@@ -0,0 +1,310 @@
+"""Streaming sketches of bypass traffic: heavy hitters and distinct counts.
+
+``TrafficSketches`` is updated with every batch of stored logs and answers,
+in constant time and memory whatever the history size:
+
+- the most bypassed domains and URLs: Space-Saving keeps the candidates
+  (every key seen more than ``events / capacity`` times is guaranteed to be
+  among them) and a Count-Min sketch tightens their counts. Both only ever
+  overestimate, so a reported count is an upper bound and ``error`` says by
+  how much it can be too high.
+- the number of distinct URLs and clients: HyperLogLog, with a relative
+  standard error of ``1.04 / sqrt(2 ** precision)`` (0.8% by default).
+
+Sketches are kept in memory by the process that writes the logs and
+persisted to a JSON file, so one writer process is assumed: with several
+workers each one would only see its share of the traffic, and they would
+overwrite each other's file.
+"""
+import base64
+import hashlib
+import heapq
+import json
+import math
+import os
+from array import array
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+def hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+
+
+def _encode(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii')
+
+
+def _decode(data: str) -> bytes:
+    return base64.b64decode(data)
+
+
+class HyperLogLog:
+    """Distinct count estimator using ``2 ** precision`` one-byte registers"""
+
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+        # Number of registers holding each rank, so estimates don't scan the registers
+        self._histogram = [0] * (64 - precision + 2)
+        self._histogram[0] = self.size
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self.size)
+
+    def add_hash(self, hashed: int):
+        index = hashed >> (64 - self.precision)
+        rest_bits = 64 - self.precision
+        rank = rest_bits - (hashed & ((1 << rest_bits) - 1)).bit_length() + 1
+        current = self.registers[index]
+        if rank > current:
+            self.registers[index] = rank
+            self._histogram[current] -= 1
+            self._histogram[rank] += 1
+
+    def add(self, value: str):
+        self.add_hash(hash64(value))
+
+    def estimate(self) -> int:
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        harmonic = sum(count * 2.0 ** -rank for rank, count in enumerate(self._histogram) if count)
+        estimate = alpha * size * size / harmonic
+        zeros = self._histogram[0]
+        if estimate <= 2.5 * size and zeros:
+            # Small range: linear counting is more accurate
+            estimate = size * math.log(size / zeros)
+        return int(round(estimate))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'precision': self.precision, 'registers': _encode(bytes(self.registers))}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HyperLogLog":
+        sketch = cls(data['precision'])
+        registers = _decode(data['registers'])
+        if len(registers) != sketch.size:
+            raise ValueError("HyperLogLog registers don't match the precision")
+        sketch.registers = bytearray(registers)
+        sketch._histogram = [0] * len(sketch._histogram)
+        for rank in sketch.registers:
+            sketch._histogram[rank] += 1
+        return sketch
+
+
+class CountMinSketch:
+    """Frequency upper bounds, too high by at most ``e / width * total`` with
+    probability ``1 - exp(-depth)``"""
+
+    def __init__(self, width: int = 2048, depth: int = 5):
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.rows = [array('Q', bytes(8 * width)) for _ in range(depth)]
+
+    def _indexes(self, hashed: int):
+        # Double hashing: depth indexes from the two halves of one 64-bit hash
+        low, high = hashed & 0xFFFFFFFF, (hashed >> 32) | 1
+        return [(low + row * high) % self.width for row in range(self.depth)]
+
+    def add_hash(self, hashed: int, count: int = 1):
+        self.total += count
+        for row, index in zip(self.rows, self._indexes(hashed)):
+            row[index] += count
+
+    def estimate_hash(self, hashed: int) -> int:
+        return min(row[index] for row, index in zip(self.rows, self._indexes(hashed)))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'width': self.width, 'depth': self.depth, 'total': self.total,
+            'rows': [_encode(row.tobytes()) for row in self.rows],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CountMinSketch":
+        sketch = cls(data['width'], data['depth'])
+        sketch.total = data['total']
+        for row, encoded in zip(sketch.rows, data['rows']):
+            values = array('Q')
+            values.frombytes(_decode(encoded))
+            if len(values) != sketch.width:
+                raise ValueError("Count-Min row doesn't match the width")
+            row[:] = values
+        return sketch
+
+
+class SpaceSaving:
+    """The ``capacity`` most frequent keys, each with a count and its maximum overestimate"""
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        # Key -> [count, error]
+        self.counters: Dict[str, List[int]] = {}
+        # Lazy min-heap of (count, key); entries whose count changed since are skipped
+        self._heap: List[Tuple[int, str]] = []
+
+    def add(self, key: str, count: int = 1):
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += count
+        elif len(self.counters) < self.capacity:
+            counter = self.counters[key] = [count, 0]
+        else:
+            # Evict the smallest counter; the newcomer may have been seen that often before
+            minimum, evicted = self._pop_min()
+            del self.counters[evicted]
+            counter = self.counters[key] = [minimum + count, minimum]
+        heapq.heappush(self._heap, (counter[0], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(counter[0], key) for key, counter in self.counters.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self) -> Tuple[int, str]:
+        while True:
+            count, key = heapq.heappop(self._heap)
+            counter = self.counters.get(key)
+            if counter is not None and counter[0] == count:
+                return count, key
+
+    def top(self, n: int) -> List[Tuple[str, int, int]]:
+        """(key, count, error) of the ``n`` largest counters"""
+        largest = heapq.nsmallest(n, self.counters.items(), key=lambda item: (-item[1][0], item[0]))
+        return [(key, count, error) for key, (count, error) in largest]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'capacity': self.capacity, 'counters': [[key, *counter] for key, counter in self.counters.items()]}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SpaceSaving":
+        sketch = cls(data['capacity'])
+        sketch.counters = {key: [count, error] for key, count, error in data['counters']}
+        sketch._heap = [(counter[0], key) for key, counter in sketch.counters.items()]
+        heapq.heapify(sketch._heap)
+        return sketch
+
+
+class HeavyHitters:
+    """Space-Saving candidates with Count-Min counts"""
+
+    def __init__(self, capacity: int = 1000, width: int = 2048, depth: int = 5):
+        self.candidates = SpaceSaving(capacity)
+        self.counts = CountMinSketch(width, depth)
+
+    def add(self, key: str, count: int = 1) -> int:
+        hashed = hash64(key)
+        self.candidates.add(key, count)
+        self.counts.add_hash(hashed, count)
+        return hashed
+
+    def top(self, n: int, field: str) -> List[Dict[str, Any]]:
+        top = []
+        for key, count, error in self.candidates.top(n):
+            # Both structures overestimate, so the smaller count is the tighter bound
+            bound = min(count, self.counts.estimate_hash(hash64(key)))
+            # Space-Saving also guarantees at least count - error occurrences
+            top.append({field: key, 'count': bound, 'error': bound - (count - error)})
+        top.sort(key=lambda item: item['count'], reverse=True)
+        return top
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'candidates': self.candidates.to_dict(), 'counts': self.counts.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HeavyHitters":
+        sketch = cls.__new__(cls)
+        sketch.candidates = SpaceSaving.from_dict(data['candidates'])
+        sketch.counts = CountMinSketch.from_dict(data['counts'])
+        return sketch
+
+
+class TrafficSketches:
+    def __init__(self, capacity: int = 1000, precision: int = 14, since: Optional[datetime] = None):
+        self.since = since or datetime.utcnow()
+        self.events = 0
+        self.domains = HeavyHitters(capacity)
+        self.urls = HeavyHitters(capacity)
+        self.distinct_urls = HyperLogLog(precision)
+        self.distinct_clients = HyperLogLog(precision)
+        # Clients aren't stored with the logs, so they are only counted since this time
+        self.clients_since = self.since
+        self.dirty = False
+
+    def add_logs(self, documents: Iterable[Dict[str, Any]]):
+        """Add a batch of stored log documents"""
+        domains, urls = Counter(), Counter()
+        for document in documents:
+            domains[document['domain']] += 1
+            urls[document['url']] += 1
+        for domain, count in domains.items():
+            self.domains.add(domain, count)
+        for url, count in urls.items():
+            self.distinct_urls.add_hash(self.urls.add(url, count))
+        self.events += sum(domains.values())
+        self.dirty = self.dirty or bool(domains)
+
+    def add_client(self, client: str):
+        self.distinct_clients.add(client)
+        self.dirty = True
+
+    def summary(self, top: int = 5) -> Dict[str, Any]:
+        return {
+            'since': self.since,
+            'events': self.events,
+            'unique_urls': self.distinct_urls.estimate(),
+            'unique_clients': self.distinct_clients.estimate(),
+            'clients_since': self.clients_since,
+            'distinct_relative_error': round(self.distinct_urls.relative_error, 4),
+            'top_domains': self.domains.top(top, 'domain'),
+            'top_urls': self.urls.top(top, 'url'),
+        }
+
+    def to_json(self) -> bytes:
+        return json.dumps({
+            'since': self.since.isoformat(),
+            'clients_since': self.clients_since.isoformat(),
+            'events': self.events,
+            'domains': self.domains.to_dict(),
+            'urls': self.urls.to_dict(),
+            'distinct_urls': self.distinct_urls.to_dict(),
+            'distinct_clients': self.distinct_clients.to_dict(),
+        }).encode()
+
+    @classmethod
+    def from_json(cls, data: bytes) -> "TrafficSketches":
+        data = json.loads(data)
+        sketches = cls.__new__(cls)
+        sketches.since = datetime.fromisoformat(data['since'])
+        sketches.clients_since = datetime.fromisoformat(data['clients_since'])
+        sketches.events = data['events']
+        sketches.domains = HeavyHitters.from_dict(data['domains'])
+        sketches.urls = HeavyHitters.from_dict(data['urls'])
+        sketches.distinct_urls = HyperLogLog.from_dict(data['distinct_urls'])
+        sketches.distinct_clients = HyperLogLog.from_dict(data['distinct_clients'])
+        sketches.dirty = False
+        return sketches
+
+
+def load(path: str) -> Optional[TrafficSketches]:
+    try:
+        with open(path, 'rb') as f:
+            return TrafficSketches.from_json(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def save(path: str, data: bytes):
+    """Replace the sketch file atomically with ``data`` (from ``to_json``)"""
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+async def rebuild(logs, sketches: TrafficSketches, end: Optional[datetime] = None, batch_size: int = 5000):
+    """Add every log stored before ``end`` to ``sketches`` (clients can't be recovered)"""
+    async for batch in logs.batches(None, end, ['domain', 'url'], batch_size):
+        sketches.add_logs(batch)
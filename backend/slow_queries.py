@@ -0,0 +1,169 @@
+"""Slow MongoDB command log with optional explain capture.
+
+``SlowQueryLog`` is a pymongo ``CommandListener``: every command slower than
+the threshold is recorded with its query shape (field names and operators,
+literal values replaced by ``"?"``), collection and duration, logged as a
+warning and kept in a small in-memory ring for ``/api/db/slow-queries``.
+
+For slow reads (find, aggregate, count, distinct) the ``queryPlanner``
+explain output can be captured as well. Explains run on the event loop via
+Motor, at most once per shape per window, and both records and explains are
+rate limited so a burst of slow queries can't turn into a burst of extra
+load on the database.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from bson import json_util
+from pymongo import monitoring
+
+
+logger = logging.getLogger(__name__)
+
+EXPLAINABLE = ('find', 'aggregate', 'count', 'distinct')
+# Driver-added fields that are not part of the query itself
+COMMAND_METADATA = ('lsid', '$db', '$clusterTime', '$readPreference', 'txnNumber', 'apiVersion', '$readConcern')
+# Fields holding documents rather than a query
+PAYLOAD_FIELDS = ('documents', 'updates', 'deletes')
+
+
+def query_shape(value: Any) -> Any:
+    """Keep the structure, field names, operators and $field paths; hide literals"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, dict) for item in value):
+            return [query_shape(item) for item in value]
+        return '?'
+    if isinstance(value, str) and value.startswith('$'):
+        return value
+    return '?'
+
+
+def command_shape(command_name: str, command: Dict[str, Any]) -> Dict[str, Any]:
+    shape = {'command': command_name, 'collection': command.get(command_name)}
+    for key, value in command.items():
+        if key == command_name or key in COMMAND_METADATA:
+            continue
+        if key in PAYLOAD_FIELDS:
+            shape[key] = len(value) if isinstance(value, list) else '?'
+        else:
+            shape[key] = query_shape(value)
+    return shape
+
+
+class RateLimiter:
+    """Token bucket allowing ``per_minute`` events with bursts of the same size"""
+
+    def __init__(self, per_minute: int, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self._clock = clock
+        self._updated = clock()
+
+    def allow(self) -> bool:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    def __init__(
+        self,
+        threshold_ms: float = 100,
+        max_per_minute: int = 60,
+        explain: bool = False,
+        explains_per_minute: int = 6,
+        explain_interval: float = 600,
+        max_entries: int = 200,
+    ):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.entries = deque(maxlen=max_entries)
+        self.suppressed = 0
+        self._records = RateLimiter(max_per_minute)
+        self._explains = RateLimiter(explains_per_minute)
+        self._explained: Dict[str, float] = {}
+        self._pending: Dict[Tuple[int, int], Tuple[str, Dict[str, Any]]] = {}
+        self._client = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self, client, loop: asyncio.AbstractEventLoop):
+        """Enable explain capture, run through ``client`` on ``loop``"""
+        self._client = client
+        self._loop = loop
+
+    def started(self, event):
+        if event.command_name != 'explain':
+            self._pending[(event.request_id, event.operation_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        pending = self._pending.pop((event.request_id, event.operation_id), None)
+        duration_ms = event.duration_micros / 1000
+        if pending is None or duration_ms < self.threshold_ms:
+            return
+        if not self._records.allow():
+            self.suppressed += 1
+            return
+
+        database_name, command = pending
+        shape = command_shape(event.command_name, command)
+        shape_id = hashlib.sha1(json.dumps(shape, sort_keys=True, default=str).encode()).hexdigest()[:12]
+        entry = {
+            'time': time.time(),
+            'database': database_name,
+            'duration_ms': round(duration_ms, 3),
+            'shape_id': shape_id,
+            'shape': shape,
+            'failed': isinstance(event, monitoring.CommandFailedEvent),
+        }
+        self.entries.append(entry)
+        logger.warning(f"Slow MongoDB {event.command_name} on {shape['collection']} ({duration_ms:.1f} ms): "
+                       f"{json.dumps(shape, default=str)}")
+
+        if self._should_explain(event.command_name, shape_id):
+            explain = {key: value for key, value in command.items() if key not in COMMAND_METADATA}
+            self._loop.call_soon_threadsafe(
+                lambda: asyncio.ensure_future(self._capture_explain(entry, database_name, explain))
+            )
+
+    def _should_explain(self, command_name: str, shape_id: str) -> bool:
+        if not self.explain or self._loop is None or command_name not in EXPLAINABLE:
+            return False
+        now = time.monotonic()
+        if now - self._explained.get(shape_id, float('-inf')) < self.explain_interval:
+            return False
+        if not self._explains.allow():
+            return False
+        self._explained[shape_id] = now
+        return True
+
+    async def _capture_explain(self, entry: Dict[str, Any], database_name: str, command: Dict[str, Any]):
+        try:
+            result = await self._client[database_name].command(
+                {'explain': command, 'verbosity': 'queryPlanner'}
+            )
+            plan = result.get('queryPlanner') or {
+                key: value for key, value in result.items() if key not in ('ok', 'operationTime', '$clusterTime')
+            }
+            # Extended JSON, so BSON types in the plan stay serializable
+            entry['explain'] = json.loads(json_util.dumps(plan))
+        except Exception as e:
+            entry['explain_error'] = str(e)
@@ -0,0 +1,103 @@
+"""Short-lived result cache for expensive read endpoints.
+
+``CoalescingCache`` serves a value for ``ttl`` seconds, then keeps serving
+it for up to ``stale_ttl`` more seconds while a single background task
+recomputes it (stale-while-revalidate). Concurrent misses for the same key
+share one in-flight computation (single flight), so a burst of identical
+requests costs one aggregation instead of one per request.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingCache:
+    def __init__(self, ttl: float = 5.0, stale_ttl: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.last_refresh_seconds = 0.0
+        self.total_refresh_seconds = 0.0
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            'refreshes': self.refreshes,
+            'refresh_errors': self.refresh_errors,
+            'last_refresh_seconds': round(self.last_refresh_seconds, 6),
+            'avg_refresh_seconds': round(self.total_refresh_seconds / self.refreshes, 6) if self.refreshes else 0.0,
+        }
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for ``key``, computing it with ``loader`` when needed"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = self._clock() - entry[0]
+            if age < self.ttl:
+                self.hits += 1
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    self._start(key, loader).add_done_callback(self._log_refresh_error)
+                return entry[1]
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._start(key, loader)
+        else:
+            self.coalesced += 1
+        # Shield so one cancelled request doesn't cancel the computation others wait on
+        return await asyncio.shield(task)
+
+    def invalidate(self, key: Hashable = None):
+        """Drop one entry, or everything when no key is given"""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def _start(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = asyncio.create_task(self._refresh(key, loader))
+        self._inflight[key] = task
+        return task
+
+    async def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        started = self._clock()
+        try:
+            value = await loader()
+        except Exception:
+            self.refresh_errors += 1
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        elapsed = self._clock() - started
+        self.refreshes += 1
+        self.last_refresh_seconds = elapsed
+        self.total_refresh_seconds += elapsed
+        self._entries[key] = (self._clock(), value)
+        return value
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            # The stale value keeps being served until a refresh succeeds
+            logger.error(f"Background cache refresh failed: {task.exception()}")
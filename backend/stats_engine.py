@@ -0,0 +1,184 @@
+"""Single-pass statistics over the raw bypass logs.
+
+All counters are computed by one ``$facet`` aggregation, so each request is a
+single round trip that reads every matching document once. Time windows are
+resolved through a small registry, which makes it easy to add new dashboard
+ranges next to ``today``, ``week`` and ``month``. The functions accept a
+single collection or the list of log partitions covering the window, and a
+``LogCodec`` describing how the log documents are stored.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from log_codec import PLAIN_CODEC, LogCodec
+from partitions import union_aggregate
+
+
+Window = Tuple[Optional[datetime], Optional[datetime]]
+
+WINDOWS: Dict[str, Callable[[datetime], Window]] = {}
+
+
+def register_window(name: str):
+    """Register a function mapping "now" to a (start, end) window"""
+    def decorator(func: Callable[[datetime], Window]):
+        WINDOWS[name] = func
+        return func
+    return decorator
+
+
+def _day_start(now: datetime) -> datetime:
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+@register_window('all')
+def _all_time(now: datetime) -> Window:
+    return None, None
+
+
+@register_window('today')
+def _today(now: datetime) -> Window:
+    return _day_start(now), None
+
+
+@register_window('week')
+def _this_week(now: datetime) -> Window:
+    today_start = _day_start(now)
+    return today_start - timedelta(days=today_start.weekday()), None
+
+
+@register_window('month')
+def _this_month(now: datetime) -> Window:
+    return _day_start(now).replace(day=1), None
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Logs are stored with naive UTC timestamps, so bounds are compared that way"""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def resolve_window(
+    name: str,
+    now: datetime,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> Window:
+    """Turn a window name (or ``custom`` with explicit bounds) into a naive UTC range"""
+    if name == 'custom':
+        start, end = _naive_utc(start), _naive_utc(end)
+        if start is None and end is None:
+            raise ValueError("A custom window needs a start and/or an end")
+        if start is not None and end is not None and start >= end:
+            raise ValueError("Window start must be before its end")
+        return start, end
+    if name not in WINDOWS:
+        raise ValueError(f"Unknown window '{name}' (expected one of: {', '.join(sorted(WINDOWS))}, custom)")
+    return WINDOWS[name](now)
+
+
+def _timestamp_filter(
+    start: Optional[datetime],
+    end: Optional[datetime],
+    codec: LogCodec = PLAIN_CODEC
+) -> Dict[str, Any]:
+    bounds = {}
+    if start is not None:
+        bounds['$gte'] = start
+    if end is not None:
+        bounds['$lt'] = end
+    return {codec.field('timestamp'): bounds} if bounds else {}
+
+
+def _count_facet(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    stages = [{'$match': match}] if match else []
+    return stages + [{'$count': 'n'}]
+
+
+def _top_sites_facet(top_sites: int, codec: LogCodec) -> List[Dict[str, Any]]:
+    return [
+        {'$group': {'_id': f"${codec.field('domain')}", 'count': {'$sum': 1}}},
+        {'$sort': {'count': -1}},
+        {'$limit': top_sites},
+    ]
+
+
+def _facet_count(result: Dict[str, Any], name: str) -> int:
+    return result[name][0]['n'] if result.get(name) else 0
+
+
+async def _top_sites(result: Dict[str, Any], codec: LogCodec) -> List[Dict[str, Any]]:
+    top_sites = result.get('top_sites', [])
+    domains = await codec.decode_values('domain', [doc['_id'] for doc in top_sites])
+    return [{'domain': domain, 'count': doc['count']} for domain, doc in zip(domains, top_sites)]
+
+
+def build_stats_pipeline(now: datetime, top_sites: int = 5, codec: LogCodec = PLAIN_CODEC) -> List[Dict[str, Any]]:
+    """Pipeline producing every popup counter in one pass"""
+    today_start, _ = resolve_window('today', now)
+    week_start, _ = resolve_window('week', now)
+    return [{'$facet': {
+        'total': _count_facet({}),
+        'today': _count_facet(_timestamp_filter(today_start, None, codec)),
+        'week': _count_facet(_timestamp_filter(week_start, None, codec)),
+        'success': _count_facet({codec.field('success'): True}),
+        'top_sites': _top_sites_facet(top_sites, codec),
+    }}]
+
+
+def build_window_pipeline(top_sites: int = 5, codec: LogCodec = PLAIN_CODEC) -> List[Dict[str, Any]]:
+    """Pipeline producing totals, success count and top sites for the matched window"""
+    return [{'$facet': {
+        'total': _count_facet({}),
+        'success': _count_facet({codec.field('success'): True}),
+        'top_sites': _top_sites_facet(top_sites, codec),
+    }}]
+
+
+async def _run_facet(collections, pipeline: List[Dict[str, Any]], match: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    results = await union_aggregate(collections, pipeline, match).to_list(1)
+    return results[0] if results else {}
+
+
+async def compute_stats(
+    collections,
+    now: datetime,
+    top_sites: int = 5,
+    codec: LogCodec = PLAIN_CODEC
+) -> Dict[str, Any]:
+    """Popup statistics (same shape as ``BypassStats``) in a single round trip"""
+    result = await _run_facet(collections, build_stats_pipeline(now, top_sites, codec))
+    total_bypasses = _facet_count(result, 'total')
+    successful = _facet_count(result, 'success')
+    success_rate = (successful / total_bypasses * 100) if total_bypasses > 0 else 0
+    return {
+        'total_bypasses': total_bypasses,
+        'bypasses_today': _facet_count(result, 'today'),
+        'bypasses_this_week': _facet_count(result, 'week'),
+        'most_bypassed_sites': await _top_sites(result, codec),
+        'success_rate': round(success_rate, 2),
+    }
+
+
+async def compute_window_stats(
+    collections,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    top_sites: int = 5,
+    codec: LogCodec = PLAIN_CODEC
+) -> Dict[str, Any]:
+    """Totals, success rate and top sites restricted to ``[start, end)``"""
+    pipeline = build_window_pipeline(top_sites, codec)
+    result = await _run_facet(collections, pipeline, _timestamp_filter(start, end, codec))
+    total_bypasses = _facet_count(result, 'total')
+    successful = _facet_count(result, 'success')
+    success_rate = (successful / total_bypasses * 100) if total_bypasses > 0 else 0
+    return {
+        'start': start,
+        'end': end,
+        'total_bypasses': total_bypasses,
+        'successful_bypasses': successful,
+        'most_bypassed_sites': await _top_sites(result, codec),
+        'success_rate': round(success_rate, 2),
+    }
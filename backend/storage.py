@@ -0,0 +1,681 @@
+"""Storage backends behind the API routes.
+
+Routes reach bypass logs, site configs and status checks through three
+repositories, so the engine can be picked per deployment with
+``STORAGE_BACKEND``:
+
+- ``mongodb`` (default): Motor, with the partitioning, compact encoding,
+  rollups and read routing configured in ``server.py``
+- ``sqlite``: one embedded file (``STORAGE_PATH``), for small edge nodes
+- ``duckdb``: one embedded columnar file, for deployments whose load is
+  mostly analytics over the logs; batches are appended through a DataFrame
+  and aggregations scan only the columns they need
+
+Log repositories are collection-like writers (``insert_one`` and
+``insert_many`` raising ``BulkWriteError`` with per-index errors), so the
+write-behind buffer and the bulk route work unchanged on every engine.
+The embedded engines run every statement on one storage thread, which keeps
+the event loop free and serializes access to their connection.
+They have no partitions, compact encoding or rollups, and stats are always
+computed from the raw logs: ``check_embedded_options`` refuses those settings.
+"""
+import asyncio
+import json
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import BulkWriteError
+
+import export
+import pagination
+import rollups
+import stats_engine
+from config_snapshot import changed_since, deleted_version, next_config_version, record_config_deletion
+
+try:
+    import duckdb
+except ImportError:  # Only needed with STORAGE_BACKEND=duckdb
+    duckdb = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+
+BACKENDS = ('mongodb', 'sqlite', 'duckdb')
+
+# Keyset pagination order for list endpoints (must end with a unique field)
+SITE_SORT = [("domain", 1)]
+STATUS_SORT = [("timestamp", 1), ("_id", 1)]
+# Embedded tables have no _id; status checks are unique by their id
+SQL_STATUS_SORT = [("timestamp", 1), ("id", 1)]
+
+STREAM_BATCH_SIZE = 500
+
+
+class LogRepository(ABC):
+    @abstractmethod
+    async def insert_one(self, document: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = False):
+        ...
+
+    async def after_insert(self, documents: List[Dict[str, Any]]):
+        """Update data derived from the logs once ``documents`` are stored"""
+
+    @abstractmethod
+    async def stats(self, now: datetime, top_sites: int = 5) -> Dict[str, Any]:
+        """Popup statistics, shaped like ``BypassStats``"""
+
+    @abstractmethod
+    async def window_stats(
+        self, start: Optional[datetime], end: Optional[datetime], top_sites: int = 5
+    ) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def batches(
+        self,
+        start: Optional[datetime],
+        end: Optional[datetime],
+        fields: List[str],
+        batch_size: int = export.DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Logs in ``[start, end)`` in timestamp order, as batches of API field dicts"""
+
+    def export_chunks(
+        self,
+        start: Optional[datetime],
+        end: Optional[datetime],
+        export_format: str,
+        fields: Optional[List[str]],
+        batch_size: int
+    ) -> AsyncIterator[bytes]:
+        """Byte chunks of a time-range export; raises ``ValueError`` on bad arguments"""
+        fields = export.check_arguments(export_format, fields)
+        return export.encode_batches(self.batches(start, end, fields, batch_size), export_format, fields)
+
+
+class SiteConfigRepository(ABC):
+    @abstractmethod
+    async def get(self, domain: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def upsert(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        """Store ``config`` by domain, stamped with the next snapshot version"""
+
+    @abstractmethod
+    async def delete(self, domain: str) -> bool:
+        """Remove the config of a domain and record the deletion version"""
+
+    @abstractmethod
+    async def all(self) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def changes(self, since: int) -> Tuple[int, List[Dict[str, Any]]]:
+        """Current version and the configs changed after ``since``"""
+
+    @abstractmethod
+    async def deleted_version(self) -> int:
+        """Version of the last deletion, 0 if nothing was ever deleted"""
+
+    @abstractmethod
+    async def page(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        ...
+
+    @abstractmethod
+    def stream(self, cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+        ...
+
+
+class StatusCheckRepository(ABC):
+    @abstractmethod
+    async def insert(self, document: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def page(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        ...
+
+    @abstractmethod
+    def stream(self, cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+        ...
+
+
+class Storage:
+    def __init__(self, logs: LogRepository, site_configs: SiteConfigRepository, status_checks: StatusCheckRepository):
+        self.logs = logs
+        self.site_configs = site_configs
+        self.status_checks = status_checks
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+# --- MongoDB -------------------------------------------------------------------
+
+class MongoLogRepository(LogRepository):
+    def __init__(self, db, analytics_db, writer, partitions, codec, stats_source: str = 'rollups', read_preference=None):
+        self.db = db
+        self.analytics_db = analytics_db
+        self.writer = writer
+        self.partitions = partitions
+        self.codec = codec
+        self.stats_source = stats_source
+        self.read_preference = read_preference
+
+    async def insert_one(self, document: Dict[str, Any]):
+        return await self.writer.insert_one(document)
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = False):
+        return await self.writer.insert_many(documents, ordered=ordered)
+
+    async def after_insert(self, documents: List[Dict[str, Any]]):
+        await rollups.fold_logs(self.db.bypass_rollups, documents)
+
+    async def stats(self, now: datetime, top_sites: int = 5) -> Dict[str, Any]:
+        if self.stats_source == 'rollups':
+            return await rollups.read_stats(self.analytics_db.bypass_rollups, now, top_sites)
+        return await stats_engine.compute_stats(
+            await self.partitions.collections(read_preference=self.read_preference), now, top_sites, self.codec
+        )
+
+    async def window_stats(self, start, end, top_sites: int = 5) -> Dict[str, Any]:
+        collections = await self.partitions.collections(start, end, self.read_preference)
+        return await stats_engine.compute_window_stats(collections, start, end, top_sites, codec=self.codec)
+
+    async def batches(self, start, end, fields, batch_size=export.DEFAULT_BATCH_SIZE):
+        collections = await self.partitions.collections(start, end, self.read_preference)
+        async for batch in export.iter_log_batches(collections, start, end, fields, batch_size, self.codec):
+            yield batch
+
+
+class MongoSiteConfigRepository(SiteConfigRepository):
+    def __init__(self, db, config_db):
+        self.db = db
+        self.config_db = config_db
+
+    async def get(self, domain: str) -> Optional[Dict[str, Any]]:
+        # Always the primary: the result is cached, including right after update-rules
+        return await self.db.site_configs.find_one({"domain": domain})
+
+    async def upsert(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        config = {**config, "version": await next_config_version(self.db)}
+        await self.db.site_configs.replace_one({"domain": config["domain"]}, config, upsert=True)
+        return config
+
+    async def delete(self, domain: str) -> bool:
+        # Delete before recording, so a client told to resync never gets the deleted config back
+        result = await self.db.site_configs.delete_many({"domain": domain})
+        if not result.deleted_count:
+            return False
+        await record_config_deletion(self.db)
+        return True
+
+    async def all(self) -> List[Dict[str, Any]]:
+        return await self.config_db.site_configs.find({}).to_list(None)
+
+    async def changes(self, since: int) -> Tuple[int, List[Dict[str, Any]]]:
+        # Counter and documents must come from the same node, so stay on the primary
+        counter = await self.db.counters.find_one({"_id": "site_configs"}) or {}
+        changed = changed_since(await self.db.site_configs.find({"version": {"$gt": since}}).to_list(None), since)
+        return counter.get('seq', 0), changed
+
+    async def deleted_version(self) -> int:
+        return await deleted_version(self.db)
+
+    async def page(self, limit: int, cursor: Optional[str] = None):
+        return await pagination.fetch_page(self.config_db.site_configs, SITE_SORT, limit, cursor, projection={"_id": 0})
+
+    def stream(self, cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+        return pagination.stream_ndjson(self.config_db.site_configs, SITE_SORT, cursor, projection={"_id": 0})
+
+
+class MongoStatusCheckRepository(StatusCheckRepository):
+    def __init__(self, db):
+        self.db = db
+
+    async def insert(self, document: Dict[str, Any]):
+        await self.db.status_checks.insert_one(document)
+
+    async def page(self, limit: int, cursor: Optional[str] = None):
+        # _id is part of the sort key, so it is only dropped after the cursor is encoded
+        documents, next_cursor = await pagination.fetch_page(self.db.status_checks, STATUS_SORT, limit, cursor)
+        for document in documents:
+            del document["_id"]
+        return documents, next_cursor
+
+    def stream(self, cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+        return pagination.stream_ndjson(self.db.status_checks, STATUS_SORT, cursor, projection={"_id": 0})
+
+
+# --- Embedded SQL engines ----------------------------------------------------------
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Naive UTC at millisecond precision, the way MongoDB stores timestamps"""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def _keyset_clause(sort, cursor: Optional[str]) -> Tuple[str, List[Any]]:
+    """Row-value condition selecting rows after ``cursor`` (ascending sorts only)"""
+    if not cursor:
+        return "", []
+    values = pagination.decode_cursor(cursor, sort)
+    columns = ", ".join(field for field, _ in sort)
+    return f"WHERE ({columns}) > ({', '.join('?' for _ in sort)})", values
+
+
+def _ndjson(document: Dict[str, Any]) -> bytes:
+    return json.dumps(jsonable_encoder(document), ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+
+
+def _stream_pages(fetch_page, cursor: Optional[str], sort) -> AsyncIterator[bytes]:
+    if cursor:
+        # Raise ValueError for a malformed cursor now, not once streaming started
+        pagination.decode_cursor(cursor, sort)
+    return _iter_pages(fetch_page, cursor)
+
+
+async def _iter_pages(fetch_page, cursor: Optional[str]) -> AsyncIterator[bytes]:
+    while True:
+        documents, cursor = await fetch_page(STREAM_BATCH_SIZE, cursor)
+        for document in documents:
+            yield _ndjson(document)
+        if cursor is None:
+            return
+
+
+class SQLStorage(Storage, ABC):
+    """Shared implementation of the embedded engines (DB-API with ``?`` parameters)"""
+
+    SCHEMA: List[str] = []
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        super().__init__(SQLLogRepository(self), SQLSiteConfigRepository(self), SQLStatusCheckRepository(self))
+
+    @abstractmethod
+    def connect(self):
+        """Open the DB-API connection (called on the storage thread)"""
+
+    def to_db_time(self, value: datetime) -> Any:
+        return _utc(value)
+
+    def from_db_time(self, value: Any) -> datetime:
+        return value
+
+    def insert_log_rows(self, rows: List[Tuple]):
+        self.connection.executemany("INSERT INTO bypass_logs VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    @abstractmethod
+    def is_constraint_error(self, error: Exception) -> bool:
+        """Whether ``error`` rejects the row itself (retrying can't succeed)"""
+
+    def rollback(self):
+        self.connection.rollback()
+
+    async def run(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def fetch(self, sql: str, params=()) -> List[Tuple]:
+        return await self.run(lambda: self.connection.execute(sql, list(params)).fetchall())
+
+    async def open(self):
+        def create():
+            self.connection = self.connect()
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+            self.connection.commit()
+        await self.run(create)
+
+    async def close(self):
+        if self.connection is not None:
+            await self.run(self.connection.close)
+            self.connection = None
+        self._executor.shutdown(wait=False)
+
+
+class SQLiteStorage(SQLStorage):
+    # Timestamps are stored as fixed-width ISO text, which sorts like the times it holds
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS bypass_logs (id TEXT PRIMARY KEY, action TEXT NOT NULL, domain TEXT NOT NULL, "
+        "url TEXT NOT NULL, timestamp TEXT NOT NULL, user_agent TEXT, success BOOLEAN NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS bypass_logs_timestamp ON bypass_logs (timestamp)",
+        "CREATE INDEX IF NOT EXISTS bypass_logs_domain ON bypass_logs (domain)",
+        "CREATE TABLE IF NOT EXISTS site_configs (domain TEXT PRIMARY KEY, version INTEGER NOT NULL, document TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS site_configs_version ON site_configs (version)",
+        "CREATE TABLE IF NOT EXISTS config_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS status_checks (id TEXT PRIMARY KEY, client_name TEXT NOT NULL, timestamp TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS status_checks_timestamp_id ON status_checks (timestamp, id)",
+    ]
+
+    def connect(self):
+        import sqlite3
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def to_db_time(self, value: datetime) -> Any:
+        return _utc(value).isoformat(sep=' ', timespec='microseconds')
+
+    def is_constraint_error(self, error: Exception) -> bool:
+        import sqlite3
+        return isinstance(error, sqlite3.IntegrityError)
+
+    def from_db_time(self, value: Any) -> datetime:
+        return datetime.fromisoformat(value)
+
+
+class DuckDBStorage(SQLStorage):
+    # No primary key on the logs: appends stay cheap and scans rely on zone maps
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS bypass_logs (id VARCHAR NOT NULL, action VARCHAR NOT NULL, domain VARCHAR NOT NULL, "
+        "url VARCHAR NOT NULL, timestamp TIMESTAMP NOT NULL, user_agent VARCHAR, success BOOLEAN NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS site_configs (domain VARCHAR PRIMARY KEY, version BIGINT NOT NULL, document VARCHAR NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS config_counters (name VARCHAR PRIMARY KEY, value BIGINT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS status_checks (id VARCHAR PRIMARY KEY, client_name VARCHAR NOT NULL, timestamp TIMESTAMP NOT NULL)",
+    ]
+
+    def connect(self):
+        if duckdb is None:
+            raise RuntimeError("STORAGE_BACKEND=duckdb requires the duckdb package")
+        return duckdb.connect(self.path)
+
+    def rollback(self):
+        # Statements autocommit, and a failed one leaves nothing behind
+        pass
+
+    def is_constraint_error(self, error: Exception) -> bool:
+        return isinstance(error, duckdb.ConstraintException)
+
+    def insert_log_rows(self, rows: List[Tuple]):
+        if pd is None:
+            return super().insert_log_rows(rows)
+        # One columnar append per batch instead of a statement per row
+        frame = pd.DataFrame.from_records(rows, columns=export.EXPORT_FIELDS)
+        self.connection.register("incoming_logs", frame)
+        try:
+            self.connection.execute(f"INSERT INTO bypass_logs SELECT {', '.join(export.EXPORT_FIELDS)} FROM incoming_logs")
+        finally:
+            self.connection.unregister("incoming_logs")
+
+
+class SQLLogRepository(LogRepository):
+    def __init__(self, storage: SQLStorage):
+        self.storage = storage
+
+    def _row(self, document: Dict[str, Any]) -> Tuple:
+        return (
+            document['id'], document['action'], document['domain'], document['url'],
+            self.storage.to_db_time(document['timestamp']), document.get('user_agent'), bool(document.get('success', True)),
+        )
+
+    async def insert_one(self, document: Dict[str, Any]):
+        await self.insert_many([document])
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = False):
+        storage = self.storage
+
+        def write():
+            rows = [self._row(document) for document in documents]
+            try:
+                storage.insert_log_rows(rows)
+                storage.connection.commit()
+                return len(rows), []
+            except Exception:
+                storage.rollback()
+            # Retry row by row to find out which documents were rejected. Only
+            # constraint violations are reported like duplicate keys; anything
+            # else (a locked database, I/O) has no code, so callers retry it
+            inserted, errors = 0, []
+            for index, row in enumerate(rows):
+                try:
+                    storage.insert_log_rows([row])
+                    inserted += 1
+                except Exception as e:
+                    if storage.is_constraint_error(e):
+                        errors.append({'index': index, 'code': 11000, 'errmsg': str(e)})
+                    else:
+                        errors.append({'index': index, 'errmsg': str(e)})
+                    if ordered:
+                        break
+            storage.connection.commit()
+            return inserted, errors
+
+        inserted, errors = await storage.run(write)
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': inserted})
+
+    @staticmethod
+    def _time_filter(storage: SQLStorage, start, end) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(storage.to_db_time(start))
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(storage.to_db_time(end))
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    async def _top_sites(self, where: str, params: List[Any], top_sites: int) -> List[Dict[str, Any]]:
+        rows = await self.storage.fetch(
+            f"SELECT domain, COUNT(*) AS count FROM bypass_logs {where} GROUP BY domain "
+            f"ORDER BY count DESC, domain LIMIT ?", params + [top_sites]
+        )
+        return [{'domain': domain, 'count': count} for domain, count in rows]
+
+    async def stats(self, now: datetime, top_sites: int = 5) -> Dict[str, Any]:
+        today_start, _ = stats_engine.resolve_window('today', now)
+        week_start, _ = stats_engine.resolve_window('week', now)
+        (total, successful, today, week), = await self.storage.fetch(
+            "SELECT COUNT(*), "
+            "COALESCE(SUM(CASE WHEN success THEN 1 ELSE 0 END), 0), "
+            "COALESCE(SUM(CASE WHEN timestamp >= ? THEN 1 ELSE 0 END), 0), "
+            "COALESCE(SUM(CASE WHEN timestamp >= ? THEN 1 ELSE 0 END), 0) "
+            "FROM bypass_logs",
+            [self.storage.to_db_time(today_start), self.storage.to_db_time(week_start)]
+        )
+        success_rate = (successful / total * 100) if total > 0 else 0
+        return {
+            'total_bypasses': total,
+            'bypasses_today': today,
+            'bypasses_this_week': week,
+            'most_bypassed_sites': await self._top_sites("", [], top_sites),
+            'success_rate': round(success_rate, 2),
+        }
+
+    async def window_stats(self, start, end, top_sites: int = 5) -> Dict[str, Any]:
+        where, params = self._time_filter(self.storage, start, end)
+        (total, successful), = await self.storage.fetch(
+            f"SELECT COUNT(*), COALESCE(SUM(CASE WHEN success THEN 1 ELSE 0 END), 0) FROM bypass_logs {where}", params
+        )
+        success_rate = (successful / total * 100) if total > 0 else 0
+        return {
+            'start': start,
+            'end': end,
+            'total_bypasses': total,
+            'successful_bypasses': successful,
+            'most_bypassed_sites': await self._top_sites(where, params, top_sites),
+            'success_rate': round(success_rate, 2),
+        }
+
+    async def batches(self, start, end, fields, batch_size=export.DEFAULT_BATCH_SIZE):
+        storage = self.storage
+        where, params = self._time_filter(storage, start, end)
+        # A separate cursor, so other statements can run between two batches
+        cursor = await storage.run(lambda: storage.connection.cursor())
+        try:
+            await storage.run(cursor.execute, f"SELECT {', '.join(fields)} FROM bypass_logs {where} ORDER BY timestamp", params)
+            while True:
+                rows = await storage.run(cursor.fetchmany, batch_size)
+                if not rows:
+                    return
+                batch = [dict(zip(fields, row)) for row in rows]
+                for document in batch:
+                    if 'timestamp' in document:
+                        document['timestamp'] = storage.from_db_time(document['timestamp'])
+                    if 'success' in document:
+                        document['success'] = bool(document['success'])
+                yield batch
+        finally:
+            # Unless the storage was closed (and the cursor with it) in the meantime
+            if storage.connection is not None:
+                await storage.run(cursor.close)
+
+
+class SQLSiteConfigRepository(SiteConfigRepository):
+    # Versions continue after the last deletion even when it removed the newest config
+    NEXT_VERSION = (
+        "SELECT MAX(version) + 1 FROM (SELECT COALESCE(MAX(version), 0) AS version FROM site_configs "
+        "UNION ALL SELECT value FROM config_counters WHERE name = 'deleted_version') AS versions"
+    )
+
+    def __init__(self, storage: SQLStorage):
+        self.storage = storage
+
+    async def get(self, domain: str) -> Optional[Dict[str, Any]]:
+        rows = await self.storage.fetch("SELECT document FROM site_configs WHERE domain = ?", [domain])
+        return json.loads(rows[0][0]) if rows else None
+
+    async def upsert(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        storage = self.storage
+
+        def write():
+            (version,), = storage.connection.execute(self.NEXT_VERSION).fetchall()
+            stored = jsonable_encoder({**config, "version": version})
+            storage.connection.execute(
+                "INSERT INTO site_configs (domain, version, document) VALUES (?, ?, ?) "
+                "ON CONFLICT (domain) DO UPDATE SET version = excluded.version, document = excluded.document",
+                [stored["domain"], version, json.dumps(stored, ensure_ascii=False)]
+            )
+            storage.connection.commit()
+            return stored
+
+        return await storage.run(write)
+
+    async def delete(self, domain: str) -> bool:
+        storage = self.storage
+
+        def write():
+            if not storage.connection.execute("SELECT 1 FROM site_configs WHERE domain = ?", [domain]).fetchall():
+                return False
+            (version,), = storage.connection.execute(self.NEXT_VERSION).fetchall()
+            storage.connection.execute("DELETE FROM site_configs WHERE domain = ?", [domain])
+            storage.connection.execute(
+                "INSERT INTO config_counters (name, value) VALUES ('deleted_version', ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+                [version]
+            )
+            storage.connection.commit()
+            return True
+
+        return await storage.run(write)
+
+    async def all(self) -> List[Dict[str, Any]]:
+        rows = await self.storage.fetch("SELECT document FROM site_configs ORDER BY domain")
+        return [json.loads(document) for document, in rows]
+
+    async def changes(self, since: int) -> Tuple[int, List[Dict[str, Any]]]:
+        (version,), = await self.storage.fetch("SELECT COALESCE(MAX(version), 0) FROM site_configs")
+        rows = await self.storage.fetch("SELECT document FROM site_configs WHERE version > ?", [since])
+        return version, changed_since([json.loads(document) for document, in rows], since)
+
+    async def deleted_version(self) -> int:
+        rows = await self.storage.fetch("SELECT value FROM config_counters WHERE name = 'deleted_version'")
+        return rows[0][0] if rows else 0
+
+    async def page(self, limit: int, cursor: Optional[str] = None):
+        where, params = _keyset_clause(SITE_SORT, cursor)
+        rows = await self.storage.fetch(
+            f"SELECT document FROM site_configs {where} ORDER BY domain LIMIT ?", params + [limit + 1]
+        )
+        documents = [json.loads(document) for document, in rows]
+        if len(documents) <= limit:
+            return documents, None
+        documents = documents[:limit]
+        return documents, pagination.encode_cursor(documents[-1], SITE_SORT)
+
+    def stream(self, cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+        return _stream_pages(self.page, cursor, SITE_SORT)
+
+
+class SQLStatusCheckRepository(StatusCheckRepository):
+    def __init__(self, storage: SQLStorage):
+        self.storage = storage
+
+    async def insert(self, document: Dict[str, Any]):
+        storage = self.storage
+
+        def write():
+            storage.connection.execute(
+                "INSERT INTO status_checks (id, client_name, timestamp) VALUES (?, ?, ?)",
+                [document['id'], document['client_name'], storage.to_db_time(document['timestamp'])]
+            )
+            storage.connection.commit()
+
+        await storage.run(write)
+
+    async def page(self, limit: int, cursor: Optional[str] = None):
+        where, params = _keyset_clause(SQL_STATUS_SORT, cursor)
+        if params:
+            params[0] = self.storage.to_db_time(params[0])
+        rows = await self.storage.fetch(
+            f"SELECT id, client_name, timestamp FROM status_checks {where} ORDER BY timestamp, id LIMIT ?",
+            params + [limit + 1]
+        )
+        documents = [
+            {'id': id, 'client_name': client_name, 'timestamp': self.storage.from_db_time(timestamp)}
+            for id, client_name, timestamp in rows
+        ]
+        if len(documents) <= limit:
+            return documents, None
+        documents = documents[:limit]
+        return documents, pagination.encode_cursor(documents[-1], SQL_STATUS_SORT)
+
+    def stream(self, cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+        return _stream_pages(self.page, cursor, SQL_STATUS_SORT)
+
+
+def open_embedded(backend: str, path: str) -> SQLStorage:
+    """Storage for an embedded engine; call ``open()`` before use"""
+    if backend == 'sqlite':
+        return SQLiteStorage(path)
+    if backend == 'duckdb':
+        return DuckDBStorage(path)
+    raise ValueError(f"Unknown storage backend '{backend}' (expected one of: {', '.join(BACKENDS)})")
+
+
+def check_embedded_options(log_partitioning: str = 'off', log_encoding: str = 'plain', stats_source: str = 'raw'):
+    """Refuse options only the MongoDB backend implements.
+
+    The embedded engines keep every log in one table, in API field names, and
+    compute stats from it: partitions, the compact encoding and rollups would
+    be silently ignored, so fail at startup instead.
+    """
+    unsupported = []
+    if log_partitioning != 'off':
+        unsupported.append(f"LOG_PARTITIONING={log_partitioning}")
+    if log_encoding != 'plain':
+        unsupported.append(f"LOG_ENCODING={log_encoding}")
+    if stats_source != 'raw':
+        unsupported.append(f"STATS_SOURCE={stats_source}")
+    if unsupported:
+        raise ValueError(f"Embedded storage backends don't support {', '.join(unsupported)} (MongoDB only)")
@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+# The app reads its configuration at import time: run it against the
+# in-memory database, with synchronous log writes so tests see them at once
+_scratch = tempfile.mkdtemp(prefix='backend-tests-')
+os.environ.setdefault('MONGO_URL', 'memory://tests')
+os.environ.setdefault('DB_NAME', 'test')
+os.environ.setdefault('MONGO_WARM_UP', 'false')
+os.environ.setdefault('LOG_BUFFER_ENABLED', 'false')
+os.environ.setdefault('STATS_CACHE_TTL', '0')
+os.environ.setdefault('STATS_CACHE_STALE_TTL', '0')
+os.environ.setdefault('ANALYTICS_DIR', os.path.join(_scratch, 'analytics'))
+os.environ.setdefault('SKETCH_PATH', os.path.join(_scratch, 'sketches.json'))
+
+import memory_db  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def db():
+    """An empty in-memory database of its own"""
+    url = f"memory://{uuid.uuid4().hex}"
+    yield memory_db.MemoryClient(url)['test']
+    memory_db.MemoryClient.reset(url)
+
+
+@pytest.fixture
+def server():
+    """The app module, with an empty database and cold caches"""
+    import server as app_module
+    memory_db.MemoryClient.reset(app_module.mongo_url)
+    app_module.site_config_cache.invalidate()
+    app_module.site_config_table.replace_all([])
+    app_module.site_config_table.deleted_version = 0
+    app_module.site_config_table.deletion_pending = False
+    app_module.config_snapshots.invalidate()
+    app_module.stats_cache.invalidate()
+    return app_module
+
+
+@pytest.fixture
+def api(server):
+    """A test client for the app, with its startup and shutdown run"""
+    from fastapi.testclient import TestClient
+    with TestClient(server.app) as client:
+        yield client
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import analytics
+import storage
+from log_codec import PLAIN_CODEC
+from partitions import LogPartitions
+
+pytestmark = [
+    pytest.mark.anyio,
+    pytest.mark.skipif(not analytics.available(), reason="pandas and pyarrow are not installed"),
+]
+
+NOW = datetime(2026, 10, 18, 12, 30)
+
+
+def _log(index, hours_ago, domain='a.fr', action='header_modified', success=True):
+    return {
+        'id': str(index), 'action': action, 'domain': domain, 'url': f"https://{domain}/{index}",
+        'timestamp': NOW - timedelta(hours=hours_ago), 'user_agent': None, 'success': success,
+    }
+
+
+def _history():
+    return [
+        _log(1, 0.1), _log(2, 0.2, success=False), _log(3, 1, domain='b.fr'),
+        _log(4, 26, action='cookies_cleared'), _log(5, 26.5, domain='b.fr'), _log(6, 50, domain='c.fr'),
+    ]
+
+
+@pytest.fixture
+def logs(db):
+    partitions = LogPartitions(db)
+    return storage.MongoLogRepository(db, db, partitions.writer, partitions, PLAIN_CODEC, stats_source='raw')
+
+
+@pytest.fixture
+def store(tmp_path):
+    return analytics.SegmentStore(str(tmp_path / 'analytics'))
+
+
+def test_batches_are_aggregated_per_hour():
+    frame = analytics.aggregate_batch(_history()[:3])
+    rows = sorted(frame[['hour', 'domain', 'events', 'successes']].itertuples(index=False, name=None))
+    assert rows == [
+        (datetime(2026, 10, 18, 11), 'b.fr', 1, 1),
+        (datetime(2026, 10, 18, 12), 'a.fr', 2, 1),
+    ]
+
+
+async def test_compaction_writes_one_segment_per_day(logs, store):
+    await logs.insert_many(_history())
+    assert await analytics.compact(logs, store, NOW) == ['2026-10-16', '2026-10-17', '2026-10-18']
+    assert store.compacted_through == NOW
+    assert [(segment['day'], segment['rows']) for segment in store.segments()] == \
+        [('2026-10-16', 1), ('2026-10-17', 2), ('2026-10-18', 2)]
+
+    # Later runs only rewrite from the last compaction (minus late events)
+    await logs.insert_one(_log(7, -1))
+    assert await analytics.compact(logs, store, NOW + timedelta(hours=2)) == ['2026-10-18']
+    [today] = analytics.timeseries(store, NOW - timedelta(hours=2), NOW + timedelta(hours=3), 'day')
+    assert today['events'] == 4
+
+
+async def test_compaction_works_off_the_event_loop(logs, store, monkeypatch):
+    threads = set()
+    aggregate_batch, write = analytics.aggregate_batch, store.write
+
+    def record(func):
+        def wrapper(*args):
+            threads.add(threading.current_thread())
+            return func(*args)
+        return wrapper
+
+    monkeypatch.setattr(analytics, 'aggregate_batch', record(aggregate_batch))
+    monkeypatch.setattr(store, 'write', record(write))
+    await logs.insert_many(_history())
+    await analytics.compact(logs, store, NOW)
+    assert threads and threading.current_thread() not in threads
+
+
+@pytest.mark.skipif(analytics.fcntl is None, reason="file locks need fcntl")
+async def test_compactions_take_turns_across_processes(logs, store, monkeypatch):
+    monkeypatch.setattr(analytics, 'LOCK_POLL_INTERVAL', 0.01)
+    await logs.insert_many(_history())
+    # Another worker's store on the same directory holds the lock
+    held = analytics.SegmentStore(str(store.directory)).try_lock()
+    assert store.try_lock() is None
+    compaction = asyncio.create_task(analytics.compact(logs, store, NOW))
+    await asyncio.sleep(0.05)
+    assert not compaction.done()
+    store.unlock(held)
+    assert len(await compaction) == 3
+    assert not list(store.directory.rglob('*.tmp'))
+
+
+async def test_first_compaction_without_logs(logs, store):
+    assert await analytics.compact(logs, store, NOW) == []
+    assert store.compacted_through == NOW and store.days() == []
+
+
+async def test_hourly_and_daily_series(logs, store):
+    await logs.insert_many(_history())
+    await analytics.compact(logs, store, NOW)
+    [hourly] = analytics.timeseries(store, NOW - timedelta(hours=2), NOW)
+    assert hourly['key'] == 'all' and hourly['events'] == 3
+    assert hourly['points'] == [
+        {'time': '2026-10-18T11:00:00', 'events': 1, 'successes': 1, 'success_rate': 100.0},
+        {'time': '2026-10-18T12:00:00', 'events': 2, 'successes': 1, 'success_rate': 50.0},
+    ]
+    [daily] = analytics.timeseries(store, NOW - timedelta(days=3), NOW, 'day')
+    assert [(point['time'], point['events']) for point in daily['points']] == [
+        ('2026-10-16T00:00:00', 1), ('2026-10-17T00:00:00', 2), ('2026-10-18T00:00:00', 3),
+    ]
+    # Aware bounds are compared in UTC
+    aware = analytics.timeseries(store, (NOW - timedelta(hours=2)).replace(tzinfo=timezone.utc),
+                                 NOW.replace(tzinfo=timezone.utc))
+    assert aware == [hourly]
+
+
+async def test_series_per_domain_and_filters(logs, store):
+    await logs.insert_many(_history())
+    await analytics.compact(logs, store, NOW)
+    start = NOW - timedelta(days=3)
+    by_domain = analytics.timeseries(store, start, NOW, 'day', by='domain', top=2)
+    assert [(series['key'], series['events']) for series in by_domain] == [('a.fr', 3), ('b.fr', 2)]
+    [cookies] = analytics.timeseries(store, start, NOW, 'day', action='cookies_cleared')
+    assert cookies['events'] == 1
+    assert analytics.timeseries(store, start, NOW, domain='missing.fr') == []
+    assert analytics.timeseries(store, NOW - timedelta(days=30), NOW - timedelta(days=20)) == []
+
+
+@pytest.mark.parametrize('arguments', [
+    {'interval': 'week'},
+    {'by': 'url'},
+    {'start': NOW, 'end': NOW},
+])
+def test_bad_queries_raise_value_error(store, arguments):
+    arguments = {'start': NOW - timedelta(days=1), 'end': NOW, **arguments}
+    with pytest.raises(ValueError):
+        analytics.timeseries(store, **arguments)
+
+
+async def test_rewritten_segments_are_reloaded(logs, store):
+    await logs.insert_many(_history()[:1])
+    await analytics.compact(logs, store, NOW)
+    first = analytics.timeseries(store, NOW - timedelta(hours=1), NOW + timedelta(hours=1))
+    await logs.insert_many(_history()[1:2])
+    await analytics.compact(logs, store, NOW)
+    path = store.path_for('2026-10-18')
+    # Make sure the rewrite is visible even on filesystems with coarse mtimes
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 1))
+    second = analytics.timeseries(store, NOW - timedelta(hours=1), NOW + timedelta(hours=1))
+    assert (first[0]['events'], second[0]['events']) == (1, 2)
+
+
+def test_endpoints(api, server, monkeypatch, store):
+    assert api.get('/api/analytics/timeseries').status_code == 404
+    monkeypatch.setattr(server, 'ANALYTICS_ENABLED', True)
+    monkeypatch.setattr(server, 'analytics_store', store)
+    api.post('/api/bypass-log', json={'action': 'header_modified', 'domain': 'a.fr', 'url': 'https://a.fr/1'})
+    assert api.post('/api/analytics/compact').json()['compacted_days']
+    assert len(api.get('/api/analytics/segments').json()['segments']) == 1
+    body = api.get('/api/analytics/timeseries', params={'interval': 'day', 'by': 'domain'}).json()
+    assert [(series['key'], series['events']) for series in body['series']] == [('a.fr', 1)]
+    assert api.get('/api/analytics/timeseries', params={'interval': 'week'}).status_code == 400
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from server import parse_bulk_log_body
+
+
+def _event(index, **overrides):
+    return {'action': 'header_modified', 'domain': 'lefigaro.fr', 'url': f"https://www.lefigaro.fr/{index}", **overrides}
+
+
+def test_parse_json_array():
+    assert parse_bulk_log_body(json.dumps([{'a': 1}, {'a': 2}]).encode(), 'application/json') == [{'a': 1}, {'a': 2}]
+
+
+def test_parse_ndjson_keeps_bad_lines_as_errors():
+    items = parse_bulk_log_body(b'{"a": 1}\n\nnot json\n{"a": 2}\n', 'application/x-ndjson')
+    assert items[0] == {'a': 1} and items[2] == {'a': 2}
+    assert isinstance(items[1], ValueError)
+
+
+@pytest.mark.parametrize('body', [b'[{"a": 1}', b'[1, 2'])
+def test_parse_rejects_a_broken_array(body):
+    with pytest.raises(ValueError):
+        parse_bulk_log_body(body, 'application/json')
+
+
+def test_bulk_accepts_valid_events_and_rejects_the_rest(api, server):
+    response = api.post('/api/bypass-log/bulk', json=[_event(0), {'domain': 'x.fr'}, 'nope', _event(3)])
+    assert response.status_code == 200
+    body = response.json()
+    assert (body['accepted'], body['rejected']) == (2, 2)
+    assert [result['accepted'] for result in body['results']] == [True, False, False, True]
+    assert 'action' in body['results'][1]['error']
+    assert body['results'][2]['error'] == "Event must be a JSON object"
+    assert api.get('/api/bypass-stats').json()['total_bypasses'] == 2
+
+
+def test_bulk_ndjson_body(api):
+    body = '\n'.join(json.dumps(_event(index)) for index in range(3)) + '\n{broken'
+    response = api.post('/api/bypass-log/bulk', content=body, headers={'content-type': 'application/x-ndjson'})
+    assert response.json()['accepted'] == 3
+    assert response.json()['results'][3]['accepted'] is False
+
+
+def test_bulk_maps_write_errors_to_request_indexes(api, server):
+    # A unique URL index makes the second copy of an event fail at write time
+    api.portal.call(lambda: server.db.bypass_logs.create_index([('url', 1)], unique=True))
+    response = api.post('/api/bypass-log/bulk', json=[_event(0), {'domain': 'x.fr'}, _event(0), _event(1)])
+    results = response.json()['results']
+    assert [result['accepted'] for result in results] == [True, False, False, True]
+    assert results[2]['id'] is None and 'duplicate key' in results[2]['error']
+
+
+def test_bulk_limits(api, server, monkeypatch):
+    monkeypatch.setattr(server, 'BULK_LOG_MAX_ITEMS', 2)
+    assert api.post('/api/bypass-log/bulk', json=[_event(index) for index in range(3)]).status_code == 413
+    assert api.post('/api/bypass-log/bulk', content=b'[{"a": 1},', headers={'content-type': 'application/json'}).status_code == 400
+    assert api.post('/api/bypass-log/bulk', content=b'').json()['accepted'] == 0
@@ -0,0 +1,98 @@
+import pytest
+
+from config_cache import TTLCache, accepts_encoding, etag_matches, render_response
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_the_ttl():
+    clock = Clock()
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.set('a', 1)
+    clock.now = 9.9
+    assert cache.get('a') == 1
+    clock.now = 10
+    assert cache.get('a') is None
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 0)
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = TTLCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+
+
+def test_invalidate_one_or_all():
+    cache = TTLCache()
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.invalidate('a')
+    assert (cache.get('a'), cache.get('b')) == (None, 2)
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_render_response_is_compact_and_stable():
+    first = render_response({'domain': 'lefigaro.fr', 'name': 'Le Figaro'})
+    assert first.body == '{"domain":"lefigaro.fr","name":"Le Figaro"}'.encode()
+    assert first == render_response({'domain': 'lefigaro.fr', 'name': 'Le Figaro'})
+    assert first.etag != render_response({'domain': 'lefigaro.fr'}).etag
+    assert first.etag.startswith('"') and first.etag.endswith('"')
+
+
+@pytest.mark.parametrize('header, matches', [
+    (None, False),
+    ('', False),
+    ('*', True),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"other", "abc"', True),
+    ('"other"', False),
+    ('abc', False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, '"abc"') is matches
+
+
+@pytest.mark.parametrize('header, accepted', [
+    ('gzip', True),
+    ('deflate, GZIP;q=0.5', True),
+    ('gzip;q=0', False),
+    ('gzip; q=0.000', False),
+    ('*', True),
+    ('*;q=0.1, gzip;q=0', False),
+    ('br, identity', False),
+    (None, False),
+])
+def test_accepts_encoding(header, accepted):
+    assert accepts_encoding(header, 'gzip') is accepted
+
+
+def test_site_config_is_cached_and_revalidated(api, server):
+    response = api.get('/api/site-config/lefigaro.fr')
+    assert response.status_code == 200
+    etag = response.headers['etag']
+    assert 'must-revalidate' in response.headers['cache-control']
+    assert server.site_config_cache.get('lefigaro.fr').etag == etag
+
+    revalidated = api.get('/api/site-config/lefigaro.fr', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304 and revalidated.content == b''
+    assert revalidated.headers['etag'] == etag
+
+
+def test_update_rules_invalidates_the_cached_config(api):
+    before = api.get('/api/site-config/lefigaro.fr')
+    assert api.post('/api/update-rules').json()['success'] is True
+    after = api.get('/api/site-config/lefigaro.fr', headers={'If-None-Match': before.headers['etag']})
+    assert after.status_code == 200
+    assert after.headers['etag'] != before.headers['etag']
+    assert 'figaro_paywall' in after.json()['methods']['removeCookies']
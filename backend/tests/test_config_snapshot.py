@@ -0,0 +1,157 @@
+import gzip
+import json
+
+import pytest
+
+import storage
+from config_snapshot import (
+    SnapshotHolder, build_snapshot, changed_since, deleted_version, needs_full_resync, next_config_version,
+    record_config_deletion,
+)
+
+pytestmark = pytest.mark.anyio
+
+DOCUMENTS = [
+    {'_id': 1, 'domain': 'b.fr', 'version': 3},
+    {'_id': 2, 'domain': 'a.fr', 'version': 1},
+    {'_id': 3, 'domain': 'c.fr', 'version': 2},
+]
+
+
+async def test_versions_increase_across_writes_and_deletions(db):
+    assert [await next_config_version(db) for _ in range(2)] == [1, 2]
+    assert await deleted_version(db) == 0
+    assert await record_config_deletion(db) == 3
+    assert await next_config_version(db) == 4
+    assert await deleted_version(db) == 3
+
+
+def test_changed_since_is_ordered_by_version():
+    assert [document['domain'] for document in changed_since(DOCUMENTS, 1)] == ['c.fr', 'b.fr']
+    assert changed_since(DOCUMENTS, 3) == []
+    assert '_id' not in changed_since(DOCUMENTS, 0)[0]
+
+
+def test_snapshot_body_and_etag():
+    snapshot = build_snapshot(DOCUMENTS)
+    body = json.loads(snapshot.body)
+    assert snapshot.version == body['version'] == 3
+    assert [site['domain'] for site in body['sites']] == ['a.fr', 'b.fr', 'c.fr']
+    assert gzip.decompress(snapshot.gzipped_body) == snapshot.body
+    assert snapshot.etag.startswith('"v3-') and snapshot.gzip_etag != snapshot.etag
+    assert build_snapshot(DOCUMENTS, deleted_version=5).version == 5
+
+
+def test_holder_rebuilds_on_changes_and_deletions():
+    holder, loads = SnapshotHolder(), []
+
+    def loader():
+        loads.append(1)
+        return DOCUMENTS
+
+    first = holder.get(loader)
+    assert holder.get(loader) is first and len(loads) == 1
+    holder.invalidate('a.fr')
+    holder.get(loader)
+    assert holder.get(loader, deleted_version=4).version == 4
+    assert len(loads) == 3
+
+
+@pytest.mark.parametrize('since, version, deleted, resync', [
+    (3, 3, 0, False),
+    (4, 3, 0, True),
+    (2, 5, 4, True),
+    (4, 5, 4, False),
+])
+def test_needs_full_resync(since, version, deleted, resync):
+    assert needs_full_resync(since, version, deleted) is resync
+
+
+@pytest.fixture(params=['mongodb', 'sqlite', 'duckdb'])
+async def site_configs(request, db, tmp_path):
+    if request.param == 'mongodb':
+        yield storage.MongoSiteConfigRepository(db, db)
+        return
+    if request.param == 'duckdb':
+        pytest.importorskip('duckdb')
+    repositories = storage.open_embedded(request.param, str(tmp_path / f"bypass.{request.param}"))
+    await repositories.open()
+    yield repositories.site_configs
+    await repositories.close()
+
+
+async def test_repository_deletions_are_versioned(site_configs):
+    for domain in ('a.fr', 'b.fr'):
+        await site_configs.upsert({'domain': domain})
+    assert await site_configs.delete('b.fr') is True
+    assert await site_configs.delete('b.fr') is False
+    assert await site_configs.deleted_version() == 3
+    # Later writes take versions after the deletion, even though it removed the newest config
+    assert (await site_configs.upsert({'domain': 'c.fr'}))['version'] == 4
+    version, changed = await site_configs.changes(3)
+    assert [config['domain'] for config in changed] == ['c.fr']
+    assert [config['domain'] for config in await site_configs.all()] == ['a.fr', 'c.fr']
+
+
+def test_delta_after_a_deletion_forces_a_full_resync(api, server):
+    api.post('/api/update-rules')
+    held = api.get('/api/site-configs/snapshot')
+    version = int(held.headers['x-config-version'])
+    assert api.get('/api/site-configs/delta', params={'since': version}).json()['full_resync'] is False
+
+    assert api.portal.call(lambda: server.repositories.site_configs.delete('lefigaro.fr'))
+    # Picked up by the next poll
+    api.portal.call(server.site_config_watcher.reload)
+    delta = api.get('/api/site-configs/delta', params={'since': version}).json()
+    assert delta['full_resync'] is True and delta['version'] == version + 1
+
+    snapshot = api.get('/api/site-configs/snapshot', headers={'If-None-Match': held.headers['etag']})
+    assert snapshot.status_code == 200
+    assert snapshot.json() == {'version': version + 1, 'sites': []}
+    assert api.get('/api/site-configs/delta', params={'since': version + 1}).json()['full_resync'] is False
+
+
+def test_polls_read_the_deletion_version_from_memory(api, server, monkeypatch):
+    api.post('/api/update-rules')
+    reads = []
+    read_deleted_version = server.repositories.site_configs.deleted_version
+
+    async def counted():
+        reads.append(1)
+        return await read_deleted_version()
+
+    monkeypatch.setattr(server.repositories.site_configs, 'deleted_version', counted)
+    for _ in range(3):
+        api.get('/api/site-configs/snapshot')
+        api.get('/api/site-configs/delta', params={'since': 0})
+    assert reads == []
+
+    # A deletion seen on the change stream: ask the database until its version is recorded
+    server.site_config_table.deletion_pending = True
+    assert api.portal.call(lambda: server.repositories.site_configs.delete('lefigaro.fr'))
+    assert api.get('/api/site-configs/delta', params={'since': 1}).json()['full_resync'] is True
+    api.get('/api/site-configs/delta', params={'since': 1})
+    assert len(reads) == 1 and not server.site_config_table.deletion_pending
+
+
+def test_each_encoding_has_its_own_etag(api):
+    api.post('/api/update-rules')
+    gzipped = api.get('/api/site-configs/snapshot', headers={'Accept-Encoding': 'gzip'})
+    plain = api.get('/api/site-configs/snapshot', headers={'Accept-Encoding': 'gzip;q=0'})
+    assert gzipped.headers['content-encoding'] == 'gzip' and 'content-encoding' not in plain.headers
+    assert gzipped.json() == plain.json() and gzipped.headers['etag'] != plain.headers['etag']
+    # A validator only matches the representation it was given for
+    revalidated = api.get('/api/site-configs/snapshot',
+                          headers={'Accept-Encoding': 'identity', 'If-None-Match': gzipped.headers['etag']})
+    assert revalidated.status_code == 200
+    revalidated = api.get('/api/site-configs/snapshot',
+                          headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzipped.headers['etag']})
+    assert revalidated.status_code == 304
+
+
+def test_delta_lists_changed_configs(api):
+    api.post('/api/update-rules')
+    delta = api.get('/api/site-configs/delta', params={'since': 0}).json()
+    assert delta['full_resync'] is False
+    assert [site['domain'] for site in delta['sites']] == ['lefigaro.fr']
+    assert api.get('/api/site-configs/delta', params={'since': delta['version'] + 1}).json()['full_resync'] is True
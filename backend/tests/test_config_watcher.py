@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+from config_watcher import SiteConfigTable, SiteConfigWatcher
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeStream:
+    def __init__(self, changes, error=None):
+        self.changes = changes
+        self.error = error
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def __aiter__(self):
+        for index, change in enumerate(self.changes):
+            self.resume_token = {'n': index}
+            yield change
+        if self.error is not None:
+            raise self.error
+        await asyncio.Event().wait()
+
+
+class WatchedCollection:
+    """Delegates to an in-memory collection, with scripted change streams"""
+
+    def __init__(self, collection, streams):
+        self.collection = collection
+        self.streams = streams
+        self.resumed_after = []
+
+    def find(self, *args, **kwargs):
+        return self.collection.find(*args, **kwargs)
+
+    def watch(self, resume_after=None, **kwargs):
+        self.resumed_after.append(resume_after)
+        return self.streams.pop(0)
+
+
+def _table():
+    table, changes = SiteConfigTable(), []
+    table.add_listener(changes.append)
+    return table, changes
+
+
+def test_table_tracks_upserts_renames_and_removals():
+    table, changes = _table()
+    table.replace_all([{'_id': 1, 'domain': 'a.fr', 'v': 1}])
+    table.upsert({'_id': 1, 'domain': 'a.fr', 'v': 2})
+    table.upsert({'_id': 1, 'domain': 'b.fr', 'v': 3})
+    assert (table.get('a.fr'), table.get('b.fr')) == (None, {'domain': 'b.fr', 'v': 3})
+    table.remove_by_id(1)
+    table.remove_by_id(2)
+    assert table.all() == []
+    assert changes == [None, 'a.fr', 'a.fr', 'b.fr', 'b.fr']
+
+
+def test_table_hands_out_copies_and_skips_unchanged_reloads():
+    table, changes = _table()
+    table.replace_all([{'_id': 1, 'domain': 'a.fr', 'methods': {'techniques': ['cookies']}}])
+    table.get('a.fr')['methods']['techniques'].append('archive')
+    assert table.get('a.fr')['methods']['techniques'] == ['cookies']
+    table.replace_all([{'_id': 1, 'domain': 'a.fr', 'methods': {'techniques': ['cookies']}}])
+    assert changes == [None]
+
+
+def test_listener_errors_are_contained():
+    table = SiteConfigTable()
+    table.add_listener(lambda domain: 1 / 0)
+    table.upsert({'domain': 'a.fr'})
+    assert table.get('a.fr') == {'domain': 'a.fr'}
+
+
+async def test_change_events_update_the_table(db):
+    await db.site_configs.insert_one({'_id': 1, 'domain': 'a.fr'})
+    stream = FakeStream([
+        {'operationType': 'insert', 'fullDocument': {'_id': 2, 'domain': 'b.fr'}},
+        {'operationType': 'update', 'fullDocument': {'_id': 1, 'domain': 'a.fr', 'enabled': False}},
+        {'operationType': 'delete', 'documentKey': {'_id': 2}},
+    ])
+    table, _ = _table()
+    watcher = SiteConfigWatcher(WatchedCollection(db.site_configs, [stream]), table)
+    await watcher.start()
+    await asyncio.sleep(0.01)
+    assert watcher.mode == 'change_stream'
+    assert table.all() == [{'domain': 'a.fr', 'enabled': False}]
+    await watcher.stop()
+    assert watcher.mode == 'stopped'
+
+
+async def test_deletion_versions_are_tracked(db):
+    versions = [2]
+
+    async def load_deleted_version():
+        return versions[-1]
+
+    await db.site_configs.insert_one({'_id': 1, 'domain': 'a.fr'})
+    stream = FakeStream([{'operationType': 'delete', 'documentKey': {'_id': 1}}])
+    table, changes = _table()
+    watcher = SiteConfigWatcher(WatchedCollection(db.site_configs, [stream]), table,
+                                load_deleted_version=load_deleted_version)
+    await watcher.start()
+    await asyncio.sleep(0.01)
+    # Loaded with the table, then pending until the deletion's version is known
+    assert (table.deleted_version, table.deletion_pending) == (2, True)
+    table.set_deleted_version(2)
+    assert table.deletion_pending
+    table.set_deleted_version(4)
+    assert (table.deleted_version, table.deletion_pending) == (4, False)
+    assert changes == [None, None, 'a.fr', None]
+    await watcher.stop()
+
+
+async def test_interrupted_streams_reload_and_resume(db):
+    await db.site_configs.insert_one({'_id': 1, 'domain': 'a.fr'})
+    collection = WatchedCollection(db.site_configs, [
+        FakeStream([{'operationType': 'insert', 'fullDocument': {'_id': 2, 'domain': 'b.fr'}}], AutoReconnect("reset")),
+        FakeStream([]),
+    ])
+    table, _ = _table()
+    watcher = SiteConfigWatcher(collection, table, retry_delay=0)
+    await watcher.start()
+    await asyncio.sleep(0.01)
+    # The reload replaced the streamed insert with the collection's contents
+    assert [config['domain'] for config in table.all()] == ['a.fr']
+    assert collection.resumed_after == [None, {'n': 0}]
+    await watcher.stop()
+
+
+async def test_falls_back_to_polling_without_change_streams(db):
+    table, _ = _table()
+    watcher = SiteConfigWatcher(db.site_configs, table, poll_interval=0.01)
+    await watcher.start()
+    assert table.loaded and table.all() == []
+    await db.site_configs.insert_one({'domain': 'a.fr'})
+    await asyncio.sleep(0.05)
+    assert watcher.mode == 'polling'
+    assert table.get('a.fr') == {'domain': 'a.fr'}
+    await watcher.stop()
+
+
+def test_site_config_is_served_from_the_table(api, server):
+    server.site_config_table.replace_all([{'_id': 1, 'domain': 'example.fr', 'name': 'Example'}])
+    assert api.get('/api/site-config/example.fr').json()['name'] == 'Example'
+    server.site_config_table.upsert({'_id': 1, 'domain': 'example.fr', 'name': 'Renamed'})
+    assert api.get('/api/site-config/example.fr').json()['name'] == 'Renamed'
@@ -0,0 +1,86 @@
+import pytest
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+import database
+import memory_db
+import storage
+
+pytestmark = pytest.mark.anyio
+
+
+def test_pool_options_come_from_the_environment(monkeypatch):
+    assert database.client_options_from_env()['maxPoolSize'] == 100
+    monkeypatch.setenv('MONGO_MAX_POOL_SIZE', '12')
+    monkeypatch.setenv('MONGO_READ_PREFERENCE', 'nearest')
+    options = database.client_options_from_env()
+    assert (options['maxPoolSize'], options['minPoolSize'], options['readPreference']) == (12, 10, 'nearest')
+
+
+def test_create_client_applies_the_options(monkeypatch):
+    monkeypatch.setenv('MONGO_MIN_POOL_SIZE', '0')
+    client = database.create_client('mongodb://localhost:27017', database.PoolStats(), maxPoolSize=7)
+    try:
+        pool_options = client.options.pool_options
+        assert (pool_options.max_pool_size, pool_options.min_pool_size) == (7, 0)
+    finally:
+        client.close()
+
+
+async def test_memory_urls_use_the_in_process_database():
+    client = database.create_client('memory://test-database')
+    assert isinstance(client, memory_db.MemoryClient)
+    await database.warm_up(client, 3)
+    memory_db.MemoryClient.reset('memory://test-database')
+
+
+def test_pool_stats_follow_checkouts():
+    stats = database.PoolStats()
+    for _ in range(3):
+        stats.connection_created(None)
+        stats.connection_check_out_started(None)
+    assert stats.peak_waiting == 3
+    for _ in range(2):
+        stats.connection_checked_out(None)
+    stats.connection_check_out_failed(None)
+    stats.connection_checked_in(None)
+    snapshot = stats.snapshot()
+    assert (snapshot['in_use'], snapshot['peak_in_use'], snapshot['waiting'], snapshot['checkout_failures']) == (1, 2, 0, 1)
+    assert snapshot['connections_open'] == 3
+
+
+def test_read_routes(monkeypatch):
+    assert isinstance(database.read_route('CONFIG'), Primary)
+    route = database.read_route('ANALYTICS', 'secondaryPreferred')
+    assert isinstance(route, SecondaryPreferred) and route.max_staleness == 120
+    monkeypatch.setenv('MONGO_ANALYTICS_MAX_STALENESS_SECONDS', '10')
+    assert database.read_route('ANALYTICS', 'secondaryPreferred').max_staleness == database.MIN_MAX_STALENESS
+    monkeypatch.setenv('MONGO_ANALYTICS_MAX_STALENESS_SECONDS', '-1')
+    assert database.read_route('ANALYTICS', 'secondaryPreferred').max_staleness == -1
+    monkeypatch.setenv('MONGO_ANALYTICS_READ_PREFERENCE', 'fastest')
+    with pytest.raises(ValueError):
+        database.read_route('ANALYTICS')
+
+
+async def test_site_config_lookups_read_the_primary(db):
+    stale = memory_db.MemoryClient('memory://test-stale-replica')['test']
+    try:
+        await stale.site_configs.insert_one({'domain': 'a.fr', 'version': 1})
+        repository = storage.MongoSiteConfigRepository(db, stale)
+        await repository.upsert({'domain': 'a.fr'})
+        assert (await repository.get('a.fr'))['version'] == 1
+        await repository.upsert({'domain': 'a.fr'})
+        assert (await repository.get('a.fr'))['version'] == 2
+        # Listings follow the configurable route
+        assert [config['version'] for config in await repository.all()] == [1]
+    finally:
+        memory_db.MemoryClient.reset('memory://test-stale-replica')
+
+
+def test_config_reads_default_to_the_primary(server):
+    assert isinstance(server.CONFIG_READ_PREFERENCE, Primary)
+    assert isinstance(server.ANALYTICS_READ_PREFERENCE, SecondaryPreferred)
+
+
+def test_pool_endpoint(api):
+    body = api.get('/api/db/pool').json()
+    assert {'max_pool_size', 'min_pool_size', 'in_use', 'waiting', 'connections_open'} <= set(body)
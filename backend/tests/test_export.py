@@ -0,0 +1,126 @@
+import asyncio
+import io
+import json
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from typer.testing import CliRunner
+
+import export
+import storage
+
+NOW = datetime(2026, 10, 18, 12, 0)
+
+
+def _logs(count=5):
+    return [
+        {
+            'id': str(index), 'action': 'header_modified', 'domain': 'a.fr', 'url': f"https://a.fr/{index}",
+            'timestamp': NOW + timedelta(minutes=index), 'user_agent': None, 'success': index != 2,
+        }
+        for index in range(count)
+    ]
+
+
+async def _collect(chunks):
+    return b''.join([chunk async for chunk in chunks])
+
+
+def test_batches_are_projected_and_bounded(db):
+    asyncio.run(db.bypass_logs.insert_many(_logs()))
+
+    async def batches():
+        return [batch async for batch in export.iter_log_batches(db.bypass_logs, NOW + timedelta(minutes=1), None, ['id', 'success'], 2)]
+
+    assert asyncio.run(batches()) == [
+        [{'id': '1', 'success': True}, {'id': '2', 'success': False}],
+        [{'id': '3', 'success': True}, {'id': '4', 'success': True}],
+    ]
+
+
+def test_ndjson_export(db):
+    asyncio.run(db.bypass_logs.insert_many(_logs()))
+    body = asyncio.run(_collect(export.export_chunks(db.bypass_logs, None, NOW + timedelta(minutes=2), fields=['id', 'timestamp'])))
+    assert [json.loads(line) for line in body.splitlines()] == [
+        {'id': '0', 'timestamp': '2026-10-18T12:00:00'},
+        {'id': '1', 'timestamp': '2026-10-18T12:01:00'},
+    ]
+
+
+def test_parquet_export(db):
+    pq = pytest.importorskip('pyarrow.parquet')
+    asyncio.run(db.bypass_logs.insert_many(_logs()))
+    body = asyncio.run(_collect(export.export_chunks(db.bypass_logs, None, None, 'parquet', batch_size=2)))
+    table = pq.read_table(io.BytesIO(body))
+    assert table.num_rows == 5 and pq.ParquetFile(io.BytesIO(body)).num_row_groups == 3
+    assert table.column('success').to_pylist() == [True, True, False, True, True]
+
+
+def test_batches_are_encoded_off_the_event_loop(db, monkeypatch):
+    threads = []
+    ndjson_lines = export._ndjson_lines
+
+    def recorded(batch):
+        threads.append(threading.current_thread())
+        return ndjson_lines(batch)
+
+    monkeypatch.setattr(export, '_ndjson_lines', recorded)
+    asyncio.run(db.bypass_logs.insert_many(_logs()))
+
+    async def run():
+        body = await _collect(export.export_chunks(db.bypass_logs, None, None, batch_size=2))
+        return body, threading.current_thread()
+
+    body, loop_thread = asyncio.run(run())
+    assert len(body.splitlines()) == 5
+    assert len(threads) == 3 and loop_thread not in threads
+
+
+@pytest.mark.parametrize('export_format, fields', [('csv', None), ('ndjson', ['password'])])
+def test_bad_arguments_raise_value_error(export_format, fields):
+    with pytest.raises(ValueError):
+        export.check_arguments(export_format, fields)
+
+
+def test_cli_reads_through_the_configured_storage(db, monkeypatch, tmp_path):
+    asyncio.run(db.bypass_logs.insert_many(_logs()))
+    monkeypatch.setenv('STORAGE_BACKEND', 'mongodb')
+    monkeypatch.setenv('MONGO_URL', db.client.url)
+    monkeypatch.setenv('DB_NAME', db.name)
+    output = tmp_path / 'logs.ndjson'
+    result = CliRunner().invoke(export.cli, ['--field', 'id', '-o', str(output)])
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line)['id'] for line in output.read_text().splitlines()] == ['0', '1', '2', '3', '4']
+
+
+def test_cli_exports_from_an_embedded_backend(monkeypatch, tmp_path):
+    path = str(tmp_path / 'bypass.sqlite')
+
+    async def fill():
+        repositories = storage.open_embedded('sqlite', path)
+        await repositories.open()
+        await repositories.logs.insert_many(_logs(3))
+        await repositories.close()
+
+    asyncio.run(fill())
+    monkeypatch.setenv('STORAGE_BACKEND', 'sqlite')
+    monkeypatch.setenv('STORAGE_PATH', path)
+    result = CliRunner().invoke(export.cli, ['--field', 'url'])
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line)['url'] for line in result.stdout.splitlines()] == [f"https://a.fr/{index}" for index in range(3)]
+
+
+def test_cli_reports_bad_arguments(monkeypatch, db):
+    monkeypatch.setenv('MONGO_URL', db.client.url)
+    result = CliRunner().invoke(export.cli, ['--format', 'csv'])
+    assert result.exit_code == 1
+    assert "Unknown export format" in result.output
+
+
+def test_export_endpoint(api):
+    api.post('/api/bypass-log', json={'action': 'header_modified', 'domain': 'a.fr', 'url': 'https://a.fr/1'})
+    response = api.get('/api/export/bypass-logs', params={'fields': 'domain'})
+    assert response.status_code == 200
+    assert [json.loads(line) for line in response.text.splitlines()] == [{'domain': 'a.fr'}]
+    assert api.get('/api/export/bypass-logs', params={'format': 'csv'}).status_code == 400
@@ -0,0 +1,60 @@
+import json
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import fast_json
+
+pytestmark = [
+    pytest.mark.anyio,
+    pytest.mark.skipif(not fast_json.available(), reason="orjson is not installed"),
+]
+
+NOW = datetime(2026, 10, 18, 12, 0, 0, 250000)
+
+
+def test_datetimes_uuids_and_models_are_encoded_natively(server):
+    identifier = uuid.UUID(int=7)
+    check = server.StatusCheck(id=str(identifier), client_name='c', timestamp=NOW)
+    body = fast_json.dumps({'when': NOW, 'id': identifier, 'check': check, 1: 'key'})
+    assert json.loads(body) == {
+        'when': '2026-10-18T12:00:00.250000', 'id': str(identifier),
+        'check': {'id': str(identifier), 'client_name': 'c', 'timestamp': '2026-10-18T12:00:00.250000'},
+        '1': 'key',
+    }
+
+
+def test_unknown_types_are_refused():
+    with pytest.raises(TypeError):
+        fast_json.dumps({'value': object()})
+
+
+def test_response_class():
+    response = fast_json.FastJSONResponse([{'when': NOW}], headers={'x-next-cursor': 'abc'})
+    assert response.media_type == 'application/json'
+    assert response.body == b'[{"when":"2026-10-18T12:00:00.250000"}]'
+    assert response.headers['x-next-cursor'] == 'abc'
+
+
+async def test_benchmark_bodies_match_the_standard_path(tmp_path):
+    import bench_json
+    output = tmp_path / 'bench.json'
+    await bench_json.run(SimpleNamespace(rows=[3], repeat=2, output=str(output)))
+    report = json.loads(output.read_text())
+    assert {entry['endpoint'] for entry in report} == set(bench_json.ENDPOINTS)
+    assert all(entry['bodies_match'] for entry in report)
+
+
+@pytest.mark.parametrize('path', ['/api/status', '/api/supported-sites', '/api/bypass-stats'])
+def test_endpoints_return_the_same_body_in_fast_mode(api, server, monkeypatch, path):
+    api.post('/api/status', json={'client_name': 'c'})
+    api.post('/api/update-rules')
+    api.post('/api/bypass-log', json={'action': 'header_modified', 'domain': 'a.fr', 'url': 'https://a.fr/1'})
+    standard = api.get(path)
+    monkeypatch.setattr(server, 'FAST_JSON', True)
+    fast = api.get(path)
+    assert fast.status_code == standard.status_code == 200
+    assert fast.json() == standard.json()
+    assert fast.headers.get('x-next-cursor') == standard.headers.get('x-next-cursor')
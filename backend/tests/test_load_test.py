@@ -0,0 +1,57 @@
+import json
+import random
+from types import SimpleNamespace
+
+import pytest
+
+import load_test
+
+pytestmark = pytest.mark.anyio
+
+
+def _args(tmp_path, **overrides):
+    return SimpleNamespace(**{
+        'base_url': None, 'in_process': True, 'routes': ['mix'], 'concurrency': 4, 'duration': 30.0,
+        'requests': 40, 'warmup': 0, 'timeout': 30.0, 'seed': 1, 'output': str(tmp_path / 'results.json'),
+        'baseline': None, **overrides,
+    })
+
+
+def test_percentiles():
+    values = [index / 100 for index in range(1, 101)]
+    assert (load_test.percentile(values, 0.5), load_test.percentile(values, 0.99)) == (0.5, 0.99)
+    assert load_test.percentile([0.2], 0.95) == 0.2
+    assert load_test.percentile([], 0.5) == 0.0
+
+
+def test_summary_per_route():
+    summary = load_test.summarize({'log': [(0.01, True), (0.03, False)], 'stats': []}, elapsed=2)
+    assert summary['log'] == {
+        'requests': 2, 'errors': 1, 'error_rate': 0.5, 'throughput_rps': 1.0,
+        'p50_ms': 10.0, 'p95_ms': 30.0, 'p99_ms': 30.0, 'mean_ms': 20.0,
+    }
+    assert summary['stats']['requests'] == 0 and summary['stats']['error_rate'] == 0.0
+
+
+def test_every_route_builds_a_request():
+    rng = random.Random(1)
+    assert set(load_test.MIX) <= set(load_test.ROUTES)
+    for build in load_test.ROUTES.values():
+        method, path, kwargs = build(rng)
+        assert method in ('GET', 'POST') and path.startswith('/api/')
+
+
+async def test_in_process_run_writes_a_report(server, tmp_path, capsys):
+    await load_test.run(_args(tmp_path, routes=['log', 'stats']))
+    report = json.loads((tmp_path / 'results.json').read_text())
+    assert (report['target'], report['concurrency']) == ('in-process', 4)
+    for name in ('log', 'stats'):
+        overall = report['scenarios'][name]['overall']
+        assert overall['requests'] == 40 and overall['errors'] == 0
+        assert overall['p50_ms'] <= overall['p95_ms'] <= overall['p99_ms']
+    assert await server.db.bypass_logs.count_documents({}) == 40
+
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps(report))
+    await load_test.run(_args(tmp_path, routes=['stats'], baseline=str(baseline), output=None))
+    assert 'vs baseline stats' in capsys.readouterr().out
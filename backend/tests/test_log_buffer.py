@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+from log_buffer import LogWriteBuffer
+
+pytestmark = pytest.mark.anyio
+
+
+class FlakyCollection:
+    """Fails the first ``failures`` writes, optionally after storing the documents"""
+
+    def __init__(self, db, failures=0, partial=False):
+        self.collection = db.bypass_logs
+        self.failures = failures
+        self.partial = partial
+        self.calls = 0
+
+    async def insert_many(self, documents, ordered=True):
+        self.calls += 1
+        if self.calls <= self.failures:
+            if self.partial:
+                await self.collection.insert_many(documents, ordered=ordered)
+            raise AutoReconnect("connection reset")
+        return await self.collection.insert_many(documents, ordered=ordered)
+
+
+def _buffer(collection, stored, **kwargs):
+    async def on_flush(documents):
+        stored.extend(documents)
+    return LogWriteBuffer(collection, flush_interval=0.01, retry_backoff=0, on_flush=on_flush, **kwargs)
+
+
+async def test_queued_documents_are_flushed_in_batches(db):
+    stored = []
+    buffer = _buffer(db.bypass_logs, stored, max_batch_size=4)
+    buffer.start()
+    for index in range(10):
+        await buffer.put({'n': index})
+    await buffer.close()
+    assert await db.bypass_logs.count_documents({}) == 10
+    assert sorted(document['n'] for document in stored) == list(range(10))
+    assert buffer.flushes >= 3 and (buffer.flushed_documents, buffer.dropped_documents) == (10, 0)
+
+
+async def test_put_writes_synchronously_when_not_running(db):
+    stored = []
+    await _buffer(db.bypass_logs, stored).put({'n': 1})
+    assert await db.bypass_logs.count_documents({}) == 1 and len(stored) == 1
+
+
+async def test_transient_errors_are_retried(db):
+    stored = []
+    collection = FlakyCollection(db, failures=2)
+    buffer = _buffer(collection, stored)
+    await buffer._flush([{'n': 1}, {'n': 2}])
+    assert collection.calls == 3 and buffer.retries == 2
+    assert (buffer.flushed_documents, buffer.dropped_documents) == (2, 0)
+    assert len(stored) == 2
+
+
+async def test_retry_after_a_partial_write_does_not_drop_or_duplicate(db):
+    stored = []
+    buffer = _buffer(FlakyCollection(db, failures=1, partial=True), stored)
+    await buffer._flush([{'n': 1}, {'n': 2}])
+    assert await db.bypass_logs.count_documents({}) == 2
+    assert (buffer.flushed_documents, buffer.dropped_documents) == (2, 0)
+
+
+async def test_batch_is_dropped_after_the_last_retry(db, caplog):
+    stored = []
+    buffer = _buffer(FlakyCollection(db, failures=10), stored, max_retries=2)
+    await buffer._flush([{'n': 1}, {'n': 2}])
+    assert (buffer.retries, buffer.flushed_documents, buffer.dropped_documents) == (2, 0, 2)
+    assert stored == []
+    assert any(record.levelname == 'ERROR' and 'Dropping 2' in record.message for record in caplog.records)
+
+
+async def test_rejected_documents_are_not_retried(db):
+    stored = []
+    await db.bypass_logs.create_index([('n', 1)], unique=True)
+    buffer = _buffer(db.bypass_logs, stored)
+    await buffer._flush([{'n': 1}, {'n': 1}, {'n': 2}])
+    assert buffer.retries == 0
+    assert (buffer.flushed_documents, buffer.dropped_documents) == (2, 1)
+    assert [document['n'] for document in stored] == [1, 2]
+
+
+async def test_on_flush_errors_are_contained(db):
+    async def on_flush(documents):
+        raise RuntimeError("boom")
+
+    buffer = LogWriteBuffer(db.bypass_logs, on_flush=on_flush)
+    await buffer._flush([{'n': 1}])
+    assert buffer.flushed_documents == 1
+
+
+async def test_producers_wait_while_the_queue_is_full(db):
+    buffer = LogWriteBuffer(db.bypass_logs, max_queue_size=1, flush_interval=0.01)
+    buffer._queue = asyncio.Queue(maxsize=1)
+    buffer._task = asyncio.create_task(asyncio.sleep(3600))
+    await buffer.put({'n': 1})
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(buffer.put({'n': 2}), 0.05)
+    buffer._task.cancel()
+
@@ -0,0 +1,83 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from bson import Binary
+from pymongo.errors import BulkWriteError
+
+import stats_engine
+from log_codec import PLAIN_CODEC, CompactLogCodec, EncodingWriter, convert
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 10, 18, 12, 0)
+
+
+def _logs(count=6):
+    return [
+        {
+            'id': str(uuid.UUID(int=index + 1)), 'action': 'header_modified', 'domain': f"d{index % 2}.fr",
+            'url': f"https://d{index % 2}.fr/{index}", 'timestamp': NOW - timedelta(hours=index),
+            'user_agent': 'Mozilla/5.0' if index % 3 else None, 'success': index != 1,
+        }
+        for index in range(count)
+    ]
+
+
+async def test_compact_documents_round_trip(db):
+    codec = CompactLogCodec(db)
+    logs = _logs()
+    encoded = await codec.encode_many(logs)
+    assert encoded[0] == {'_id': Binary.from_uuid(uuid.UUID(int=1)), 'u': 'https://d0.fr/0', 't': NOW, 's': True, 'a': 1, 'd': 1}
+    assert encoded[1]['d'] == 2 and encoded[1]['ua'] == 1
+    assert await codec.decode_many(encoded) == logs
+    assert await codec.decode_many(encoded[:1], ['domain', 'user_agent']) == [{
+        'id': logs[0]['id'], 'action': 'header_modified', 'domain': 'd0.fr', 'url': 'https://d0.fr/0',
+        'timestamp': NOW, 'user_agent': None, 'success': True,
+    }]
+
+
+async def test_codes_are_shared_between_workers(db):
+    first, second = CompactLogCodec(db), CompactLogCodec(db)
+    await first.encode_many(_logs(2))
+    encoded = await second.encode_many([{**_logs(1)[0], 'domain': 'd1.fr'}])
+    assert encoded[0]['d'] == 2
+    fresh = CompactLogCodec(db)
+    await fresh.load()
+    assert await fresh.decode_values('domain', [1, 2, 99, 'legacy.fr']) == ['d0.fr', 'd1.fr', None, 'legacy.fr']
+
+
+async def test_non_uuid_ids_are_kept_as_is(db):
+    encoded = await CompactLogCodec(db).encode_many([{**_logs(1)[0], 'id': 'custom'}])
+    assert encoded[0]['_id'] == 'custom'
+
+
+async def test_compact_stats_match_plain_stats(db):
+    codec = CompactLogCodec(db)
+    await db.bypass_logs.insert_many(_logs())
+    await EncodingWriter(db.bypass_events, codec).insert_many(_logs())
+    plain = await stats_engine.compute_stats(db.bypass_logs, NOW, 5, PLAIN_CODEC)
+    compact = await stats_engine.compute_stats(db.bypass_events, NOW, 5, codec)
+    assert compact == plain
+    window = (NOW - timedelta(hours=2), NOW)
+    assert await stats_engine.compute_window_stats(db.bypass_events, *window, 5, codec=codec) == \
+        await stats_engine.compute_window_stats(db.bypass_logs, *window, 5)
+
+
+async def test_encoding_writer_keeps_error_indexes(db):
+    writer = EncodingWriter(db.bypass_events, CompactLogCodec(db))
+    logs = _logs(3)
+    await writer.insert_one(logs[1])
+    with pytest.raises(BulkWriteError) as raised:
+        await writer.insert_many(logs)
+    assert [error['index'] for error in raised.value.details['writeErrors']] == [1]
+
+
+async def test_convert_is_idempotent(db):
+    await db.bypass_logs.insert_many(_logs())
+    assert await convert(db, batch_size=4) == 6
+    assert await convert(db, batch_size=4) == 6
+    assert await db.bypass_events.count_documents({}) == 6
+    codec = CompactLogCodec(db)
+    decoded = await codec.decode_many(await db.bypass_events.find().sort('t', -1).to_list(None))
+    assert decoded == _logs()
@@ -0,0 +1,227 @@
+"""The in-memory stand-in must answer the backend's own queries like MongoDB.
+
+Every scenario runs against ``memory://`` and against a reference: mongomock
+when it is installed, and a real server when ``TEST_MONGO_URL`` is set.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+import memory_db
+import migrations
+import pagination
+import rollups
+import stats_engine
+from config_snapshot import deleted_version, next_config_version, record_config_deletion
+from partitions import LogPartitions
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 10, 18, 12, 0)
+
+
+@pytest.fixture(params=['mongomock', 'mongodb'])
+def reference(request):
+    """A database with real MongoDB semantics (or a close emulation)"""
+    if request.param == 'mongomock':
+        mongomock_motor = pytest.importorskip('mongomock_motor')
+        yield mongomock_motor.AsyncMongoMockClient()['test'], False
+        return
+    url = os.environ.get('TEST_MONGO_URL')
+    if not url:
+        pytest.skip("TEST_MONGO_URL is not set")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pymongo import MongoClient
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    yield AsyncIOMotorClient(url)[name], True
+    MongoClient(url).drop_database(name)
+
+
+def _logs(count=40):
+    return [
+        {
+            'id': str(index),
+            'action': 'header_modified',
+            'domain': f"d{index % 3}.fr",
+            'url': f"https://d{index % 3}.fr/{index}",
+            'timestamp': NOW - timedelta(hours=7 * index),
+            'success': index % 4 != 0,
+        }
+        for index in range(count)
+    ]
+
+
+async def _both(reference, scenario):
+    reference_db, _ = reference
+    fake = memory_db.MemoryClient(f"memory://{uuid.uuid4().hex}")['test']
+    try:
+        return await scenario(fake), await scenario(reference_db)
+    finally:
+        memory_db.MemoryClient.reset(fake.client.url)
+
+
+def _by_domain(sites):
+    return sorted(sites, key=lambda site: (-site['count'], site['domain']))
+
+
+async def test_facet_stats_match(reference):
+    async def scenario(db):
+        await db.bypass_logs.insert_many(_logs())
+        stats = await stats_engine.compute_stats(db.bypass_logs, NOW, 5)
+        window = await stats_engine.compute_window_stats(db.bypass_logs, NOW - timedelta(days=2), NOW, 5)
+        stats['most_bypassed_sites'] = _by_domain(stats['most_bypassed_sites'])
+        window['most_bypassed_sites'] = _by_domain(window['most_bypassed_sites'])
+        return stats, window
+
+    fake, expected = await _both(reference, scenario)
+    assert fake == expected
+    assert fake[0]['total_bypasses'] == 40
+
+
+async def test_partition_union_matches(reference):
+    if not reference[1]:
+        pytest.skip("mongomock has no $unionWith")
+
+    async def scenario(db):
+        partitions = LogPartitions(db, granularity='day')
+        await partitions.writer.insert_many(_logs())
+        stats = await stats_engine.compute_stats(await partitions.collections(), NOW, 5)
+        stats['most_bypassed_sites'] = _by_domain(stats['most_bypassed_sites'])
+        return await partitions.partition_names(), stats
+
+    fake, expected = await _both(reference, scenario)
+    assert fake == expected
+
+
+async def test_rollups_match(reference):
+    async def scenario(db):
+        logs = _logs()
+        await db.bypass_logs.insert_many([dict(log) for log in logs])
+        await rollups.fold_logs(db.folded, logs)
+        await rollups.rebuild_rollups(db.bypass_logs, db.rebuilt)
+        folded = await rollups.read_stats(db.folded, NOW)
+        rebuilt = await rollups.read_stats(db.rebuilt, NOW)
+        for stats in (folded, rebuilt):
+            stats['most_bypassed_sites'] = _by_domain(stats['most_bypassed_sites'])
+        return folded, rebuilt
+
+    fake, expected = await _both(reference, scenario)
+    assert fake == expected
+    assert fake[0] == fake[1]
+
+
+async def test_rollup_subtraction_marks_match(reference):
+    async def scenario(db):
+        logs = _logs()
+        await db.bypass_logs.insert_many([dict(log) for log in logs])
+        await rollups.fold_logs(db.bypass_rollups, logs)
+        for _ in range(2):
+            await rollups.subtract_logs(db.bypass_logs, db.bypass_rollups)
+        marked = await db.bypass_rollups.find_one({'_id': 'total'})
+        await rollups.forget_subtracted('bypass_logs', db.bypass_rollups)
+        return marked, await db.bypass_rollups.find({}).to_list(None)
+
+    fake, expected = await _both(reference, scenario)
+    assert fake == expected
+    assert fake[0] == {'_id': 'total', 'kind': 'total', 'count': 0, 'success': 0, 'subtracted': ['bypass_logs']}
+    assert fake[1] == [{'_id': 'total', 'kind': 'total', 'count': 0, 'success': 0, 'subtracted': []}]
+
+
+async def test_keyset_pages_match(reference):
+    async def scenario(db):
+        await db.status_checks.insert_many([
+            {'_id': f"id{index:02d}", 'client_name': 'c', 'timestamp': NOW - timedelta(minutes=index % 5)}
+            for index in range(23)
+        ])
+        pages, cursor = [], None
+        while True:
+            documents, cursor = await pagination.fetch_page(db.status_checks, [('timestamp', 1), ('_id', 1)], 10, cursor)
+            pages.append([document['_id'] for document in documents])
+            if cursor is None:
+                return pages
+
+    fake, expected = await _both(reference, scenario)
+    assert fake == expected
+    assert [len(page) for page in fake] == [10, 10, 3]
+
+
+async def test_sorts_apply_before_projections(reference):
+    async def scenario(db):
+        await db.bypass_logs.insert_many(_logs(6))
+        cursor = db.bypass_logs.find({}, {'_id': 0, 'id': 1}).sort('timestamp', 1).limit(4)
+        return [document['id'] for document in await cursor.to_list(None)]
+
+    fake, expected = await _both(reference, scenario)
+    assert fake == expected == ['5', '4', '3', '2']
+
+
+async def test_migrations_match(reference):
+    async def scenario(db):
+        await db.bypass_logs.insert_many([{'_id': 1, 'domain': 'a.fr'}, {'_id': 2, 'domain': 'a.fr', 'success': False}])
+        await db.site_configs.insert_many([
+            {'_id': 1, 'domain': 'a.fr', 'last_updated': NOW - timedelta(days=1)},
+            {'_id': 2, 'domain': 'a.fr', 'last_updated': NOW},
+            {'_id': 3, 'domain': 'b.fr', 'last_updated': NOW},
+        ])
+        applied = await migrations.run_migrations(db)
+        logs = await db.bypass_logs.find({}, {'_id': 1, 'success': 1}).sort('_id', 1).to_list(None)
+        configs = await db.site_configs.find({}, {'_id': 1, 'version': 1}).sort('_id', 1).to_list(None)
+        return applied, logs, configs, await migrations.run_migrations(db)
+
+    fake, expected = await _both(reference, scenario)
+    assert fake == expected
+    applied, logs, configs, again = fake
+    assert applied == [1, 2, 3] and again == []
+    assert logs == [{'_id': 1, 'success': True}, {'_id': 2, 'success': False}]
+    assert [config['_id'] for config in configs] == [2, 3]
+
+
+async def test_counters_and_upserts_match(reference):
+    async def scenario(db):
+        versions = [await next_config_version(db) for _ in range(3)]
+        versions.append((await record_config_deletion(db), await deleted_version(db)))
+        await db.site_configs.replace_one({'domain': 'a.fr'}, {'domain': 'a.fr', 'v': 1}, upsert=True)
+        await db.site_configs.replace_one({'domain': 'a.fr'}, {'domain': 'a.fr', 'v': 2}, upsert=True)
+        return versions, await db.site_configs.find({}, {'_id': 0}).to_list(None)
+
+    fake, expected = await _both(reference, scenario)
+    assert fake == expected == ([1, 2, 3, (4, 4)], [{'domain': 'a.fr', 'v': 2}])
+
+
+async def test_unique_index_errors_match(reference):
+    async def scenario(db):
+        await db.site_configs.create_index([('domain', 1)], name='domain_unique', unique=True)
+        try:
+            await db.site_configs.insert_many(
+                [{'domain': 'a.fr'}, {'domain': 'a.fr'}, {'domain': 'b.fr'}, {'domain': 'b.fr'}], ordered=False
+            )
+        except BulkWriteError as e:
+            failed = [error['index'] for error in e.details['writeErrors']]
+            codes = {error['code'] for error in e.details['writeErrors']}
+        with pytest.raises(DuplicateKeyError):
+            await db.site_configs.insert_one({'domain': 'a.fr'})
+        names = sorted([index['name'] async for index in db.site_configs.list_indexes()])
+        return failed, codes, await db.site_configs.count_documents({}), names
+
+    fake, expected = await _both(reference, scenario)
+    assert fake == expected == ([1, 3], {11000}, 2, ['_id_', 'domain_unique'])
+
+
+async def test_datetimes_are_stored_with_millisecond_precision(reference):
+    async def scenario(db):
+        await db.events.insert_one({'_id': 1, 'timestamp': datetime(2026, 10, 18, 12, 0, 0, 123456)})
+        return (await db.events.find_one({'_id': 1}))['timestamp']
+
+    fake, expected = await _both(reference, scenario)
+    assert fake == expected == datetime(2026, 10, 18, 12, 0, 0, 123000)
+
+
+async def test_unsupported_operators_fail_loudly(db):
+    await db.events.insert_one({'_id': 1})
+    with pytest.raises(OperationFailure):
+        await db.events.find({'_id': {'$size': 1}}).to_list(None)
+    with pytest.raises(OperationFailure):
+        await db.events.aggregate([{'$unwind': '$tags'}]).to_list(None)
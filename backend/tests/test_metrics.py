@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+
+import pytest
+
+import metrics
+
+
+def _lines(registry):
+    return registry.render().decode().splitlines()
+
+
+def _command(name, command, request_id=1, duration_micros=2000):
+    return SimpleNamespace(
+        command_name=name, command=command, request_id=request_id, operation_id=request_id,
+        duration_micros=duration_micros,
+    )
+
+
+def test_counters_and_gauges():
+    registry = metrics.Registry()
+    counter = registry.counter('events_total', 'Events', ('kind',))
+    counter.inc('a')
+    counter.inc('a', amount=2)
+    counter.inc('b"\n')
+    depth = registry.gauge('queue_depth', 'Queued events', callback=lambda: 7)
+    depth.set(3)
+    assert _lines(registry) == [
+        '# HELP events_total Events', '# TYPE events_total counter',
+        'events_total{kind="a"} 3', 'events_total{kind="b\\"\\n"} 1',
+        '# HELP queue_depth Queued events', '# TYPE queue_depth gauge',
+        'queue_depth 7', 'queue_depth 3',
+    ]
+
+
+def test_histograms_are_cumulative():
+    registry = metrics.Registry()
+    histogram = registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, '/a')
+    assert _lines(registry)[2:] == [
+        'latency_seconds_bucket{route="/a",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a",le="1"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 3.65',
+        'latency_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_mongo_commands_are_timed_per_collection():
+    registry = metrics.Registry()
+    listener = metrics.MongoCommandMetrics(registry)
+    listener.started(_command('aggregate', {'aggregate': 'bypass_logs'}, 1))
+    listener.succeeded(_command('aggregate', {}, 1, 1500))
+    listener.started(_command('getMore', {'getMore': 42, 'collection': 'bypass_logs'}, 2))
+    listener.failed(_command('getMore', {}, 2))
+    listener.started(_command('ping', {'ping': 1}, 3))
+    listener.succeeded(_command('ping', {}, 3))
+    rendered = _lines(registry)
+    assert 'mongodb_command_duration_seconds_sum{collection="bypass_logs",command="aggregate"} 0.0015' in rendered
+    assert 'mongodb_command_duration_seconds_count{collection="bypass_logs",command="getMore"} 1' in rendered
+    assert 'mongodb_command_failures_total{collection="bypass_logs",command="getMore"} 1' in rendered
+    assert 'mongodb_command_duration_seconds_count{collection="",command="ping"} 1' in rendered
+    assert listener._collections == {}
+
+
+@pytest.fixture
+def instrumented_app():
+    from fastapi import FastAPI, HTTPException
+    from fastapi.testclient import TestClient
+
+    registry = metrics.Registry()
+    app = FastAPI()
+
+    @app.get('/items/{item_id}')
+    async def item(item_id: int):
+        if item_id == 0:
+            raise HTTPException(status_code=503)
+        if item_id < 0:
+            raise RuntimeError("boom")
+        return {'id': item_id}
+
+    app.add_middleware(metrics.MetricsMiddleware, registry=registry)
+    with TestClient(app, raise_server_exceptions=False) as client:
+        yield client, registry
+
+
+def test_middleware_labels_requests_by_route_template(instrumented_app):
+    client, registry = instrumented_app
+    for item_id in (1, 2, 0, -1):
+        client.get(f"/items/{item_id}")
+    client.get('/missing')
+    rendered = _lines(registry)
+    assert 'http_request_duration_seconds_count{method="GET",route="/items/{item_id}"} 4' in rendered
+    assert 'http_responses_total{method="GET",route="/items/{item_id}",status="2xx"} 2' in rendered
+    assert 'http_request_errors_total{method="GET",route="/items/{item_id}"} 2' in rendered
+    assert 'http_responses_total{method="GET",route="unmatched",status="4xx"} 1' in rendered
+    assert 'http_requests_in_flight 0' in rendered
+
+
+def test_metrics_endpoint(api):
+    api.post('/api/bypass-log', json={'action': 'header_modified', 'domain': 'a.fr', 'url': 'https://a.fr/1'})
+    response = api.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'] == metrics.CONTENT_TYPE
+    assert 'http_request_duration_seconds_count{method="POST",route="/api/bypass-log"}' in response.text
+    assert '# TYPE stats_cache_hits_total counter' in response.text
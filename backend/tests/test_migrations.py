@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import indexes
+import migrations
+from indexes import IndexSpec
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(migrations, 'LOCK_POLL_INTERVAL', 0.01)
+
+
+def _recorder(calls, version, delay=0.0):
+    async def apply(db):
+        calls.append(version)
+        await asyncio.sleep(delay)
+    return migrations.Migration(version, f"step {version}", apply)
+
+
+async def test_pending_migrations_are_applied_once_in_order(db):
+    calls = []
+    steps = [_recorder(calls, 1), _recorder(calls, 2)]
+    assert await migrations.run_migrations(db, steps) == [1, 2]
+    assert await migrations.run_migrations(db, steps + [_recorder(calls, 3)]) == [3]
+    assert calls == [1, 2, 3]
+    assert await migrations.applied_versions(db) == [1, 2, 3]
+    assert (await db.schema_migrations.find_one({'_id': migrations.LOCK_ID}))['owner'] is None
+
+
+async def test_concurrent_runs_apply_each_migration_once(db):
+    calls = []
+    steps = [_recorder(calls, 1, delay=0.05), _recorder(calls, 2)]
+    results = await asyncio.gather(*(migrations.run_migrations(db, steps) for _ in range(3)))
+    assert calls == [1, 2]
+    assert sorted(results) == [[], [], [1, 2]]
+
+
+async def test_runs_wait_for_a_live_lease(db):
+    await db.schema_migrations.insert_one({
+        '_id': migrations.LOCK_ID, 'owner': 'other', 'expires_at': datetime.utcnow() + timedelta(minutes=1)
+    })
+    run = asyncio.ensure_future(migrations.run_migrations(db, [_recorder([], 1)]))
+    await asyncio.sleep(0.05)
+    assert not run.done()
+    await migrations._release_lock(db.schema_migrations, 'other')
+    assert await asyncio.wait_for(run, 1) == [1]
+
+
+async def test_an_expired_lease_is_taken_over(db):
+    await db.schema_migrations.insert_one({
+        '_id': migrations.LOCK_ID, 'owner': 'crashed', 'expires_at': datetime.utcnow() - timedelta(seconds=1)
+    })
+    assert await asyncio.wait_for(migrations.run_migrations(db, [_recorder([], 1)]), 1) == [1]
+
+
+async def test_a_failed_migration_releases_the_lease(db):
+    async def broken(db):
+        raise RuntimeError("boom")
+
+    calls = []
+    with pytest.raises(RuntimeError):
+        await migrations.run_migrations(db, [_recorder(calls, 1), migrations.Migration(2, "broken", broken)])
+    assert await migrations.applied_versions(db) == [1]
+    assert await migrations.run_migrations(db, [_recorder(calls, 1), _recorder(calls, 2)]) == [2]
+
+
+def test_duplicate_versions_are_refused():
+    with pytest.raises(ValueError):
+        migrations.migration(1, "again")(lambda db: None)
+
+
+async def test_ensure_indexes_creates_missing_indexes_once(db):
+    declarations = {'site_configs': indexes.INDEXES['site_configs'], 'bypass_logs': indexes.INDEXES['bypass_logs']}
+    report = await indexes.ensure_indexes(db, declarations)
+    assert report['site_configs']['created'] == ['domain_unique', 'version']
+    assert report['bypass_logs']['created'] == ['timestamp_domain', 'domain', 'success_true']
+    again = await indexes.ensure_indexes(db, declarations)
+    assert all(not any(collection_report.values()) for collection_report in again.values())
+
+
+async def test_ensure_indexes_reports_drift_without_touching_it(db):
+    await db.site_configs.create_index([('domain', 1)], name='domain_unique')
+    await db.site_configs.create_index([('name', 1)], name='name')
+    report = await indexes.ensure_indexes(db, {'site_configs': [IndexSpec('domain_unique', [('domain', 1)], {'unique': True})]})
+    assert report['site_configs']['created'] == []
+    assert report['site_configs']['drift'] == ["domain_unique: unique None != True"]
+    assert report['site_configs']['undeclared'] == ['name']
+    names = sorted([index['name'] async for index in db.site_configs.list_indexes()])
+    assert names == ['_id_', 'domain_unique', 'name']
@@ -0,0 +1,63 @@
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+PAYLOAD = {'action': 'header_modified', 'domain': 'a.fr', 'url': 'https://a.fr/1', 'user_agent': 'UA'}
+
+
+def test_from_create_matches_a_validated_log(server):
+    data = server.BypassLogCreate.model_validate(PAYLOAD)
+    constructed = server.BypassLog.from_create(data)
+    validated = server.BypassLog.model_validate(constructed.model_dump())
+    assert constructed.model_dump() == validated.model_dump()
+    assert constructed.model_dump(exclude={'id', 'timestamp'}) == {**PAYLOAD, 'success': True}
+    assert server.BypassLog.from_create(data).id != constructed.id
+
+
+def test_the_stored_document_is_the_response(api, server):
+    response = api.post('/api/bypass-log', json=PAYLOAD)
+    assert response.status_code == 200
+    body = response.json()
+    stored = api.portal.call(lambda: server.db.bypass_logs.find_one({'id': body['id']}, {'_id': 0}))
+    assert set(stored) == set(body)
+    assert {key: stored[key] for key in PAYLOAD} == PAYLOAD
+    # BSON keeps milliseconds
+    assert timedelta(0) <= datetime.fromisoformat(body['timestamp']) - stored['timestamp'] < timedelta(milliseconds=1)
+
+
+@pytest.mark.parametrize('payload', [
+    {'action': 'header_modified', 'domain': 'a.fr'},
+    {**PAYLOAD, 'success': 'maybe'},
+    {**PAYLOAD, 'domain': ['a.fr']},
+])
+def test_invalid_events_are_rejected_before_storage(api, server, payload):
+    assert api.post('/api/bypass-log', json=payload).status_code == 422
+    assert api.portal.call(lambda: server.db.bypass_logs.count_documents({})) == 0
+
+
+def test_status_checks_are_built_once(api):
+    body = api.post('/api/status', json={'client_name': 'c'}).json()
+    assert set(body) == {'id', 'client_name', 'timestamp'}
+    [listed] = api.get('/api/status').json()
+    assert {**listed, 'timestamp': listed['timestamp'][:23]} == {**body, 'timestamp': body['timestamp'][:23]}
+
+
+async def test_benchmark_paths_build_the_same_document(tmp_path):
+    import bench_models
+    field = bench_models.response_field()
+    with pytest.warns(DeprecationWarning):
+        legacy_document, legacy_body = await bench_models.legacy(field, bench_models.PAYLOAD)
+    document, body = await bench_models.current(field, bench_models.PAYLOAD)
+    ignored = {'id', 'timestamp'}
+    assert {key: value for key, value in document.items() if key not in ignored} == \
+        {key: value for key, value in legacy_document.items() if key not in ignored}
+    assert set(json.loads(body)) == set(json.loads(legacy_body))
+
+    output = tmp_path / 'bench.json'
+    with pytest.warns(DeprecationWarning):
+        await bench_models.run(SimpleNamespace(events=5, output=str(output)))
+    assert {'legacy', 'current'} <= set(json.loads(output.read_text()))
@@ -0,0 +1,103 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+import pagination
+
+pytestmark = pytest.mark.anyio
+
+SORT = [('timestamp', 1), ('_id', 1)]
+NOW = datetime(2026, 10, 18, 12, 0, 0, 123000)
+
+
+def test_cursor_round_trip():
+    oid = ObjectId()
+    cursor = pagination.encode_cursor({'timestamp': NOW, '_id': oid, 'other': 1}, SORT)
+    assert '=' not in cursor and '/' not in cursor and '+' not in cursor
+    assert pagination.decode_cursor(cursor, SORT) == [NOW, oid]
+    assert pagination.decode_cursor(pagination.encode_cursor({'domain': 'a.fr'}, [('domain', 1)]), [('domain', 1)]) == ['a.fr']
+
+
+@pytest.mark.parametrize('cursor', [
+    'not-base64!',
+    pagination.encode_cursor({'domain': 'a.fr'}, [('domain', 1)]),
+    'eyJhIjoxfQ',  # {"a":1}
+    '',
+])
+def test_malformed_cursors_raise_value_error(cursor):
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(cursor, SORT)
+
+
+def test_keyset_filter():
+    assert pagination.keyset_filter([('domain', 1)], ['a.fr']) == {'domain': {'$gt': 'a.fr'}}
+    assert pagination.keyset_filter([('timestamp', -1), ('_id', 1)], [NOW, 3]) == {'$or': [
+        {'timestamp': {'$lt': NOW}},
+        {'timestamp': NOW, '_id': {'$gt': 3}},
+    ]}
+
+
+async def _checks(db, count=7):
+    await db.status_checks.insert_many([
+        {'_id': f"id{index}", 'client_name': 'c', 'timestamp': NOW + timedelta(minutes=index // 2)}
+        for index in range(count)
+    ])
+
+
+async def test_fetch_page_walks_every_document_once(db):
+    await _checks(db)
+    seen, cursor = [], None
+    while True:
+        documents, cursor = await pagination.fetch_page(db.status_checks, SORT, 3, cursor, query={'client_name': 'c'})
+        seen.extend(document['_id'] for document in documents)
+        if cursor is None:
+            break
+    assert seen == [f"id{index}" for index in range(7)]
+
+
+async def test_stream_ndjson(db):
+    await _checks(db)
+    _, cursor = await pagination.fetch_page(db.status_checks, SORT, 5)
+    lines = [line async for line in pagination.stream_ndjson(
+        db.status_checks, SORT, cursor, projection={'_id': 1}, transform=lambda document: {'id': document['_id']}
+    )]
+    assert [json.loads(line) for line in lines] == [{'id': 'id5'}, {'id': 'id6'}]
+    assert all(line.endswith(b'\n') for line in lines)
+
+
+def test_stream_ndjson_rejects_a_bad_cursor_before_streaming(db):
+    with pytest.raises(ValueError):
+        pagination.stream_ndjson(db.status_checks, SORT, 'garbage')
+
+
+def test_status_checks_are_paginated(api):
+    for index in range(5):
+        api.post('/api/status', json={'client_name': f"client{index}"})
+    first = api.get('/api/status', params={'limit': 3})
+    assert len(first.json()) == 3
+    cursor = first.headers['x-next-cursor']
+    assert 'rel="next"' in first.headers['link']
+    rest = api.get('/api/status', params={'limit': 3, 'cursor': cursor})
+    assert 'x-next-cursor' not in rest.headers
+    names = [check['client_name'] for check in first.json() + rest.json()]
+    assert sorted(names) == [f"client{index}" for index in range(5)]
+
+    streamed = api.get('/api/status', params={'stream': 'true', 'cursor': cursor})
+    assert streamed.headers['content-type'] == 'application/x-ndjson'
+    assert [json.loads(line)['client_name'] for line in streamed.text.splitlines()] == [check['client_name'] for check in rest.json()]
+
+
+@pytest.mark.parametrize('path', ['/api/status', '/api/supported-sites'])
+@pytest.mark.parametrize('stream', ['false', 'true'])
+def test_bad_cursors_are_rejected(api, path, stream):
+    response = api.get(path, params={'cursor': 'garbage', 'stream': stream})
+    assert response.status_code == 400
+    assert response.json()['detail'] == "Invalid pagination cursor"
+
+
+def test_supported_sites_stream(api):
+    api.post('/api/update-rules')
+    lines = api.get('/api/supported-sites', params={'stream': 'true'}).text.splitlines()
+    assert [json.loads(line)['domain'] for line in lines] == ['lefigaro.fr']
@@ -0,0 +1,165 @@
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import rollups
+import stats_engine
+from log_buffer import LogWriteBuffer
+from partitions import LogPartitions
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 10, 18, 12, 0)
+
+
+def _log(_id, days_ago=0, domain='a.fr'):
+    return {'_id': _id, 'domain': domain, 'timestamp': NOW - timedelta(days=days_ago), 'success': True}
+
+
+class FailingPartitions(LogPartitions):
+    """Partitions whose writes fail for the given names"""
+
+    def __init__(self, db, failing):
+        super().__init__(db, granularity='day')
+        self.failing = set(failing)
+
+    async def collection_for(self, timestamp):
+        if self.name_for(timestamp) in self.failing:
+            raise AutoReconnect("connection reset")
+        return await super().collection_for(timestamp)
+
+
+def test_partition_names_and_ranges(db):
+    days = LogPartitions(db, granularity='day')
+    months = LogPartitions(db, granularity='month')
+    assert days.name_for(NOW) == 'bypass_logs_20261018'
+    assert months.name_for(NOW) == 'bypass_logs_202610'
+    assert LogPartitions(db).name_for(NOW) == 'bypass_logs'
+    assert days.partition_range('bypass_logs_20261018') == (datetime(2026, 10, 18), datetime(2026, 10, 19))
+    assert months.partition_range('bypass_logs_202612') == (datetime(2026, 12, 1), datetime(2027, 1, 1))
+    assert days.partition_range('bypass_logs_20261399') is None
+    with pytest.raises(ValueError):
+        LogPartitions(db, granularity='week')
+
+
+async def test_writes_are_routed_and_partitions_indexed(db):
+    partitions = LogPartitions(db, granularity='day')
+    await partitions.writer.insert_many([_log(1), _log(2, days_ago=1), _log(3)])
+    assert await partitions.partition_names() == ['bypass_logs_20261017', 'bypass_logs_20261018']
+    assert await db.bypass_logs_20261018.count_documents({}) == 2
+    indexes = sorted([index['name'] async for index in db.bypass_logs_20261017.list_indexes()])
+    assert indexes == ['_id_', 'domain', 'success_true', 'timestamp_domain']
+    collections = await partitions.collections(NOW - timedelta(hours=1), None)
+    assert [collection.name for collection in collections] == ['bypass_logs', 'bypass_logs_20261018']
+
+
+async def test_write_errors_are_reported_with_the_callers_indexes(db):
+    writer = LogPartitions(db, granularity='day').writer
+    await writer.insert_many([_log(1), _log(2, days_ago=1)])
+    with pytest.raises(BulkWriteError) as raised:
+        await writer.insert_many([_log(3, days_ago=1), _log(1), _log(4), _log(2, days_ago=1)])
+    details = raised.value.details
+    assert [error['index'] for error in details['writeErrors']] == [1, 3]
+    assert all(error['code'] == 11000 for error in details['writeErrors'])
+    assert details['nInserted'] == 2
+
+
+async def test_a_failed_partition_does_not_hide_the_others(db):
+    writer = FailingPartitions(db, ['bypass_logs_20261017']).writer
+    with pytest.raises(BulkWriteError) as raised:
+        await writer.insert_many([_log(1), _log(2, days_ago=1), _log(3), _log(4, days_ago=1)])
+    details = raised.value.details
+    assert details['nInserted'] == 2
+    assert [error['index'] for error in details['writeErrors']] == [1, 3]
+    assert all('code' not in error for error in details['writeErrors'])
+    assert await db.bypass_logs_20261018.count_documents({}) == 2
+
+
+async def test_the_original_error_is_raised_when_nothing_was_written(db):
+    writer = FailingPartitions(db, ['bypass_logs_20261018']).writer
+    with pytest.raises(AutoReconnect):
+        await writer.insert_many([_log(1), _log(2)])
+
+
+async def test_the_buffer_retries_documents_of_a_failed_partition(db):
+    partitions = FailingPartitions(db, ['bypass_logs_20261017'])
+    writer = partitions.writer
+    calls = []
+
+    class Writer:
+        async def insert_many(self, documents, ordered=False):
+            calls.append(len(documents))
+            try:
+                return await writer.insert_many(documents, ordered=ordered)
+            finally:
+                # The partition comes back after the first attempt
+                partitions.failing.clear()
+
+    buffer = LogWriteBuffer(Writer(), retry_backoff=0)
+    await buffer._flush([_log(1), _log(2, days_ago=1), _log(3)])
+    assert calls == [3, 1]
+    assert (buffer.retries, buffer.flushed_documents, buffer.dropped_documents) == (1, 3, 0)
+    assert await db.bypass_logs_20261017.count_documents({}) == 1
+
+
+async def test_retention_drops_partitions_and_subtracts_their_rollups(db):
+    partitions = LogPartitions(db, granularity='day', retention_days=2)
+    logs = [_log(1), _log(2, days_ago=1, domain='b.fr'), _log(3, days_ago=3), _log(4, days_ago=4, domain='c.fr')]
+    await partitions.writer.insert_many([dict(log) for log in logs])
+    await rollups.fold_logs(db.bypass_rollups, logs)
+
+    dropped = await partitions.drop_expired(
+        NOW,
+        before_drop=lambda partition: rollups.subtract_logs(partition, db.bypass_rollups),
+        after_drop=lambda name: rollups.forget_subtracted(name, db.bypass_rollups),
+    )
+    assert dropped == ['bypass_logs_20261014', 'bypass_logs_20261015']
+    assert await partitions.partition_names() == ['bypass_logs_20261017', 'bypass_logs_20261018']
+
+    stats = await rollups.read_stats(db.bypass_rollups, NOW)
+    raw = await stats_engine.compute_stats(await partitions.collections(), NOW, 5)
+    assert stats['total_bypasses'] == raw['total_bypasses'] == 2
+    assert sorted(site['domain'] for site in stats['most_bypassed_sites']) == ['a.fr', 'b.fr']
+    assert await db.bypass_rollups.find_one({'_id': 'day:2026-10-14'}) is None
+
+
+async def test_a_failed_hook_keeps_the_partition(db):
+    partitions = LogPartitions(db, granularity='day', retention_days=1)
+    await partitions.writer.insert_many([_log(1, days_ago=3)])
+
+    async def broken(partition):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await partitions.drop_expired(NOW, before_drop=broken)
+    assert await partitions.partition_names() == ['bypass_logs_20261015']
+
+
+async def test_an_interrupted_sweep_subtracts_each_partition_once(db):
+    partitions = LogPartitions(db, granularity='day', retention_days=2)
+    logs = [_log(1), _log(2, days_ago=3), _log(3, days_ago=3, domain='b.fr')]
+    await partitions.writer.insert_many([dict(log) for log in logs])
+    await rollups.fold_logs(db.bypass_rollups, logs)
+
+    async def subtract_then_fail(partition):
+        await rollups.subtract_logs(partition, db.bypass_rollups)
+        raise RuntimeError("connection lost before the drop")
+
+    with pytest.raises(RuntimeError):
+        await partitions.drop_expired(NOW, before_drop=subtract_then_fail)
+    assert (await db.bypass_rollups.find_one({'_id': 'total'}))['count'] == 1
+
+    await partitions.drop_expired(
+        NOW,
+        before_drop=lambda partition: rollups.subtract_logs(partition, db.bypass_rollups),
+        after_drop=lambda name: rollups.forget_subtracted(name, db.bypass_rollups),
+    )
+    total = await db.bypass_rollups.find_one({'_id': 'total'})
+    assert (total['count'], total['subtracted']) == (1, [])
+    assert (await rollups.read_stats(db.bypass_rollups, NOW))['most_bypassed_sites'] == [{'domain': 'a.fr', 'count': 1}]
+
+
+async def test_retention_is_off_without_partitions(db):
+    await db.bypass_logs.insert_one(_log(1, days_ago=100))
+    assert await LogPartitions(db, retention_days=1).drop_expired(NOW) == []
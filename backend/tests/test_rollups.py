@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import rollups
+
+pytestmark = pytest.mark.anyio
+
+# A Wednesday, so the week started two days earlier
+NOW = datetime(2026, 10, 14, 12, 0)
+
+
+def _log(domain, days_ago=0, success=True):
+    return {'domain': domain, 'timestamp': NOW - timedelta(days=days_ago), 'success': success}
+
+
+LOGS = [
+    _log('a.fr'), _log('a.fr', success=False), _log('b.fr', days_ago=1),
+    _log('a.fr', days_ago=2), _log('c.fr', days_ago=3), _log('c.fr', days_ago=10, success=False),
+]
+
+
+async def test_fold_increments_the_counters(db):
+    await rollups.fold_logs(db.bypass_rollups, LOGS[:3])
+    await rollups.fold_logs(db.bypass_rollups, LOGS[3:])
+    await rollups.fold_logs(db.bypass_rollups, [])
+    assert await db.bypass_rollups.find_one({'_id': 'total'}) == {'_id': 'total', 'kind': 'total', 'count': 6, 'success': 4}
+    assert (await db.bypass_rollups.find_one({'_id': 'domain:a.fr'}))['count'] == 3
+    assert (await db.bypass_rollups.find_one({'_id': 'day:2026-10-14'}))['success'] == 1
+
+
+async def test_read_stats(db):
+    await rollups.fold_logs(db.bypass_rollups, LOGS)
+    stats = await rollups.read_stats(db.bypass_rollups, NOW, top_sites=2)
+    assert stats == {
+        'total_bypasses': 6,
+        'bypasses_today': 2,
+        'bypasses_this_week': 4,
+        'most_bypassed_sites': [{'domain': 'a.fr', 'count': 3}, {'domain': 'c.fr', 'count': 2}],
+        'success_rate': 66.67,
+    }
+
+
+async def test_read_stats_without_rollups(db):
+    stats = await rollups.read_stats(db.bypass_rollups, NOW)
+    assert (stats['total_bypasses'], stats['success_rate'], stats['most_bypassed_sites']) == (0, 0, [])
+
+
+async def test_rebuild_matches_the_folded_counters_and_is_idempotent(db):
+    await db.bypass_logs.insert_many([dict(log) for log in LOGS])
+    await rollups.fold_logs(db.folded, LOGS)
+    await rollups.rebuild_rollups(db.bypass_logs, db.rebuilt)
+    await rollups.rebuild_rollups(db.bypass_logs, db.rebuilt)
+    folded = await db.folded.find().sort('_id', 1).to_list(None)
+    rebuilt = await db.rebuilt.find().sort('_id', 1).to_list(None)
+    assert rebuilt == folded
+
+
+async def test_rebuild_overwrites_drifted_counters(db):
+    await db.bypass_logs.insert_many([dict(log) for log in LOGS])
+    await rollups.fold_logs(db.bypass_rollups, LOGS + LOGS)
+    await rollups.rebuild_rollups(db.bypass_logs, db.bypass_rollups)
+    assert (await rollups.read_stats(db.bypass_rollups, NOW))['total_bypasses'] == 6
+
+
+def test_stats_endpoint_reads_the_rollups(api, server):
+    for index in range(3):
+        api.post('/api/bypass-log', json={'action': 'header_modified', 'domain': 'a.fr', 'url': f"https://a.fr/{index}"})
+    assert server.repositories.logs.stats_source == 'rollups'
+    total = api.portal.call(lambda: server.db.bypass_rollups.find_one({'_id': 'total'}))
+    assert total['count'] == 3
+    assert api.get('/api/bypass-stats').json()['most_bypassed_sites'] == [{'domain': 'a.fr', 'count': 3}]
@@ -0,0 +1,150 @@
+import asyncio
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+import sketches
+import storage
+from log_codec import PLAIN_CODEC
+from partitions import LogPartitions
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 10, 18, 12, 0)
+
+
+def _log(index, minutes_ago=0, domain=None):
+    domain = domain or f"d{index % 4}.fr"
+    return {
+        'id': str(index), 'action': 'header_modified', 'domain': domain, 'url': f"https://{domain}/{index % 50}",
+        'timestamp': NOW - timedelta(minutes=minutes_ago), 'user_agent': None, 'success': True,
+    }
+
+
+def test_distinct_counts_stay_within_the_error_bound():
+    counter = sketches.HyperLogLog(precision=12)
+    for index in range(20000):
+        counter.add(f"https://a.fr/{index}")
+        counter.add(f"https://a.fr/{index // 2}")
+    assert abs(counter.estimate() - 20000) <= 20000 * 3 * counter.relative_error
+    assert sketches.HyperLogLog().estimate() == 0
+
+
+def test_heavy_hitters_bound_the_true_counts():
+    rng = random.Random(1)
+    keys = [f"k{int(rng.paretovariate(1.2))}" for _ in range(5000)]
+    hitters = sketches.HeavyHitters(capacity=20, width=256, depth=4)
+    for key in keys:
+        hitters.add(key)
+    truth = Counter(keys)
+    top = hitters.top(3, 'domain')
+    assert [item['domain'] for item in top] == [key for key, _ in truth.most_common(3)]
+    for item in top:
+        assert item['count'] - item['error'] <= truth[item['domain']] <= item['count']
+
+
+def test_sketches_round_trip_through_json(tmp_path):
+    traffic = sketches.TrafficSketches(capacity=10, precision=10, since=NOW)
+    traffic.add_logs([_log(index) for index in range(100)])
+    traffic.add_client('1.2.3.4|UA')
+    assert traffic.dirty
+
+    path = str(tmp_path / 'sketches.json')
+    sketches.save(path, traffic.to_json())
+    loaded = sketches.load(path)
+    assert loaded.summary() == traffic.summary()
+    assert not loaded.dirty
+    summary = loaded.summary(top=2)
+    assert (summary['since'], summary['events'], summary['unique_clients']) == (NOW, 100, 1)
+    assert abs(summary['unique_urls'] - 100) <= 100 * 3 * summary['distinct_relative_error']
+    assert [item['count'] for item in summary['top_domains']] == [25, 25]
+    assert sketches.load(str(tmp_path / 'missing.json')) is None
+
+
+async def test_rebuild_stops_at_the_cutoff(db):
+    partitions = LogPartitions(db)
+    logs = storage.MongoLogRepository(db, db, partitions.writer, partitions, PLAIN_CODEC, stats_source='raw')
+    await logs.insert_many([_log(index, minutes_ago=10 - index) for index in range(10)])
+    traffic = sketches.TrafficSketches()
+    await sketches.rebuild(logs, traffic, end=NOW - timedelta(minutes=3), batch_size=3)
+    assert traffic.events == 7
+
+
+def _log_body(index):
+    return {'action': 'header_modified', 'domain': 'live.fr', 'url': f"https://live.fr/{index}"}
+
+
+@pytest.fixture
+def sketch_server(server, monkeypatch, tmp_path):
+    """The app with sketches enabled on an empty sketch file"""
+    monkeypatch.setattr(server, 'SKETCHES_ENABLED', True)
+    monkeypatch.setattr(server, 'SKETCH_PATH', str(tmp_path / 'sketches.json'))
+    monkeypatch.setattr(server, 'traffic_sketches', sketches.TrafficSketches())
+    monkeypatch.setattr(server, 'sketch_task', None)
+    monkeypatch.setattr(server, 'sketch_rebuild_task', None)
+    return server
+
+
+def test_sketches_are_off_by_default(api, server):
+    assert not server.SKETCHES_ENABLED
+    api.post('/api/bypass-log', json=_log_body(1))
+    assert api.get('/api/bypass-stats').json()['approximate'] is None
+
+
+def test_history_is_rebuilt_in_the_background(sketch_server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    server = sketch_server
+    rebuild = sketches.rebuild
+    release = asyncio.Event()
+
+    async def slow_rebuild(logs, target, end=None, batch_size=5000):
+        await release.wait()
+        await rebuild(logs, target, end, batch_size)
+
+    monkeypatch.setattr(sketches, 'rebuild', slow_rebuild)
+    history = [{**_log(index), 'timestamp': datetime.utcnow() - timedelta(minutes=1)} for index in range(5)]
+    asyncio.run(server.repositories.logs.insert_many(history))
+    with TestClient(server.app) as api:
+        # Startup didn't wait for the rebuild, and partial counts aren't reported
+        api.post('/api/bypass-log', json=_log_body(1))
+        assert api.get('/api/bypass-stats').json()['approximate'] is None
+
+        async def finish():
+            release.set()
+            await server.sketch_rebuild_task
+
+        api.portal.call(finish)
+        assert api.get('/api/bypass-stats').json()['approximate']['events'] == 6
+    assert sketches.load(server.SKETCH_PATH).events == 6
+
+
+def test_a_failed_rebuild_is_neither_reported_nor_saved(sketch_server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    server = sketch_server
+
+    async def broken_rebuild(logs, target, end=None, batch_size=5000):
+        target.add_logs([_log(1)])
+        raise RuntimeError("cursor killed")
+
+    monkeypatch.setattr(sketches, 'rebuild', broken_rebuild)
+    with TestClient(server.app) as api:
+        api.portal.call(lambda: asyncio.wait([server.sketch_rebuild_task]))
+        assert api.get('/api/bypass-stats').json()['approximate'] is None
+    assert sketches.load(server.SKETCH_PATH) is None
+
+
+def test_saved_sketches_are_loaded(sketch_server):
+    from fastapi.testclient import TestClient
+
+    server = sketch_server
+    saved = sketches.TrafficSketches()
+    saved.add_logs([_log(index) for index in range(3)])
+    sketches.save(server.SKETCH_PATH, saved.to_json())
+    with TestClient(server.app) as api:
+        assert server.sketch_rebuild_task is None
+        api.post('/api/bypass-log', json=_log_body(1))
+        assert api.get('/api/bypass-stats').json()['approximate']['events'] == 4
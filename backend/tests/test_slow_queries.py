@@ -0,0 +1,110 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from slow_queries import RateLimiter, SlowQueryLog, command_shape, query_shape
+
+pytestmark = pytest.mark.anyio
+
+AGGREGATE = {
+    'aggregate': 'bypass_logs',
+    'pipeline': [{'$match': {'domain': {'$in': ['a.fr', 'b.fr']}}}, {'$group': {'_id': '$domain', 'n': {'$sum': 1}}}],
+    'cursor': {},
+    'lsid': {'id': 'session'},
+    '$db': 'test',
+}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ExplainingClient:
+    def __init__(self):
+        self.commands = []
+
+    def __getitem__(self, name):
+        return self
+
+    async def command(self, command):
+        self.commands.append(command)
+        return {'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}}, 'ok': 1}
+
+
+def _run(log, name, command, duration_ms, request_id=1):
+    event = SimpleNamespace(
+        command_name=name, command=command, database_name='test', request_id=request_id, operation_id=request_id,
+        duration_micros=int(duration_ms * 1000),
+    )
+    log.started(event)
+    log.succeeded(event)
+
+
+def test_query_shapes_hide_literals():
+    assert query_shape({'domain': 'a.fr', 'timestamp': {'$gte': 5}, 'path': '$domain', 'tags': [1, 2]}) == \
+        {'domain': '?', 'timestamp': {'$gte': '?'}, 'path': '$domain', 'tags': '?'}
+    assert command_shape('aggregate', AGGREGATE) == {
+        'command': 'aggregate', 'collection': 'bypass_logs', 'cursor': {},
+        'pipeline': [{'$match': {'domain': {'$in': '?'}}}, {'$group': {'_id': '$domain', 'n': {'$sum': '?'}}}],
+    }
+    assert command_shape('insert', {'insert': 'bypass_logs', 'documents': [{}, {}], 'ordered': False}) == \
+        {'command': 'insert', 'collection': 'bypass_logs', 'documents': 2, 'ordered': '?'}
+
+
+def test_rate_limiter_refills_over_time():
+    clock = Clock()
+    limiter = RateLimiter(2, clock=clock)
+    assert [limiter.allow() for _ in range(3)] == [True, True, False]
+    clock.now = 30
+    assert [limiter.allow() for _ in range(2)] == [True, False]
+
+
+def test_only_slow_commands_are_recorded():
+    log = SlowQueryLog(threshold_ms=50)
+    _run(log, 'aggregate', AGGREGATE, 10, request_id=1)
+    _run(log, 'aggregate', AGGREGATE, 80, request_id=2)
+    [entry] = log.entries
+    assert (entry['duration_ms'], entry['database'], entry['failed']) == (80, 'test', False)
+    assert entry['shape'] == command_shape('aggregate', AGGREGATE)
+    assert log._pending == {}
+
+
+def test_records_are_rate_limited():
+    log = SlowQueryLog(threshold_ms=0, max_per_minute=3)
+    for request_id in range(5):
+        _run(log, 'find', {'find': 'site_configs', 'filter': {'domain': 'a.fr'}}, 1, request_id)
+    assert (len(log.entries), log.suppressed) == (3, 2)
+    assert len({entry['shape_id'] for entry in log.entries}) == 1
+
+
+async def test_slow_reads_are_explained_once_per_shape():
+    client = ExplainingClient()
+    log = SlowQueryLog(threshold_ms=0, explain=True)
+    log.start(client, asyncio.get_running_loop())
+    _run(log, 'aggregate', AGGREGATE, 5, request_id=1)
+    _run(log, 'aggregate', AGGREGATE, 5, request_id=2)
+    _run(log, 'insert', {'insert': 'bypass_logs', 'documents': [{}]}, 5, request_id=3)
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert client.commands == [{
+        'explain': {key: value for key, value in AGGREGATE.items() if key not in ('lsid', '$db')},
+        'verbosity': 'queryPlanner',
+    }]
+    assert log.entries[0]['explain'] == {'winningPlan': {'stage': 'COLLSCAN'}}
+    assert 'explain' not in log.entries[1]
+
+
+def test_explain_is_off_until_started():
+    log = SlowQueryLog(threshold_ms=0, explain=True)
+    assert not log._should_explain('find', 'shape')
+
+
+def test_slow_query_endpoint(api):
+    response = api.get('/api/db/slow-queries')
+    assert response.status_code == 200
+    assert {'suppressed', 'queries'} <= set(response.json())
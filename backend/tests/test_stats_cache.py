@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from stats_cache import CoalescingCache
+
+pytestmark = pytest.mark.anyio
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Loader:
+    """A loader that counts its calls and waits until released"""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.fail = False
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("aggregation failed")
+        return self.calls
+
+
+async def test_concurrent_misses_share_one_computation():
+    cache = CoalescingCache(ttl=5)
+    loader = Loader()
+    readers = [asyncio.create_task(cache.get('popup', loader)) for _ in range(10)]
+    await asyncio.sleep(0)
+    loader.release.set()
+    assert await asyncio.gather(*readers) == [1] * 10
+    assert loader.calls == 1
+    metrics = cache.metrics()
+    assert (metrics['misses'], metrics['coalesced'], metrics['refreshes']) == (10, 9, 1)
+
+
+async def test_fresh_values_are_served_until_the_ttl():
+    clock = Clock()
+    cache = CoalescingCache(ttl=5, stale_ttl=0, clock=clock)
+    loader = Loader()
+    loader.release.set()
+    assert await cache.get('popup', loader) == 1
+    clock.now = 4.9
+    assert await cache.get('popup', loader) == 1
+    clock.now = 5
+    assert await cache.get('popup', loader) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+async def test_stale_values_are_served_while_one_refresh_runs():
+    clock = Clock()
+    cache = CoalescingCache(ttl=5, stale_ttl=30, clock=clock)
+    loader = Loader()
+    loader.release.set()
+    await cache.get('popup', loader)
+    loader.release.clear()
+    clock.now = 10
+    # Readers never wait on the refresh, and only one is started
+    assert [await cache.get('popup', loader) for _ in range(3)] == [1, 1, 1]
+    await asyncio.sleep(0)
+    assert (loader.calls, cache.stale_hits) == (2, 3)
+    loader.release.set()
+    await asyncio.sleep(0)
+    assert await cache.get('popup', loader) == 2
+    assert cache.hits == 1
+
+
+async def test_values_past_the_stale_window_are_recomputed():
+    clock = Clock()
+    cache = CoalescingCache(ttl=5, stale_ttl=10, clock=clock)
+    loader = Loader()
+    loader.release.set()
+    await cache.get('popup', loader)
+    clock.now = 15
+    assert await cache.get('popup', loader) == 2
+    assert cache.stale_hits == 0
+
+
+async def test_failures_reach_waiting_readers_and_keep_the_stale_value():
+    clock = Clock()
+    cache = CoalescingCache(ttl=5, stale_ttl=30, clock=clock)
+    loader = Loader()
+    loader.fail = True
+    loader.release.set()
+    with pytest.raises(RuntimeError):
+        await cache.get('popup', loader)
+    assert cache.refresh_errors == 1
+
+    loader.fail = False
+    await cache.get('popup', loader)
+    clock.now = 10
+    loader.fail = True
+    assert await cache.get('popup', loader) == 2
+    await asyncio.sleep(0)
+    assert await cache.get('popup', loader) == 2
+    assert cache.refresh_errors == 2
+
+
+async def test_a_cancelled_reader_does_not_cancel_the_computation():
+    cache = CoalescingCache()
+    loader = Loader()
+    first = asyncio.create_task(cache.get('popup', loader))
+    second = asyncio.create_task(cache.get('popup', loader))
+    await asyncio.sleep(0)
+    first.cancel()
+    loader.release.set()
+    assert await second == 1
+    assert first.cancelled()
+
+
+async def test_invalidate_one_or_all():
+    cache = CoalescingCache()
+    loader = Loader()
+    loader.release.set()
+    await cache.get('a', loader)
+    await cache.get('b', loader)
+    cache.invalidate('a')
+    assert cache.metrics()['entries'] == 1
+    cache.invalidate()
+    assert cache.metrics()['entries'] == 0
+
+
+def test_stats_endpoint_and_cache_metrics(api, server, monkeypatch):
+    monkeypatch.setattr(server.stats_cache, 'ttl', 60)
+    before = api.get('/api/bypass-stats/cache').json()
+    api.post('/api/bypass-log', json={'action': 'header_modified', 'domain': 'a.fr', 'url': 'https://a.fr/1'})
+    assert api.get('/api/bypass-stats').json()['total_bypasses'] == 1
+    api.post('/api/bypass-log', json={'action': 'header_modified', 'domain': 'a.fr', 'url': 'https://a.fr/2'})
+    assert api.get('/api/bypass-stats').json()['total_bypasses'] == 1
+    metrics = api.get('/api/bypass-stats/cache').json()
+    assert (metrics['hits'] - before['hits'], metrics['misses'] - before['misses']) == (1, 1)
+    assert metrics['refreshes'] == before['refreshes'] + 1
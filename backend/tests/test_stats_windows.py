@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import stats_engine
+
+# A Wednesday
+NOW = datetime(2026, 10, 14, 15, 30)
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('all', (None, None)),
+    ('today', (datetime(2026, 10, 14), None)),
+    ('week', (datetime(2026, 10, 12), None)),
+    ('month', (datetime(2026, 10, 1), None)),
+])
+def test_named_windows(name, expected):
+    assert stats_engine.resolve_window(name, NOW) == expected
+
+
+def test_custom_window_bounds_become_naive_utc():
+    paris = timezone(timedelta(hours=2))
+    start, end = stats_engine.resolve_window(
+        'custom', NOW, datetime(2026, 1, 1, tzinfo=timezone.utc), datetime(2026, 12, 1, 2, 0, tzinfo=paris)
+    )
+    assert (start, end) == (datetime(2026, 1, 1), datetime(2026, 12, 1))
+    assert stats_engine.resolve_window('custom', NOW, None, datetime(2026, 1, 1, 1, tzinfo=paris)) == (None, datetime(2025, 12, 31, 23))
+
+
+def test_mixed_aware_and_naive_bounds_are_compared_in_utc():
+    start = datetime(2026, 1, 1, 1, 0, tzinfo=timezone(timedelta(hours=2)))
+    assert stats_engine.resolve_window('custom', NOW, start, datetime(2025, 12, 31, 23, 30))[0] == datetime(2025, 12, 31, 23)
+    with pytest.raises(ValueError):
+        stats_engine.resolve_window('custom', NOW, start, datetime(2025, 12, 31, 22, 30))
+
+
+@pytest.mark.parametrize('name, start, end', [
+    ('custom', None, None),
+    ('custom', datetime(2026, 2, 1), datetime(2026, 1, 1)),
+    ('fortnight', None, None),
+])
+def test_invalid_windows(name, start, end):
+    with pytest.raises(ValueError):
+        stats_engine.resolve_window(name, NOW, start, end)
+
+
+def test_register_window():
+    stats_engine.register_window('test_hour')(lambda now: (now - timedelta(hours=1), now))
+    try:
+        assert stats_engine.resolve_window('test_hour', NOW) == (NOW - timedelta(hours=1), NOW)
+    finally:
+        del stats_engine.WINDOWS['test_hour']
+
+
+def test_window_stats_endpoint(api):
+    api.post('/api/bypass-log', json={'action': 'header_modified', 'domain': 'a.fr', 'url': 'https://a.fr/1'})
+    response = api.get('/api/bypass-stats/window', params={
+        'window': 'custom', 'start': '2026-01-01T00:00:00Z', 'end': '2999-12-01T00:00:00',
+    })
+    assert response.status_code == 200
+    assert response.json()['total_bypasses'] == 1
+    assert api.get('/api/bypass-stats/window', params={'window': 'custom'}).status_code == 400
+    assert api.get('/api/bypass-stats/window', params={
+        'window': 'custom', 'start': '2026-06-01T00:00:00+02:00', 'end': '2026-05-31T21:00:00',
+    }).status_code == 400
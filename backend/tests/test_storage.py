@@ -0,0 +1,200 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+import storage
+from log_buffer import LogWriteBuffer
+from log_codec import PLAIN_CODEC
+from partitions import LogPartitions
+
+pytestmark = pytest.mark.anyio
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NOW = datetime(2026, 10, 18, 12, 0)
+
+
+def _logs():
+    return [
+        {
+            'id': f"log{index}", 'action': 'header_modified', 'domain': 'a.fr' if index % 3 else 'b.fr',
+            'url': f"https://a.fr/{index}", 'timestamp': NOW - timedelta(days=index), 'user_agent': None,
+            'success': index != 1,
+        }
+        for index in range(10)
+    ]
+
+
+@pytest.fixture(params=storage.BACKENDS)
+async def repositories(request, db, tmp_path):
+    if request.param == 'mongodb':
+        partitions = LogPartitions(db)
+        yield storage.Storage(
+            storage.MongoLogRepository(db, db, partitions.writer, partitions, PLAIN_CODEC, stats_source='raw'),
+            storage.MongoSiteConfigRepository(db, db),
+            storage.MongoStatusCheckRepository(db),
+        )
+        return
+    if request.param == 'duckdb':
+        pytest.importorskip('duckdb')
+    repositories = storage.open_embedded(request.param, str(tmp_path / f"bypass.{request.param}"))
+    await repositories.open()
+    yield repositories
+    await repositories.close()
+
+
+async def test_log_stats(repositories):
+    await repositories.logs.insert_many(_logs())
+    stats = await repositories.logs.stats(NOW + timedelta(hours=1))
+    assert (stats['total_bypasses'], stats['bypasses_today'], stats['bypasses_this_week']) == (10, 1, 7)
+    assert stats['success_rate'] == 90.0
+    assert stats['most_bypassed_sites'] == [{'domain': 'a.fr', 'count': 6}, {'domain': 'b.fr', 'count': 4}]
+
+    window = await repositories.logs.window_stats(NOW - timedelta(days=3), NOW, top_sites=1)
+    assert (window['total_bypasses'], window['most_bypassed_sites']) == (3, [{'domain': 'a.fr', 'count': 2}])
+
+
+async def test_log_batches_and_export(repositories):
+    await repositories.logs.insert_one(_logs()[0])
+    await repositories.logs.insert_many(_logs()[1:4])
+    batches = [batch async for batch in repositories.logs.batches(NOW - timedelta(days=2), None, ['id', 'timestamp'], 2)]
+    assert batches == [
+        [{'id': 'log2', 'timestamp': NOW - timedelta(days=2)}, {'id': 'log1', 'timestamp': NOW - timedelta(days=1)}],
+        [{'id': 'log0', 'timestamp': NOW}],
+    ]
+    chunks = repositories.logs.export_chunks(None, None, 'ndjson', ['id', 'success'], 10)
+    lines = b''.join([chunk async for chunk in chunks]).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'id': f"log{index}", 'success': index != 1} for index in (3, 2, 1, 0)
+    ]
+    with pytest.raises(ValueError):
+        repositories.logs.export_chunks(None, None, 'csv', None, 10)
+
+
+async def test_site_configs(repositories):
+    site_configs = repositories.site_configs
+    for domain in ('c.fr', 'a.fr', 'b.fr'):
+        await site_configs.upsert({'domain': domain, 'name': domain.upper(), 'methods': {'headers': True}})
+    config = await site_configs.get('a.fr')
+    assert (config['name'], config['methods'], config['version']) == ('A.FR', {'headers': True}, 2)
+    assert await site_configs.get('missing.fr') is None
+
+    page, cursor = await site_configs.page(2)
+    assert [config['domain'] for config in page] == ['a.fr', 'b.fr']
+    rest = [json.loads(line) async for line in site_configs.stream(cursor)]
+    assert [config['domain'] for config in rest] == ['c.fr']
+
+
+async def test_status_checks(repositories):
+    for index in range(3):
+        await repositories.status_checks.insert(
+            {'id': f"check{index}", 'client_name': f"client{index}", 'timestamp': NOW + timedelta(minutes=index)}
+        )
+    page, cursor = await repositories.status_checks.page(2)
+    assert [check['client_name'] for check in page] == ['client0', 'client1']
+    assert page[0]['timestamp'] == NOW
+    rest = [json.loads(line) async for line in repositories.status_checks.stream(cursor)]
+    assert [check['id'] for check in rest] == ['check2']
+    with pytest.raises(ValueError):
+        repositories.status_checks.stream('garbage')
+
+
+@pytest.fixture(params=['sqlite', 'duckdb'])
+async def embedded(request, tmp_path):
+    if request.param == 'duckdb':
+        pytest.importorskip('duckdb')
+    repositories = storage.open_embedded(request.param, str(tmp_path / f"bypass.{request.param}"))
+    await repositories.open()
+    yield repositories
+    await repositories.close()
+
+
+async def test_rejected_rows_are_reported_like_duplicate_keys(embedded):
+    logs = _logs()[:3]
+    # A NOT NULL violation on both engines (only SQLite has a key on the logs)
+    logs[1]['domain'] = None
+    with pytest.raises(BulkWriteError) as raised:
+        await embedded.logs.insert_many(logs)
+    assert raised.value.details['nInserted'] == 2
+    [error] = raised.value.details['writeErrors']
+    assert (error['index'], error['code']) == (1, 11000)
+
+
+async def test_transient_row_failures_are_left_retryable(embedded, monkeypatch):
+    insert_log_rows = embedded.insert_log_rows
+
+    def flaky(rows):
+        if any(row[0] == 'log1' for row in rows):
+            raise OSError("database is locked")
+        insert_log_rows(rows)
+
+    monkeypatch.setattr(embedded, 'insert_log_rows', flaky)
+    with pytest.raises(BulkWriteError) as raised:
+        await embedded.logs.insert_many(_logs()[:3])
+    assert raised.value.details['writeErrors'] == [{'index': 1, 'errmsg': "database is locked"}]
+
+    # The write-behind buffer retries it instead of dropping it as a duplicate
+    buffer = LogWriteBuffer(embedded.logs, retry_backoff=0)
+
+    async def recover(seconds):
+        monkeypatch.setattr(embedded, 'insert_log_rows', insert_log_rows)
+
+    monkeypatch.setattr(asyncio, 'sleep', recover)
+    await buffer._flush(_logs()[3:6] + [_logs()[1]])
+    assert (buffer.retries, buffer.flushed_documents, buffer.dropped_documents) == (1, 4, 0)
+
+
+def test_repositories_must_implement_every_operation():
+    class Partial(storage.StatusCheckRepository):
+        async def insert(self, document):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()
+
+    class Unconnected(storage.SQLStorage):
+        def is_constraint_error(self, error):
+            return False
+
+    with pytest.raises(TypeError):
+        Unconnected(':memory:')
+
+
+@pytest.mark.parametrize('options', [
+    {'log_partitioning': 'day'},
+    {'log_encoding': 'compact'},
+    {'stats_source': 'rollups'},
+])
+def test_mongodb_only_options_are_refused(options):
+    with pytest.raises(ValueError) as raised:
+        storage.check_embedded_options(**options)
+    assert "MongoDB only" in str(raised.value)
+    storage.check_embedded_options()
+
+
+def _import_server(tmp_path, **env):
+    environment = {
+        **os.environ, 'MONGO_URL': 'memory://', 'STORAGE_BACKEND': 'sqlite',
+        'STORAGE_PATH': str(tmp_path / 'bypass.sqlite'), **env,
+    }
+    return subprocess.run(
+        [sys.executable, '-c', 'import server; print(server.STATS_SOURCE)'],
+        cwd=BACKEND_DIR, env=environment, capture_output=True, text=True,
+    )
+
+
+def test_the_server_starts_embedded_with_raw_stats(tmp_path):
+    result = _import_server(tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == 'raw'
+
+
+def test_the_server_refuses_mongodb_only_options_when_embedded(tmp_path):
+    result = _import_server(tmp_path, LOG_PARTITIONING='month', STATS_SOURCE='rollups')
+    assert result.returncode != 0
+    assert "LOG_PARTITIONING=month, STATS_SOURCE=rollups" in result.stderr
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+import tracing
+
+pytestmark = pytest.mark.anyio
+
+
+def _trace(tracer):
+    root = tracer.start_trace('GET /test')
+    token = tracing._current_span.set(root)
+    return root, token
+
+
+async def test_operations_record_child_spans(db):
+    tracer = tracing.Tracer(tracing.MemoryExporter(), sample_rate=1)
+    traced = tracing.TracedDatabase(db)
+    root, token = _trace(tracer)
+    try:
+        await traced.bypass_logs.insert_many([{'domain': 'a.fr'}, {'domain': 'b.fr'}])
+        await traced['bypass_logs'].count_documents({})
+        assert len(await traced.bypass_logs.find().sort('domain', 1).limit(5).to_list(None)) == 2
+        assert [document async for document in traced.bypass_logs.aggregate([{'$match': {'domain': 'a.fr'}}])]
+        await traced.bypass_logs.find_one({'domain': 'missing'})
+    finally:
+        tracing._current_span.reset(token)
+    tracer.finish_trace(root)
+
+    [spans] = tracer.exporter.traces
+    assert [(span['name'], span['attributes']) for span in spans[1:]] == [
+        ('insert_many', {'collection': 'bypass_logs', 'documents': 2}),
+        ('count_documents', {'collection': 'bypass_logs', 'documents': 2}),
+        ('find', {'collection': 'bypass_logs', 'documents': 2}),
+        ('aggregate', {'collection': 'bypass_logs', 'documents': 1}),
+        ('find_one', {'collection': 'bypass_logs', 'documents': 0}),
+    ]
+    assert {span['trace_id'] for span in spans} == {root.trace_id}
+    assert all(span['parent_id'] == root.span_id and span['duration_ms'] is not None for span in spans[1:])
+
+
+async def test_operations_outside_a_trace_are_not_recorded(db):
+    traced = tracing.TracedDatabase(db)
+    await traced.bypass_logs.insert_one({'domain': 'a.fr'})
+    assert await traced.bypass_logs.count_documents({}) == 1
+    assert traced.name == db.name
+
+
+async def test_spans_per_trace_are_bounded(db, monkeypatch):
+    monkeypatch.setattr(tracing, 'MAX_SPANS_PER_TRACE', 3)
+    tracer = tracing.Tracer(tracing.MemoryExporter(), sample_rate=1)
+    traced = tracing.TracedDatabase(db)
+    root, token = _trace(tracer)
+    try:
+        for _ in range(5):
+            await traced.bypass_logs.count_documents({})
+    finally:
+        tracing._current_span.reset(token)
+    assert len(root.children) == 3
+
+
+def test_sampling():
+    assert tracing.Tracer(tracing.MemoryExporter(), sample_rate=0).start_trace('GET /') is None
+    assert tracing.Tracer(tracing.MemoryExporter(), sample_rate=1).start_trace('GET /') is not None
+
+
+def test_exporters(tmp_path, monkeypatch):
+    path = tmp_path / 'traces.ndjson'
+    tracer = tracing.Tracer(tracing.FileExporter(str(path)), sample_rate=1)
+    root = tracer.start_trace('GET /')
+    tracer.finish_trace(root)
+    tracer.exporter.flush()
+    assert json.loads(path.read_text())['trace_id'] == root.trace_id
+
+    class Broken:
+        def export(self, spans):
+            raise OSError("disk full")
+
+    tracing.Tracer(Broken(), sample_rate=1).finish_trace(root)
+    # Write errors happen on the exporter's thread: logged, never raised into the request
+    unwritable = tracing.FileExporter(str(tmp_path / 'missing' / 'traces.ndjson'))
+    unwritable.export([root])
+    unwritable.flush()
+
+    monkeypatch.setenv('TRACING_EXPORTER', 'file')
+    assert isinstance(tracing.exporter_from_env(), tracing.FileExporter)
+    monkeypatch.setenv('TRACING_EXPORTER', 'zipkin')
+    with pytest.raises(ValueError):
+        tracing.exporter_from_env()
+
+
+def test_middleware_traces_sampled_requests(db):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    tracer = tracing.Tracer(tracing.MemoryExporter(), sample_rate=1)
+    traced = tracing.TracedDatabase(db)
+    app = FastAPI()
+
+    @app.get('/count/{domain}')
+    async def count(domain: str):
+        return {'count': await traced.bypass_logs.count_documents({'domain': domain})}
+
+    app.add_middleware(tracing.TracingMiddleware, tracer=tracer)
+    with TestClient(app) as client:
+        response = client.get('/count/a.fr')
+    [spans] = tracer.exporter.traces
+    assert response.headers['x-trace-id'] == spans[0]['trace_id']
+    assert spans[0]['attributes'] == {'status': 200, 'route': '/count/{domain}'}
+    assert [span['name'] for span in spans[1:]] == ['count_documents']
@@ -0,0 +1,278 @@
+"""Opt-in request tracing with child spans around MongoDB calls.
+
+``TracingMiddleware`` opens a root span for a sampled fraction of requests
+and keeps it in a context variable. ``TracedDatabase`` wraps the Motor
+database so every collection operation awaited while a trace is active is
+recorded as a child span with its command name, collection, duration and
+number of documents. Unsampled requests only pay for one ``random()`` call
+and a context variable lookup per operation.
+
+Finished traces are handed to an exporter: ``MemoryExporter`` keeps the
+most recent ones for inspection, ``FileExporter`` appends them as NDJSON
+from a background thread, and anything with a non-blocking
+``export(spans)`` method can be plugged in.
+"""
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "duration", "attributes", "children")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.attributes: Dict[str, Any] = {}
+        # Only the root span collects the spans of its trace
+        self.children: List["Span"] = []
+
+    def finish(self):
+        self.duration = time.time() - self.start
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "attributes": self.attributes,
+        }
+
+
+class MemoryExporter:
+    def __init__(self, max_traces: int = 100):
+        self.traces = deque(maxlen=max_traces)
+
+    def export(self, spans: List[Span]):
+        self.traces.append([span.to_dict() for span in spans])
+
+
+class FileExporter:
+    def __init__(self, path: str):
+        self.path = path
+        # A single writer keeps traces in order and off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-export")
+
+    def export(self, spans: List[Span]):
+        lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+        self._executor.submit(self._append, lines)
+
+    def _append(self, lines: str):
+        try:
+            with open(self.path, "a") as f:
+                f.write(lines)
+        except OSError as e:
+            logger.error(f"Failed to write traces to {self.path}: {e}")
+
+    def flush(self):
+        """Wait until every exported trace is written"""
+        self._executor.submit(lambda: None).result()
+
+
+class Tracer:
+    def __init__(self, exporter, sample_rate: float = 0.01):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def start_trace(self, name: str) -> Optional[Span]:
+        if random.random() >= self.sample_rate:
+            return None
+        return Span(name, uuid.uuid4().hex)
+
+    def finish_trace(self, root: Span):
+        root.finish()
+        try:
+            self.exporter.export([root] + root.children)
+        except Exception as e:
+            logger.error(f"Failed to export trace {root.trace_id}: {e}")
+
+
+def exporter_from_env():
+    kind = os.environ.get("TRACING_EXPORTER", "memory")
+    if kind == "memory":
+        return MemoryExporter(int(os.environ.get("TRACING_MEMORY_TRACES", "100")))
+    if kind == "file":
+        return FileExporter(os.environ.get("TRACING_FILE", "traces.ndjson"))
+    raise ValueError(f"Unknown tracing exporter '{kind}' (expected memory or file)")
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a root span for sampled HTTP requests"""
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        root = self.tracer.start_trace(f"{scope.get('method', '')} {scope.get('path', '')}") \
+            if scope["type"] == "http" else None
+        if root is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                root.attributes["status"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", root.trace_id.encode())]
+            await send(message)
+
+        token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            _current_span.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                root.attributes["route"] = route.path
+            self.tracer.finish_trace(root)
+
+
+# Bounds the memory of a trace around e.g. a long export
+MAX_SPANS_PER_TRACE = 1000
+
+
+def _start_child(name: str, collection: str) -> Optional[Span]:
+    root = _current_span.get()
+    if root is None or len(root.children) >= MAX_SPANS_PER_TRACE:
+        return None
+    span = Span(name, root.trace_id, root.span_id)
+    span.attributes["collection"] = collection
+    root.children.append(span)
+    return span
+
+
+def _document_count(result: Any) -> Optional[int]:
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict):
+        return 1
+    if isinstance(result, int):
+        return result
+    for attribute in ("inserted_ids", "modified_count", "deleted_count", "inserted_count"):
+        value = getattr(result, attribute, None)
+        if value is not None:
+            return len(value) if isinstance(value, list) else value
+    if getattr(result, "inserted_id", None) is not None:
+        return 1
+    return None
+
+
+class TracedCursor:
+    """Cursor wrapper recording one span from the first fetch to exhaustion"""
+
+    def __init__(self, cursor, name: str, collection: str):
+        self._cursor = cursor
+        self._name = name
+        self._collection = collection
+
+    def __getattr__(self, attribute):
+        value = getattr(self._cursor, attribute)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            result = value(*args, **kwargs)
+            # Builder methods (sort, limit, batch_size, ...) return the cursor itself
+            return self if result is self._cursor else result
+        return call
+
+    async def to_list(self, length=None):
+        span = _start_child(self._name, self._collection)
+        try:
+            documents = await self._cursor.to_list(length)
+        finally:
+            if span is not None:
+                span.finish()
+        if span is not None:
+            span.attributes["documents"] = len(documents)
+        return documents
+
+    async def __aiter__(self):
+        span = _start_child(self._name, self._collection)
+        count = 0
+        try:
+            async for document in self._cursor:
+                count += 1
+                yield document
+        finally:
+            if span is not None:
+                span.finish()
+                span.attributes["documents"] = count
+
+
+class TracedCollection:
+    CURSOR_METHODS = ("find", "aggregate", "list_indexes")
+    # Methods returning something other than an awaitable, passed through untraced
+    SYNC_METHODS = ("watch", "find_raw_batches", "aggregate_raw_batches", "get_io_loop", "wrap")
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, attribute):
+        value = getattr(self._collection, attribute)
+        if attribute in self.CURSOR_METHODS:
+            def cursor(*args, **kwargs):
+                return TracedCursor(value(*args, **kwargs), attribute, self._collection.name)
+            return cursor
+        if attribute == "with_options":
+            return lambda *args, **kwargs: TracedCollection(value(*args, **kwargs))
+        if not callable(value) or attribute.startswith("_") or attribute in self.SYNC_METHODS:
+            return value
+
+        async def operation(*args, **kwargs):
+            span = _start_child(attribute, self._collection.name)
+            if span is None:
+                return await value(*args, **kwargs)
+            try:
+                result = await value(*args, **kwargs)
+            finally:
+                span.finish()
+            documents = _document_count(result)
+            if documents is not None:
+                span.attributes["documents"] = documents
+            return result
+        return operation
+
+    def __getitem__(self, name):
+        return TracedCollection(self._collection[name])
+
+
+class TracedDatabase:
+    """Database wrapper whose collections record spans"""
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, attribute):
+        value = getattr(self._db, attribute)
+        if attribute == "with_options":
+            return lambda *args, **kwargs: TracedDatabase(value(*args, **kwargs))
+        # Attribute access on a database is how collections are reached (db.site_configs)
+        if not attribute.startswith("_") and hasattr(value, "find_one"):
+            return TracedCollection(value)
+        return value
+
+    def __getitem__(self, name):
+        return TracedCollection(self._db[name])